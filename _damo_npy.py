@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+"""
+Write and read arrays in the NumPy .npy format, without NumPy.
+
+Only one dimensional little endian arrays of the types that the monitoring
+results use are supported.  The data of each array is aligned in the file,
+so that the files can be memory-mapped by 'numpy.load(mmap_mode='r')'.
+"""
+
+import array
+import ast
+import mmap
+import struct
+import sys
+
+npy_magic = b'\x93NUMPY'
+npy_version = b'\x01\x00'
+# alignment of the data, as NumPy does
+npy_align = 64
+
+# array typecode to numpy dtype
+dtype_of_typecode = {'q': '<i8', 'Q': '<u8', 'd': '<f8'}
+typecode_of_dtype = {v: k for k, v in dtype_of_typecode.items()}
+
+def npy_bytes(arr):
+    'Returns the .npy format bytes of an array.array'
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (
+            dtype_of_typecode[arr.typecode], len(arr))
+    head_len = len(npy_magic) + len(npy_version) + 2 + len(header) + 1
+    header += ' ' * (-head_len % npy_align) + '\n'
+    if sys.byteorder != 'little':
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return b''.join([npy_magic, npy_version,
+        struct.pack('<H', len(header)), header.encode(), arr.tobytes()])
+
+def write_npy(path, arr):
+    with open(path, 'wb') as f:
+        f.write(npy_bytes(arr))
+
+def parse_npy_header(buf):
+    '''Returns the array.array typecode, the number of the items, and the
+    offset of the data of the .npy format bytes'''
+    if buf[:len(npy_magic)] != npy_magic:
+        raise ValueError('not a npy file')
+    major = buf[len(npy_magic)]
+    offset = len(npy_magic) + len(npy_version)
+    if major == 1:
+        header_len = struct.unpack_from('<H', buf, offset)[0]
+        offset += 2
+    else:
+        header_len = struct.unpack_from('<I', buf, offset)[0]
+        offset += 4
+    header = ast.literal_eval(bytes(buf[offset:offset + header_len]).decode())
+    offset += header_len
+    if (not header['descr'] in typecode_of_dtype or header['fortran_order']
+            or len(header['shape']) != 1):
+        raise ValueError('unsupported npy array (%s)' % header)
+    return typecode_of_dtype[header['descr']], header['shape'][0], offset
+
+def parse_npy(buf):
+    'Returns the array.array in the .npy format bytes'
+    typecode, nr_items, offset = parse_npy_header(buf)
+    arr = array.array(typecode)
+    arr.frombytes(buf[offset:offset + nr_items * arr.itemsize])
+    if len(arr) != nr_items:
+        raise ValueError('truncated npy file')
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr
+
+def view_npy(buf):
+    '''Returns a memoryview of the array in the .npy format bytes-like
+    object, without copying the data.  On big endian machines, the data is
+    copied to an array.array instead'''
+    if sys.byteorder != 'little':
+        return parse_npy(buf)
+    typecode, nr_items, offset = parse_npy_header(buf)
+    size = nr_items * array.array(typecode).itemsize
+    if len(buf) < offset + size:
+        raise ValueError('truncated npy file')
+    return memoryview(buf)[offset:offset + size].cast(typecode)
+
+def to_array(arr):
+    '''Returns an array.array of the items of a memoryview that returned by
+    view_npy().  An array.array is returned as is'''
+    if isinstance(arr, array.array):
+        return arr
+    copied = array.array(arr.format)
+    copied.frombytes(arr.cast('B'))
+    return copied
+
+def read_npy(path):
+    with open(path, 'rb') as f:
+        return parse_npy(f.read())
+
+def mmap_npy(path):
+    '''Memory-maps a .npy file and returns a memoryview of the array'''
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return view_npy(buf)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+"""
+Read tracepoint samples from perf.data files that made by 'perf record',
+without the 'perf' program.
+"""
+
+import heapq
+import struct
+
+perf_magic = b'PERFILE2'
+
+# perf_event_attr.type of tracepoint events
+perf_type_tracepoint = 2
+
+# perf_event_header.type
+record_type_sample = 9
+record_type_finished_round = 68
+record_type_compressed = 81
+
+# perf_event_attr.sample_type bits
+sample_ip = 1 << 0
+sample_tid = 1 << 1
+sample_time = 1 << 2
+sample_addr = 1 << 3
+sample_read = 1 << 4
+sample_callchain = 1 << 5
+sample_id = 1 << 6
+sample_cpu = 1 << 7
+sample_period = 1 << 8
+sample_stream_id = 1 << 9
+sample_raw = 1 << 10
+sample_identifier = 1 << 16
+
+# perf_event_attr.read_format bits
+read_format_total_time_enabled = 1 << 0
+read_format_total_time_running = 1 << 1
+read_format_id = 1 << 2
+read_format_group = 1 << 3
+read_format_lost = 1 << 4
+
+# feature bit of the tracing data (format of the tracepoints) section
+feature_tracing_data = 1
+
+class PerfEventAttr:
+    type_ = None
+    config = None
+    sample_type = None
+    read_format = None
+    ids = None
+
+    def __init__(self, type_, config, sample_type, read_format, ids):
+        self.type_ = type_
+        self.config = config
+        self.sample_type = sample_type
+        self.read_format = read_format
+        self.ids = ids
+
+class TracepointField:
+    offset = None
+    size = None
+    signed = None
+
+    def __init__(self, offset, size, signed):
+        self.offset = offset
+        self.size = size
+        self.signed = signed
+
+class PerfData:
+    path = None
+    endian = None
+    attrs = None
+    data_offset = None
+    data_size = None
+    recording = False
+    tracing_data = None
+
+    def __init__(self, path):
+        self.path = path
+        self.attrs = []
+
+    def tracepoint_format(self, name):
+        '''Returns the id and the fields of the tracepoint of the given name,
+        as written in the tracing data of the file'''
+        if not self.tracing_data:
+            return None, None
+        idx = self.tracing_data.find(b'name: %s\n' % name.encode())
+        if idx == -1:
+            return None, None
+        end = self.tracing_data.find(b'print fmt:', idx)
+        if end == -1:
+            return None, None
+        tp_id = None
+        fields = {}
+        for line in self.tracing_data[idx:end].decode().split('\n'):
+            line = line.strip()
+            if line.startswith('ID:'):
+                tp_id = int(line.split(':')[1])
+            if not line.startswith('field:'):
+                continue
+            # field:unsigned long start;	offset:24;	size:8;	signed:0;
+            attrs = [x.strip() for x in line.split(';')]
+            field_name = attrs[0].split()[-1]
+            values = {}
+            for attr in attrs[1:]:
+                if attr.count(':') == 1:
+                    key, value = attr.split(':')
+                    values[key] = int(value)
+            fields[field_name] = TracepointField(values['offset'],
+                    values['size'], values['signed'] == 1)
+        return tp_id, fields
+
+    def attr_of_config(self, type_, config):
+        for attr in self.attrs:
+            if attr.type_ == type_ and attr.config == config:
+                return attr
+        return None
+
+    def records(self, f, pos, data_end):
+        '''Yields the type, the body and the end offset of each record of
+        the data section from the offset 'pos' to 'data_end', until the first
+        record that not completely written'''
+        header = struct.Struct(self.endian + 'IHH')
+        f.seek(pos)
+        while pos + header.size <= data_end:
+            head = f.read(header.size)
+            if len(head) != header.size:
+                break
+            rec_type, misc, size = header.unpack(head)
+            if size < header.size or pos + size > data_end:
+                break
+            body = f.read(size - header.size)
+            if len(body) != size - header.size:
+                break
+            pos += size
+            yield rec_type, body, pos
+
+    def sample_parser(self, attr):
+        '''Returns a function that returns the time and the raw data of a
+        sample record body of the given event attr, or None if the sample is
+        not for the attr'''
+        attr_of_id = {}
+        for a in self.attrs:
+            for id_ in a.ids:
+                attr_of_id[id_] = a
+
+        u64 = struct.Struct(self.endian + 'Q')
+        u32 = struct.Struct(self.endian + 'I')
+
+        def parse(body):
+            sample_attr = attr
+            if attr.sample_type & sample_identifier:
+                sample_attr = attr_of_id.get(u64.unpack_from(body, 0)[0])
+            if sample_attr != attr:
+                return None
+            time, raw = parse_sample(body, attr, u64, u32)
+            if raw == None:
+                return None
+            return time, raw
+        return parse
+
+    def samples(self, attr):
+        '''Yields (time, raw data) of the samples of the given event attr, in
+        the time order'''
+        queue = SamplesQueue()
+        parse = self.sample_parser(attr)
+        with open(self.path, 'rb') as f:
+            for rec_type, body, pos in self.records(f, self.data_offset,
+                    self.data_offset + self.data_size):
+                if rec_type == record_type_finished_round:
+                    for sample in queue.finish_round():
+                        yield sample
+                    continue
+                if rec_type == record_type_compressed:
+                    raise ValueError('compressed perf.data is not supported')
+                if rec_type != record_type_sample:
+                    continue
+                sample = parse(body)
+                if sample != None:
+                    queue.push(sample)
+        for sample in queue.flush():
+            yield sample
+
+    def round_samples(self, attr, pos, queue):
+        '''Reads records of the data section from the offset 'pos' to the
+        last FINISHED_ROUND record, queueing samples of the given event attr
+        to the SamplesQueue.  Returns (time, raw data) of the samples that
+        became safe to deliver, and the offset after the last FINISHED_ROUND
+        record.  Records after that are read again by the next call, as
+        those could be not completely written yet.  If the recording is
+        finished, all the records are read and all the queued samples are
+        returned'''
+        samples = []
+        round_samples = []
+        parse = self.sample_parser(attr)
+        with open(self.path, 'rb') as f:
+            for rec_type, body, end in self.records(f, pos,
+                    self.data_offset + self.data_size):
+                if rec_type == record_type_finished_round:
+                    for sample in round_samples:
+                        queue.push(sample)
+                    round_samples = []
+                    samples += queue.finish_round()
+                    pos = end
+                    continue
+                if rec_type == record_type_compressed:
+                    raise ValueError('compressed perf.data is not supported')
+                if rec_type != record_type_sample:
+                    continue
+                sample = parse(body)
+                if sample != None:
+                    round_samples.append(sample)
+        if not self.recording:
+            for sample in round_samples:
+                queue.push(sample)
+            samples += queue.flush()
+            pos = self.data_offset + self.data_size
+        return samples, pos
+
+class SamplesQueue:
+    '''Queue of samples for delivering those in the time order, like
+    'perf script' does.  Samples that queued before the previous round
+    finished are safe to deliver'''
+    queue = None
+    seq = None
+    flush_time = None
+    max_time = None
+
+    def __init__(self):
+        self.queue = []
+        self.seq = 0
+        self.max_time = 0
+
+    def push(self, sample):
+        time, raw = sample
+        self.max_time = max(self.max_time, time)
+        heapq.heappush(self.queue, (time, self.seq, raw))
+        self.seq += 1
+
+    def finish_round(self):
+        '''Returns the samples that became safe to deliver as a round
+        finished'''
+        samples = []
+        while self.queue and (self.flush_time != None and
+                self.queue[0][0] <= self.flush_time):
+            item = heapq.heappop(self.queue)
+            samples.append((item[0], item[2]))
+        self.flush_time = self.max_time
+        return samples
+
+    def flush(self):
+        '''Returns all the queued samples'''
+        samples = []
+        while self.queue:
+            item = heapq.heappop(self.queue)
+            samples.append((item[0], item[2]))
+        return samples
+
+def parse_sample(body, attr, u64, u32):
+    'Returns the time and the raw data of a sample'
+    sample_type = attr.sample_type
+    offset = 0
+    time = 0
+    for flag in [sample_identifier, sample_ip, sample_tid]:
+        if sample_type & flag:
+            offset += 8
+    if sample_type & sample_time:
+        time = u64.unpack_from(body, offset)[0]
+        offset += 8
+    for flag in [sample_addr, sample_id, sample_stream_id, sample_cpu,
+            sample_period]:
+        if sample_type & flag:
+            offset += 8
+    if sample_type & sample_read:
+        offset += read_values_size(body, offset, attr.read_format, u64)
+    if sample_type & sample_callchain:
+        offset += 8 + u64.unpack_from(body, offset)[0] * 8
+    if not sample_type & sample_raw:
+        return time, None
+    raw_size = u32.unpack_from(body, offset)[0]
+    offset += 4
+    return time, body[offset:offset + raw_size]
+
+def read_values_size(body, offset, read_format, u64):
+    nr_value_fields = 1
+    for flag in [read_format_id, read_format_lost]:
+        if read_format & flag:
+            nr_value_fields += 1
+    nr_time_fields = 0
+    for flag in [read_format_total_time_enabled,
+            read_format_total_time_running]:
+        if read_format & flag:
+            nr_time_fields += 1
+    if read_format & read_format_group:
+        nr = u64.unpack_from(body, offset)[0]
+        return 8 + nr_time_fields * 8 + nr * nr_value_fields * 8
+    return nr_value_fields * 8 + nr_time_fields * 8
+
+def read_perf_data(path):
+    '''Reads the header of a perf.data file.  Returns PerfData and an error
+    string'''
+    perf_data = PerfData(path)
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(104)
+            if len(header) != 104 or header[:8] != perf_magic:
+                return None, 'not a perf.data file'
+            # the magic is written in the endianness of the recorded system
+            if struct.unpack('<Q', perf_magic)[0] == struct.unpack_from(
+                    '<Q', header)[0]:
+                perf_data.endian = '<'
+            else:
+                perf_data.endian = '>'
+            endian = perf_data.endian
+            (size, attr_size, attrs_offset, attrs_size, data_offset,
+                    data_size) = struct.unpack_from(endian + '6Q', header, 8)
+            features = struct.unpack_from(endian + '4Q', header, 72)
+            perf_data.data_offset = data_offset
+            perf_data.data_size = data_size
+            if data_size == 0:
+                # 'perf record' updates the size at the end of the recording
+                perf_data.recording = True
+                f.seek(0, 2)
+                perf_data.data_size = f.tell() - data_offset
+
+            for idx in range(attrs_size // attr_size):
+                f.seek(attrs_offset + idx * attr_size)
+                entry = f.read(attr_size)
+                type_, attr_sz, config, period, sample_type, read_format = \
+                        struct.unpack_from(endian + 'IIQQQQ', entry)
+                ids_offset, ids_size = struct.unpack_from(endian + 'QQ',
+                        entry, attr_size - 16)
+                f.seek(ids_offset)
+                ids = struct.unpack(endian + '%dQ' % (ids_size // 8),
+                        f.read(ids_size))
+                perf_data.attrs.append(PerfEventAttr(type_, config,
+                    sample_type, read_format, ids))
+
+            # feature sections follow the data section, in the bits order
+            if features[0] & (1 << feature_tracing_data) and data_size:
+                nr_prior_features = bin(features[0] &
+                        ((1 << feature_tracing_data) - 1)).count('1')
+                f.seek(data_offset + data_size + nr_prior_features * 16)
+                section_offset, section_size = struct.unpack(endian + 'QQ',
+                        f.read(16))
+                f.seek(section_offset)
+                perf_data.tracing_data = f.read(section_size)
+    except (IOError, OSError, struct.error) as e:
+        return None, 'reading perf.data header failed (%s)' % e
+    return perf_data, None
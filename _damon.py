@@ -929,14 +929,19 @@ def turn_damon_off(kdamonds_names):
         return err
     wait_current_kdamonds_turned_off()
 
-def start_monitoring_record(record_file):
+def start_monitoring_record(record_file, switch_output=None):
+    '''Starts 'perf record' of the damon_aggregated events.  If
+    'switch_output' is given, it is passed to the '--switch-output' option of
+    'perf record', to rotate the output file'''
     try:
         subprocess.check_output(['which', 'perf'])
     except:
         return None, 'perf is not installed'
-    return subprocess.Popen(
-            ['perf', 'record', '-a', '-e', 'damon:damon_aggregated', '-o',
-                record_file]), None
+    cmd = ['perf', 'record', '-a', '-e', 'damon:damon_aggregated', '-o',
+            record_file]
+    if switch_output != None:
+        cmd.append('--switch-output=%s' % switch_output)
+    return subprocess.Popen(cmd), None
 
 def stop_monitoring_record(perf_pipe):
     perf_pipe.send_signal(signal.SIGINT)
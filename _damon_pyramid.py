@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+"""
+Multi-resolution aggregation pyramid of monitoring results files.
+
+Level N of the pyramid of a results file is a record file of the snapshots
+that aggregating every 'factor' snapshots of level N - 1, and saved next to
+the results file as '<results file>.pyramid.<N>'.  Level 0 is the results
+file itself.  A manifest of the levels, '<results file>.pyramid', keeps the
+size and modification time of the results file, to ignore the pyramid once
+the file is changed, and the snapshot time of each level.
+
+The snapshots of the levels keep the sums of the heats of the aggregated
+snapshots, but not when in the aggregation window the heats are made.
+Hence the levels are only for approximations such as heatmaps, not for
+exact reports.
+"""
+
+import json
+import os
+import struct
+
+import _damon_result
+
+default_factor = 2
+# levels having less snapshots are too coarse and uneven to be useful
+min_level_snapshots = 3
+pyramid_version = 2
+
+def manifest_path_of(result_file):
+    return result_file + '.pyramid'
+
+def level_path_of(result_file, level):
+    return '%s.pyramid.%d' % (result_file, level)
+
+def aggregate_level_snapshots(snapshots):
+    '''Returns a snapshot aggregating the snapshots for a pyramid level.
+    Unlike _damon_result.aggregate_snapshots(), regions are split at the
+    boundaries of the regions of all the snapshots, and nr_accesses of each
+    region is the sum of those of the snapshots, so that the heats of the
+    snapshots are kept, and aggregating the aggregated snapshots again is
+    same to aggregating the snapshots at once.  Ages are unknown'''
+    # differences of the sums of nr_accesses and the numbers of the covering
+    # regions at each boundary
+    diffs = {}
+    for snapshot in snapshots:
+        for start, end, nr_acc in zip(snapshot.starts, snapshot.ends,
+                snapshot.nr_accesses):
+            # e.g., the fake region
+            if start >= end:
+                continue
+            diff = diffs.setdefault(start, [0, 0])
+            diff[0] += nr_acc
+            diff[1] += 1
+            diff = diffs.setdefault(end, [0, 0])
+            diff[0] -= nr_acc
+            diff[1] -= 1
+
+    starts, ends, nr_accesses = [], [], []
+    nr_acc = 0
+    nr_covering = 0
+    for addr in sorted(diffs):
+        if nr_covering > 0:
+            # merge with the previous region of the same nr_accesses
+            if ends and ends[-1] == region_start and (
+                    nr_accesses[-1] == nr_acc):
+                ends[-1] = addr
+            else:
+                starts.append(region_start)
+                ends.append(addr)
+                nr_accesses.append(nr_acc)
+        nr_acc += diffs[addr][0]
+        nr_covering += diffs[addr][1]
+        region_start = addr
+
+    new_snapshot = _damon_result.DAMONSnapshot(snapshots[0].start_time,
+            snapshots[-1].end_time, snapshots[0].target_id)
+    new_snapshot.set_columns(starts, ends, nr_accesses,
+            [_damon_result.age_unknown] * len(starts))
+    return new_snapshot
+
+def build_level(src_path, path, factor, nr_jobs=1):
+    '''Writes the aggregation of every 'factor' snapshots of 'src_path' to
+    'path'.  The incomplete last windows are also aggregated, so that the
+    windows of the levels are aligned with those of the results file, and
+    the last level ends at the end of the results file.  Returns an error
+    string'''
+    snapshots, err = _damon_result.iter_snapshots(src_path)
+    if err:
+        return err
+    try:
+        _damon_result.write_snapshots(_damon_result.iter_faked_snapshots(
+            _damon_result.iter_window_aggregated_snapshots(snapshots,
+                factor, nr_jobs=nr_jobs,
+                aggregate=aggregate_level_snapshots)),
+            path, _damon_result.file_type_record, 0o600)
+    except (IOError, OSError, ValueError, struct.error) as e:
+        return 'writing %s failed (%s)' % (path, e)
+    return None
+
+def build_pyramid(result_file, factor=default_factor, max_levels=None,
+        nr_jobs=1):
+    '''Builds the levels of the pyramid until the next level would have
+    less than 'min_level_snapshots' snapshots for a target, or the number of
+    levels becomes 'max_levels'.  Each level is built from the previous
+    level, so the cost is about twice that of an aggregation.  'nr_jobs' is
+    passed to _damon_result.iter_window_aggregated_snapshots().  Returns the
+    paths to the level files and an error string'''
+    if factor < 2:
+        return None, 'wrong pyramid factor (%d)' % factor
+    try:
+        stat = os.stat(result_file)
+    except OSError as e:
+        return None, 'reading %s failed (%s)' % (result_file, e)
+    info, err = _damon_result.get_result_info(result_file)
+    if err:
+        return None, err
+    levels = []
+    src_path = result_file
+    nr_shots_in_aggr = 1
+    while max_levels == None or len(levels) < max_levels:
+        if info.snapshot_time == None:
+            break
+        nr_shots_in_aggr *= factor
+        # the last windows of the targets are incomplete
+        if min([(nr_snapshots + nr_shots_in_aggr - 1) // nr_shots_in_aggr
+            for nr_snapshots in info.nr_target_snapshots.values()]) < (
+                    min_level_snapshots):
+            break
+        path = level_path_of(result_file, len(levels) + 1)
+        err = build_level(src_path, path, factor, nr_jobs)
+        if err:
+            return None, err
+        # the written file has only a few snapshots of uneven durations, so
+        # the resolution is derived from that of the results file
+        levels.append({'file': os.path.basename(path),
+            'nr_shots_in_aggr': nr_shots_in_aggr,
+            'snapshot_time': nr_shots_in_aggr * info.snapshot_time})
+        src_path = path
+
+    manifest = {'damo_pyramid': pyramid_version, 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns, 'factor': factor, 'levels': levels}
+    try:
+        with open(manifest_path_of(result_file), 'w') as f:
+            json.dump(manifest, f)
+    except (IOError, OSError) as e:
+        return None, 'writing pyramid manifest failed (%s)' % e
+    return [os.path.join(os.path.dirname(result_file), level['file'])
+            for level in levels], None
+
+def read_levels(result_file):
+    '''Returns the levels of the pyramid of the results file, or an empty
+    list if there is no valid pyramid'''
+    manifest_path = manifest_path_of(result_file)
+    if not os.path.isfile(manifest_path):
+        return []
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        stat = os.stat(result_file)
+        if (manifest['damo_pyramid'] != pyramid_version or
+                manifest['size'] != stat.st_size or
+                manifest['mtime_ns'] != stat.st_mtime_ns):
+            return []
+        levels = manifest['levels']
+        for level in levels:
+            level['file'] = os.path.join(os.path.dirname(result_file),
+                    level['file'])
+            if not os.path.isfile(level['file']):
+                return []
+    except (IOError, OSError, ValueError, KeyError):
+        return []
+    return levels
+
+def coarsest_level(result_file, fits):
+    '''Returns the coarsest pyramid level of the results file that 'fits()'
+    returns True for, or None if no level fits'''
+    for level in reversed(read_levels(result_file)):
+        if fits(level):
+            return level
+    return None
+
+def level_info(level):
+    '''Returns the DAMONResultInfo of the level file and an error string.
+    The snapshot time is that of the level, so that the first snapshot of
+    each target starts at the start of the results file'''
+    info, err = _damon_result.get_result_info(level['file'])
+    if err:
+        return None, err
+    if info.snapshot_time != None:
+        info.start_time += info.snapshot_time - level['snapshot_time']
+        info.snapshot_time = level['snapshot_time']
+    return info, None
@@ -1,9 +1,31 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: GPL-2.0
 
+import array
+import bisect
+import concurrent.futures
+import heapq
+import itertools
+import json
+import lzma
+import math
+import mmap
+import multiprocessing
 import os
 import struct
 import subprocess
+import sys
+import time
+import zipfile
+import zlib
+
+import _damo_npy
+import _damo_perf_data
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # For supporting python 2.6
 try:
@@ -36,17 +58,96 @@ class DAMONRegion:
         self.nr_accesses = nr_accesses
         self.age = age
 
+# 'ages' column value for regions having no age information
+age_unknown = -(1 << 63)
+
+class DAMONSnapshotRegions:
+    '''List-like view of the regions of a DAMONSnapshot.  Regions read from
+    the view are DAMONRegion objects constructed on the fly, so modifications
+    to those are not kept'''
+    snapshot = None
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return len(self.snapshot.starts)
+
+    def region_at(self, idx):
+        snapshot = self.snapshot
+        age = snapshot.ages[idx]
+        return DAMONRegion(snapshot.starts[idx], snapshot.ends[idx],
+                snapshot.nr_accesses[idx], None if age == age_unknown else age)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self.region_at(i) for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('region index out of range')
+        return self.region_at(idx)
+
+    def __iter__(self):
+        snapshot = self.snapshot
+        for start, end, nr_accesses, age in zip(snapshot.starts,
+                snapshot.ends, snapshot.nr_accesses, snapshot.ages):
+            yield DAMONRegion(start, end, nr_accesses,
+                    None if age == age_unknown else age)
+
+    def append(self, region):
+        snapshot = self.snapshot
+        snapshot.starts.append(region.start)
+        snapshot.ends.append(region.end)
+        snapshot.nr_accesses.append(region.nr_accesses)
+        snapshot.ages.append(
+                age_unknown if region.age == None else region.age)
+
+    def extend(self, regions):
+        for region in regions:
+            self.append(region)
+
+    def __iadd__(self, regions):
+        self.extend(regions)
+        return self
+
 class DAMONSnapshot:
+    '''Monitoring results snapshot.  The regions are stored as columns of
+    start addresses, end addresses, nr_accesses and ages.  'regions' provides
+    a DAMONRegion list-like view of the columns'''
     start_time = None
     end_time = None
     target_id = None
-    regions = None
+    starts = None       # array('Q')
+    ends = None         # array('Q')
+    nr_accesses = None  # array('q')
+    ages = None         # array('q'), age_unknown for no age information
 
     def __init__(self, start_time, end_time, target_id):
         self.start_time = start_time
         self.end_time = end_time
         self.target_id = target_id
-        self.regions = []
+        self.set_columns([], [], [], [])
+
+    def set_columns(self, starts, ends, nr_accesses, ages):
+        self.starts = array.array('Q', starts)
+        self.ends = array.array('Q', ends)
+        self.nr_accesses = array.array('q', nr_accesses)
+        self.ages = array.array('q', ages)
+
+    @property
+    def regions(self):
+        return DAMONSnapshotRegions(self)
+
+    @regions.setter
+    def regions(self, regions):
+        if isinstance(regions, DAMONSnapshotRegions):
+            if regions.snapshot is self:
+                return
+            regions = list(regions)
+        self.set_columns([r.start for r in regions], [r.end for r in regions],
+                [r.nr_accesses for r in regions],
+                [age_unknown if r.age == None else r.age for r in regions])
 
 class DAMONResult:
     start_time = None
@@ -57,169 +158,1273 @@ class DAMONResult:
     def __init__(self):
         self.target_snapshots = {}
 
-def record_to_damon_result(file_path, f, fmt_version, max_secs):
-    result = None
-    parse_start_time = None
+# Precompiled decoders for the record format.  Each snapshot starts with a
+# header of the end time (sec, nsec) and the number of tasks, followed by a
+# per-task header of the target id and the number of regions, and then the
+# regions block.  Columns of the regions block are decoded at once.
+record_snapshot_head = struct.Struct('llI')
+record_task_heads = {1: struct.Struct('iI'), 2: struct.Struct('LI')}
+record_region = struct.Struct('LLI')
+# offsets and sizes of the start, end and nr_accesses fields of the regions
+record_region_fields = [[0, struct.calcsize('L')],
+        [struct.calcsize('L'), struct.calcsize('L')],
+        [struct.calcsize('LL'), struct.calcsize('I')]]
 
-    if f == None:
-        f = open(file_path, 'rb')
+def strided_column(block, nr, stride, offset, size, typecode):
+    '''Decodes the native unsigned integer fields of 'size' bytes at
+    'offset' of each 'stride' bytes entry of 'block' into an array.array of
+    'typecode' of 8 bytes entries.  Each byte of the fields is copied for
+    all the entries at once'''
+    column = bytearray(nr * 8)
+    # zero-extend the fields
+    pad = 0 if sys.byteorder == 'little' else 8 - size
+    for i in range(size):
+        column[pad + i::8] = block[offset + i::stride]
+    arr = array.array(typecode)
+    arr.frombytes(column)
+    return arr
 
-        # read record format version
-        mark = f.read(16)
-        if mark == b'damon_recfmt_ver':
-            fmt_version = struct.unpack('i', f.read(4))[0]
-        else:
-            fmt_version = 0
-            f.seek(0)
-    elif not fmt_version:
-        f.close()
-        return None, None, None, 'fmt_version is not given'
+# minimum number of regions to decode the regions block in columns.  For
+# less regions, unpacking each region is faster
+record_columns_decode_min_regions = 48
 
-    result = DAMONResult()
+def set_record_regions(snapshot, regions_block):
+    'Sets regions of the snapshot from a record file regions block'
+    nr_regions = len(regions_block) // record_region.size
+    if nr_regions == 0:
+        return
+    if nr_regions < record_columns_decode_min_regions:
+        starts, ends, nr_accesses = zip(*record_region.iter_unpack(
+            regions_block))
+        snapshot.set_columns(starts, ends, nr_accesses,
+                [age_unknown] * nr_regions)
+        return
+    regions_block = bytes(regions_block)
+    snapshot.starts, snapshot.ends, snapshot.nr_accesses = [
+            strided_column(regions_block, nr_regions, record_region.size,
+                offset, size, typecode) for (offset, size), typecode in
+            zip(record_region_fields, ['Q', 'Q', 'q'])]
+    snapshot.ages = array.array('q', [age_unknown]) * nr_regions
 
-    while True:
-        timebin = f.read(16)
-        if len(timebin) != 16:
-            if max_secs == None:
-                f.close()
+# Record format version 3 is portable and columnar.  Each snapshot is a
+# little-endian header of the end time, the target id and the number of
+# regions, followed by the columns of the start addresses, end addresses,
+# nr_accesses and ages of the regions, each entry of which is 8 bytes.  An
+# index of the offsets, end times and target ids of the snapshots follows
+# the snapshots as little-endian columns, and the footer at the end of the
+# file points the index.
+record_v3_snapshot_head = struct.Struct('<qQQ')
+record_v3_footer = struct.Struct('<QQ8s')
+record_v3_footer_mark = b'damonidx'
+
+def le_column(buf, offset, typecode, nr):
+    'Decodes a little-endian column of 8 bytes entries'
+    arr = array.array(typecode)
+    arr.frombytes(buf[offset:offset + nr * 8])
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+def le_column_bytes(arr):
+    if sys.byteorder == 'big':
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+def read_record_v3_footer(tail, file_size, footer_mark=record_v3_footer_mark):
+    '''Returns the offset of the index and the number of index entries from
+    the tail of a format version 3 record file, or None if the footer is not
+    written, e.g., the recording was not finished'''
+    if len(tail) != record_v3_footer.size:
+        return None
+    index_offset, nr_entries, mark = record_v3_footer.unpack(tail)
+    if (mark != footer_mark or
+            index_offset + nr_entries * 24 + len(tail) != file_size):
+        return None
+    return index_offset, nr_entries
+
+def set_record_v3_regions(snapshot, buf, offset, nr_regions, addr_range=None):
+    '''Sets regions of the snapshot from the columns of a format version 3
+    record.  If 'addr_range' is given, only regions overlapping with the
+    range are decoded'''
+    starts = le_column(buf, offset, 'Q', nr_regions)
+    ends = le_column(buf, offset + nr_regions * 8, 'Q', nr_regions)
+    first, last = 0, nr_regions
+    if addr_range:
+        first = bisect.bisect_right(ends, addr_range[0])
+        last = max(bisect.bisect_left(starts, addr_range[1]), first)
+        starts = starts[first:last]
+        ends = ends[first:last]
+    snapshot.starts = starts
+    snapshot.ends = ends
+    snapshot.nr_accesses = le_column(buf,
+            offset + (nr_regions * 2 + first) * 8, 'q', last - first)
+    snapshot.ages = le_column(buf, offset + (nr_regions * 3 + first) * 8,
+            'q', last - first)
+
+# Record format version 4 is a compressed version of the format version 3.
+# The compression method follows the format version as a little-endian int.
+# Snapshots in the format version 3 layout are packed into blocks, and each
+# block is independently compressed.  Each block is a little-endian header
+# of the compressed and the uncompressed sizes followed by the compressed
+# data.  The footer index is same to that of the version 3, but the offsets
+# are those in the concatenation of the uncompressed blocks.
+record_compressions = {'zlib': 1, 'lzma': 2}
+record_v4_block_head = struct.Struct('<QQ')
+record_v4_footer_mark = b'damonzix'
+# uncompressed size of blocks
+record_v4_block_size = 1 << 20
+
+# blocks of the format version 5 records could be not compressed
+record_no_compression = 0
+
+def compress_block(data, compression):
+    if compression == record_compressions['lzma']:
+        return lzma.compress(data)
+    if compression == record_compressions['zlib']:
+        return zlib.compress(data)
+    return data
+
+def decompress_block(data, compression):
+    if compression == record_compressions['lzma']:
+        return lzma.decompress(data)
+    if compression == record_compressions['zlib']:
+        return zlib.decompress(data)
+    return bytes(data)
+
+decompress_executor = None
+decompress_nr_workers = None
+
+def get_decompress_executor():
+    '''Returns the thread pool for decompressing blocks and the number of
+    the threads'''
+    global decompress_executor
+    global decompress_nr_workers
+    if decompress_executor == None:
+        decompress_nr_workers = multiprocessing.cpu_count()
+        decompress_executor = concurrent.futures.ThreadPoolExecutor(
+                decompress_nr_workers)
+    return decompress_executor, decompress_nr_workers
+
+class DAMONCompressedRecordBlocks:
+    '''Blocks of a format version 4 or 5 record file.  Blocks are decompressed
+    when those are accessed.  Following blocks are decompressed in advance
+    in a thread pool, as sequential accesses are common'''
+    buf = None
+    compression = None
+    offsets = None      # file offsets of the compressed blocks
+    sizes = None        # compressed sizes of the blocks
+    starts = None       # offsets of the blocks in the uncompressed data
+    cache = None        # {block index: decompressed block}
+    prefetched = None   # {block index: future}
+
+    def __init__(self, buf, offset, data_end):
+        self.buf = buf
+        self.compression = struct.unpack_from('<i', buf, offset)[0]
+        offset += 4
+        self.offsets = []
+        self.sizes = []
+        self.starts = []
+        uncompressed_offset = 0
+        while offset + record_v4_block_head.size <= data_end:
+            size, uncompressed_size = record_v4_block_head.unpack_from(buf,
+                    offset)
+            offset += record_v4_block_head.size
+            if offset + size > data_end:
+                break
+            self.offsets.append(offset)
+            self.sizes.append(size)
+            self.starts.append(uncompressed_offset)
+            offset += size
+            uncompressed_offset += uncompressed_size
+        self.cache = {}
+        self.prefetched = {}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def decompress(self, idx):
+        offset = self.offsets[idx]
+        return decompress_block(self.buf[offset:offset + self.sizes[idx]],
+                self.compression)
+
+    def block(self, idx):
+        if idx in self.cache:
+            return self.cache[idx]
+        executor, nr_workers = get_decompress_executor()
+        for i in range(idx, min(idx + nr_workers + 1, len(self))):
+            if not i in self.prefetched:
+                self.prefetched[i] = executor.submit(self.decompress, i)
+        # keep only the last accessed block
+        self.cache = {idx: self.prefetched.pop(idx).result()}
+        for i in list(self.prefetched.keys()):
+            if i < idx:
+                del self.prefetched[i]
+        return self.cache[idx]
+
+    def locate(self, offset):
+        '''Returns the decompressed block containing the uncompressed data
+        offset, and the offset in the block'''
+        idx = bisect.bisect_right(self.starts, offset) - 1
+        return self.block(idx), offset - self.starts[idx]
+
+def record_v4_blocks(buf, footer_mark=record_v4_footer_mark):
+    '''Returns DAMONCompressedRecordBlocks of a format version 4 or 5
+    record file data'''
+    data_end = len(buf)
+    footer = read_record_v3_footer(buf[len(buf) - record_v3_footer.size:],
+            len(buf), footer_mark)
+    if footer != None:
+        data_end = footer[0]
+    return DAMONCompressedRecordBlocks(buf, 20, data_end)
+
+# Record format version 5 delta-encodes the snapshots.  The file layout is
+# same to that of the version 4, but the blocks could be not compressed.
+# Each snapshot is a little-endian header of the end time, the target id,
+# the number of regions, the kind of the snapshot, the number of changes,
+# and the offset of the previous snapshot of the target.  A keyframe
+# snapshot is followed by the columns of the regions, like the version 3.  A
+# delta snapshot is followed by columns of the changes from the snapshot
+# that predicted from the previous snapshot of the target.  The first
+# column is the keys of the changes, each of which is the region index * 4
+# plus the index of the column (start, end, nr_accesses and age).  The
+# second column is the new values.  The age of each region is predicted to
+# be increased by one, as DAMON does for regions of unchanged access
+# frequency.
+record_v5_snapshot_head = struct.Struct('<qQQIIQ')
+record_v5_footer_mark = b'damondix'
+record_v5_keyframe = 0
+record_v5_delta = 1
+# maximum number of delta snapshots of a target between keyframes
+record_v5_keyframe_interval = 64
+
+def predict_record_v5_columns(columns, nr_regions):
+    '''Returns the columns of the snapshot predicted from the columns of the
+    previous snapshot of the target'''
+    starts, ends, nr_accesses, ages = [column[:nr_regions]
+            for column in columns]
+    ages = array.array('q', [age if age == age_unknown else age + 1
+        for age in ages])
+    nr_missing = nr_regions - len(starts)
+    if nr_missing > 0:
+        for column in [starts, ends, nr_accesses, ages]:
+            column.extend([0] * nr_missing)
+    return [starts, ends, nr_accesses, ages]
+
+class RecordV5Encoder:
+    '''Encodes snapshots in the format version 5'''
+    last_snapshots = None   # {target id: [offset, columns, nr_deltas]}
+
+    def __init__(self):
+        self.last_snapshots = {}
+
+    def encode(self, snapshot, offset):
+        '''Returns the bytes of the snapshot that placed at 'offset' of the
+        uncompressed data'''
+        target_id = snapshot.target_id & 0xffffffffffffffff
+        columns = [snapshot.starts, snapshot.ends, snapshot.nr_accesses,
+                snapshot.ages]
+        nr_regions = len(snapshot.starts)
+        last = self.last_snapshots.get(target_id)
+        self.last_snapshots[target_id] = [offset, columns, 0]
+
+        if last != None and last[2] < record_v5_keyframe_interval:
+            keys = array.array('Q')
+            values = array.array('q')
+            predicted = predict_record_v5_columns(last[1], nr_regions)
+            for column_idx in range(4):
+                for idx, (expected, value) in enumerate(
+                        zip(predicted[column_idx], columns[column_idx])):
+                    if expected != value:
+                        keys.append(idx * 4 + column_idx)
+                        # addresses are written in two's complement
+                        if value >= 1 << 63:
+                            value -= 1 << 64
+                        values.append(value)
+            # the delta should be smaller than the keyframe
+            if len(keys) * 16 < nr_regions * 32:
+                self.last_snapshots[target_id][2] = last[2] + 1
+                return b''.join([record_v5_snapshot_head.pack(
+                    snapshot.end_time, target_id, nr_regions,
+                    record_v5_delta, len(keys), last[0]),
+                    le_column_bytes(keys), le_column_bytes(values)])
+
+        return b''.join([record_v5_snapshot_head.pack(snapshot.end_time,
+            target_id, nr_regions, record_v5_keyframe, 0, 0)] +
+            [le_column_bytes(column) for column in columns])
+
+class DAMONDeltaRecordData:
+    '''Snapshots data of a format version 5 record file.  Delta snapshots
+    are decoded by applying the changes to the previous snapshots, which
+    are found from the previous snapshot offsets, until the last keyframe.
+    The last decoded snapshot of each target is kept, so that decoding the
+    snapshots in the order applies only one delta per snapshot'''
+    blocks = None
+    last_snapshots = None   # {target id: [offset, columns]}
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.last_snapshots = {}
+
+    def head(self, offset):
+        block, block_offset = self.blocks.locate(offset)
+        return (record_v5_snapshot_head.unpack_from(block, block_offset),
+                block, block_offset + record_v5_snapshot_head.size)
+
+    def columns(self, offset):
+        '''Returns the end time, the target id and the columns of the
+        snapshot at the offset'''
+        deltas = []
+        head_offset = offset
+        while True:
+            head, block, data_offset = self.head(head_offset)
+            end_time, target_id, nr_regions, kind, nr_changes, prev = head
+            last = self.last_snapshots.get(target_id)
+            if last != None and last[0] == head_offset:
+                columns = last[1]
+                break
+            if kind == record_v5_keyframe:
+                columns = [le_column(block, data_offset + nr_regions * 8 * i,
+                    typecode, nr_regions)
+                    for i, typecode in enumerate(['Q', 'Q', 'q', 'q'])]
+                break
+            deltas.append(head_offset)
+            head_offset = prev
+
+        for delta_offset in reversed(deltas):
+            head, block, data_offset = self.head(delta_offset)
+            end_time, target_id, nr_regions, kind, nr_changes, prev = head
+            columns = predict_record_v5_columns(columns, nr_regions)
+            keys = le_column(block, data_offset, 'Q', nr_changes)
+            values = le_column(block, data_offset + nr_changes * 8, 'q',
+                    nr_changes)
+            for key, value in zip(keys, values):
+                if value < 0 and key % 4 < 2:
+                    value += 1 << 64
+                columns[key % 4][key // 4] = value
+
+        self.last_snapshots[target_id] = [offset, columns]
+        head = self.head(offset)[0]
+        return head[0], head[1], columns
+
+    def snapshot(self, offset, start_time, addr_range):
+        end_time, target_id, columns = self.columns(offset)
+        snapshot = DAMONSnapshot(start_time, end_time, target_id)
+        # the kept columns should not be modified
+        snapshot.starts, snapshot.ends, snapshot.nr_accesses, \
+                snapshot.ages = [column[:] for column in columns]
+        if addr_range:
+            filter_snapshot_regions(snapshot, addr_range)
+        return snapshot
+
+def record_v5_data(buf):
+    return DAMONDeltaRecordData(record_v4_blocks(buf, record_v5_footer_mark))
+
+# Record format version 6 is the format version 3 with checksummed frames.
+# Each snapshot in the format version 3 layout is the payload of a frame,
+# which starts with a little-endian header of the length and the CRC32 of
+# the payload.  The footer index is same to that of the version 3, but the
+# offsets point the payloads.  Partially written frames at the end, e.g.,
+# due to a crash, are detected and cut out using the lengths and the
+# checksums.
+record_v6_frame_head = struct.Struct('<II')
+record_v6_footer_mark = b'damoncix'
+
+def record_v6_frame_bytes(payload):
+    return record_v6_frame_head.pack(len(payload),
+            zlib.crc32(payload) & 0xffffffff) + payload
+
+def record_v6_frames(buf, offset, data_end):
+    '''Yields the offset and the length of the payload of each frame in the
+    format version 6 record data, until the first frame that is not
+    completely written.  Only the headers are read'''
+    while offset + record_v6_frame_head.size <= data_end:
+        length, crc = record_v6_frame_head.unpack_from(buf, offset)
+        payload_offset = offset + record_v6_frame_head.size
+        if (length < record_v3_snapshot_head.size or
+                payload_offset + length > data_end):
+            return
+        nr_regions = record_v3_snapshot_head.unpack_from(buf,
+                payload_offset)[2]
+        if record_v3_snapshot_head.size + nr_regions * 32 != length:
+            return
+        yield payload_offset, length
+        offset = payload_offset + length
+
+def record_v6_frame_valid(frame_head, payload):
+    length, crc = record_v6_frame_head.unpack(frame_head)
+    return length == len(payload) and zlib.crc32(payload) & 0xffffffff == crc
+
+class DAMONRecordIndex:
+    '''Per-snapshot index of a record file.  'offsets' are the file offsets
+    of the per-task headers of the snapshots.  Also used for perf script
+    files, with the offsets of the first lines of the snapshots'''
+    fmt_version = None
+    offsets = None      # array('Q')
+    end_times = None    # array('Q')
+    target_ids = None   # array('Q')
+
+    def __init__(self, fmt_version):
+        self.fmt_version = fmt_version
+        self.offsets = array.array('Q')
+        self.end_times = array.array('Q')
+        self.target_ids = array.array('Q')
+
+    def __len__(self):
+        return len(self.offsets)
+
+def read_record_fmt_version(buf):
+    'Returns the format version and the offset of the first snapshot'
+    if buf[:16] == b'damon_recfmt_ver':
+        fmt_version = struct.unpack_from('i', buf, 16)[0]
+        if not fmt_version in [1, 2]:
+            # version 3 or later is written in little endian
+            fmt_version = struct.unpack_from('<i', buf, 16)[0]
+        return fmt_version, 20
+    return 0, 0
+
+def read_record_footer_index(buf, fmt_version, footer_mark):
+    '''Returns the index in the footer of a format version 3 or 4 record
+    file data, or None if the footer is not written'''
+    footer = read_record_v3_footer(buf[len(buf) - record_v3_footer.size:],
+            len(buf), footer_mark)
+    if footer == None:
+        return None
+    index_offset, nr_entries = footer
+    index = DAMONRecordIndex(fmt_version)
+    index.offsets = le_column(buf, index_offset, 'Q', nr_entries)
+    index.end_times = le_column(buf, index_offset + nr_entries * 8, 'Q',
+            nr_entries)
+    index.target_ids = le_column(buf, index_offset + nr_entries * 16, 'Q',
+            nr_entries)
+    return index
+
+def add_record_v3_index_entries(index, buf, offset, base_offset):
+    '''Adds entries for snapshots in a format version 3 data to the index,
+    by reading the headers of the snapshots'''
+    while offset + record_v3_snapshot_head.size <= len(buf):
+        end_time, target_id, nr_regions = \
+                record_v3_snapshot_head.unpack_from(buf, offset)
+        next_offset = offset + record_v3_snapshot_head.size + nr_regions * 32
+        if next_offset > len(buf):
             break
-        sec = struct.unpack('l', timebin[0:8])[0]
-        nsec = struct.unpack('l', timebin[8:16])[0]
-        end_time = sec * 1000000000 + nsec
+        index.offsets.append(base_offset + offset)
+        index.end_times.append(end_time)
+        index.target_ids.append(target_id)
+        offset = next_offset
 
-        if not parse_start_time:
-            parse_start_time = end_time
-        elif max_secs != None and (
-                end_time - parse_start_time > max_secs * 1000000000):
-            f.seek(-16, 1)
+def build_record_v3_index(buf, offset):
+    index = read_record_footer_index(buf, 3, record_v3_footer_mark)
+    if index == None:
+        # the footer is not written, e.g., the recording was not finished
+        index = DAMONRecordIndex(3)
+        add_record_v3_index_entries(index, buf, offset, 0)
+    return index
+
+def add_record_v5_index_entries(index, buf, offset, base_offset):
+    while offset + record_v5_snapshot_head.size <= len(buf):
+        end_time, target_id, nr_regions, kind, nr_changes, prev = \
+                record_v5_snapshot_head.unpack_from(buf, offset)
+        next_offset = offset + record_v5_snapshot_head.size
+        if kind == record_v5_keyframe:
+            next_offset += nr_regions * 32
+        else:
+            next_offset += nr_changes * 16
+        if next_offset > len(buf):
             break
+        index.offsets.append(base_offset + offset)
+        index.end_times.append(end_time)
+        index.target_ids.append(target_id)
+        offset = next_offset
 
-        nr_tasks = struct.unpack('I', f.read(4))[0]
+def walk_record_v6_frames(buf, offset):
+    '''Builds the index of the frames in a format version 6 record data
+    that has no footer, by reading the headers of the frames.  Frames having
+    wrong checksums could be only at the end, so only the payloads of those
+    are read.  Returns the index and the end offset of the last valid
+    frame'''
+    index = DAMONRecordIndex(6)
+    data_ends = []
+    for payload_offset, length in record_v6_frames(buf, offset, len(buf)):
+        end_time, target_id, nr_regions = \
+                record_v3_snapshot_head.unpack_from(buf, payload_offset)
+        index.offsets.append(payload_offset)
+        index.end_times.append(end_time)
+        index.target_ids.append(target_id)
+        data_ends.append(payload_offset + length)
+    while data_ends:
+        payload_offset = index.offsets[-1]
+        if record_v6_frame_valid(
+                buf[payload_offset - record_v6_frame_head.size:
+                    payload_offset], buf[payload_offset:data_ends[-1]]):
+            return index, data_ends[-1]
+        for column in [index.offsets, index.end_times, index.target_ids,
+                data_ends]:
+            column.pop()
+    return index, offset
+
+def build_record_v6_index(buf, offset):
+    index = read_record_footer_index(buf, 6, record_v6_footer_mark)
+    if index == None:
+        index = walk_record_v6_frames(buf, offset)[0]
+    return index
+
+def build_record_v5_index(buf):
+    index = read_record_footer_index(buf, 5, record_v5_footer_mark)
+    if index == None:
+        index = DAMONRecordIndex(5)
+        blocks = record_v4_blocks(buf, record_v5_footer_mark)
+        for idx in range(len(blocks)):
+            add_record_v5_index_entries(index, blocks.block(idx), 0,
+                    blocks.starts[idx])
+    return index
+
+def build_record_v4_index(buf):
+    index = read_record_footer_index(buf, 4, record_v4_footer_mark)
+    if index == None:
+        index = DAMONRecordIndex(4)
+        blocks = record_v4_blocks(buf)
+        for idx in range(len(blocks)):
+            add_record_v3_index_entries(index, blocks.block(idx), 0,
+                    blocks.starts[idx])
+    return index
+
+def build_record_index(buf):
+    '''Builds the index of snapshots in the record data 'buf' by reading only
+    the headers.  Incompletely written snapshots at the end are ignored'''
+    fmt_version, offset = read_record_fmt_version(buf)
+    if fmt_version == 3:
+        return build_record_v3_index(buf, offset)
+    if fmt_version == 4:
+        return build_record_v4_index(buf)
+    if fmt_version == 5:
+        return build_record_v5_index(buf)
+    if fmt_version == 6:
+        return build_record_v6_index(buf, offset)
+    index = DAMONRecordIndex(fmt_version)
+    task_head = record_task_heads[1 if fmt_version == 1 else 2]
+
+    while offset + record_snapshot_head.size <= len(buf):
+        sec, nsec, nr_tasks = record_snapshot_head.unpack_from(buf, offset)
+        offset += record_snapshot_head.size
+        end_time = sec * 1000000000 + nsec
         for t in range(nr_tasks):
-            if fmt_version == 1:
-                target_id = struct.unpack('i', f.read(4))[0]
-            else:
-                target_id = struct.unpack('L', f.read(8))[0]
+            if offset + task_head.size > len(buf):
+                return index
+            target_id, nr_regions = task_head.unpack_from(buf, offset)
+            next_offset = (offset + task_head.size +
+                    nr_regions * record_region.size)
+            if next_offset > len(buf):
+                return index
+            index.offsets.append(offset)
+            index.end_times.append(end_time)
+            # format version 1 target ids are signed int
+            index.target_ids.append(target_id & 0xffffffffffffffff)
+            offset = next_offset
+    return index
+
+record_index_mark = b'damon_recidx_ver'
+record_index_version = 1
+record_index_head = struct.Struct('iiQqQ')
 
-            if not target_id in result.target_snapshots:
-                result.target_snapshots[target_id] = []
-            target_snapshots = result.target_snapshots[target_id]
+def record_index_path(record_path):
+    return record_path + '.index'
+
+def save_record_index(record_path, index=None):
+    '''Saves the index of a record file to its sidecar file, so that later
+    reads of the record can skip the index building.  Returns an error
+    string or None'''
+    try:
+        stat = os.stat(record_path)
+        if index == None and (get_file_type(record_path) ==
+                file_type_perf_script):
+            index = build_perf_script_index(record_path)
+        elif index == None:
+            with open(record_path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            index = build_record_index(mm)
+            mm.close()
+        with open(record_index_path(record_path), 'wb') as f:
+            f.write(record_index_mark)
+            f.write(record_index_head.pack(record_index_version,
+                index.fmt_version, stat.st_size, stat.st_mtime_ns,
+                len(index)))
+            for arr in [index.offsets, index.end_times, index.target_ids]:
+                arr.tofile(f)
+    except (IOError, OSError, ValueError) as e:
+        return 'saving record index failed (%s)' % e
+    return None
+
+def load_record_index(record_path):
+    '''Returns the saved index of a record file, or None if there is no
+    saved index or the record file has changed since the index was saved'''
+    index_path = record_index_path(record_path)
+    if not os.path.isfile(index_path):
+        return None
+    try:
+        stat = os.stat(record_path)
+        with open(index_path, 'rb') as f:
+            if f.read(len(record_index_mark)) != record_index_mark:
+                return None
+            head = f.read(record_index_head.size)
+            if len(head) != record_index_head.size:
+                return None
+            version, fmt_version, size, mtime, nr_entries = \
+                    record_index_head.unpack(head)
+            if (version != record_index_version or size != stat.st_size or
+                    mtime != stat.st_mtime_ns):
+                return None
+            index = DAMONRecordIndex(fmt_version)
+            for arr in [index.offsets, index.end_times, index.target_ids]:
+                arr.fromfile(f, nr_entries)
+    except (IOError, OSError, EOFError):
+        return None
+    return index
+
+def index_window(index, target_ids, time_range):
+    '''Returns the position of the first entry of the index that could
+    overlap with the time range, and the end time of the last snapshot
+    before the position for each of the targets'''
+    start = 0
+    if time_range:
+        start = bisect.bisect_right(index.end_times, time_range[0])
+    last_end_times = {}
+    for idx in range(start - 1, -1, -1):
+        if target_ids != None and len(last_end_times) == len(target_ids):
+            break
+        target_id = record_index_target_id(index, idx)
+        if not target_id in last_end_times:
+            last_end_times[target_id] = index.end_times[idx]
+    return start, last_end_times
+
+def iter_window_snapshots(snapshots, time_range):
+    '''Yields snapshots until those of all targets pass the end of the time
+    range'''
+    seen_targets = set()
+    passed_targets = set()
+    for snapshot in snapshots:
+        if time_range:
+            if (snapshot.target_id in passed_targets and
+                    passed_targets == seen_targets):
+                break
+            seen_targets.add(snapshot.target_id)
+            if snapshot.end_time >= time_range[1]:
+                passed_targets.add(snapshot.target_id)
+        yield snapshot
+
+def record_regions_in(buf, offset, nr_regions, addr_range):
+    '''Returns the indices of the first and the last (exclusive) regions
+    overlapping with the address range in the record regions block, using
+    binary searches on the address-sorted regions'''
+    lo, hi = 0, nr_regions
+    while lo < hi:
+        mid = (lo + hi) // 2
+        # end address of the region
+        if record_region.unpack_from(buf,
+                offset + mid * record_region.size)[1] <= addr_range[0]:
+            lo = mid + 1
+        else:
+            hi = mid
+    first = lo
+    hi = nr_regions
+    while lo < hi:
+        mid = (lo + hi) // 2
+        # start address of the region
+        if record_region.unpack_from(buf,
+                offset + mid * record_region.size)[0] < addr_range[1]:
+            lo = mid + 1
+        else:
+            hi = mid
+    return first, lo
+
+def decode_record_snapshot(buf, offset, fmt_version, start_time, end_time,
+        addr_range=None):
+    '''Decodes a snapshot of the record data from the per-task header
+    offset.  If 'addr_range' is given, only regions overlapping with the
+    range are decoded'''
+    if fmt_version == 5:
+        # 'buf' is DAMONDeltaRecordData
+        return buf.snapshot(offset, start_time, addr_range)
+    if fmt_version == 4:
+        # 'buf' is DAMONCompressedRecordBlocks
+        buf, offset = buf.locate(offset)
+        fmt_version = 3
+    if fmt_version in [3, 6]:
+        end_time, target_id, nr_regions = \
+                record_v3_snapshot_head.unpack_from(buf, offset)
+        snapshot = DAMONSnapshot(start_time, end_time, target_id)
+        set_record_v3_regions(snapshot, buf,
+                offset + record_v3_snapshot_head.size, nr_regions, addr_range)
+        return snapshot
+
+    task_head = record_task_heads[1 if fmt_version == 1 else 2]
+    target_id, nr_regions = task_head.unpack_from(buf, offset)
+    offset += task_head.size
+    snapshot = DAMONSnapshot(start_time, end_time, target_id)
+    first, last = 0, nr_regions
+    if addr_range:
+        first, last = record_regions_in(buf, offset, nr_regions, addr_range)
+    set_record_regions(snapshot, buf[offset + first * record_region.size:
+        offset + last * record_region.size])
+    return snapshot
+
+def filter_snapshot_regions(snapshot, addr_range):
+    'Removes regions of the snapshot not overlapping with the address range'
+    first = bisect.bisect_right(snapshot.ends, addr_range[0])
+    last = max(bisect.bisect_left(snapshot.starts, addr_range[1]), first)
+    if first == 0 and last == len(snapshot.starts):
+        return
+    snapshot.starts = snapshot.starts[first:last]
+    snapshot.ends = snapshot.ends[first:last]
+    snapshot.nr_accesses = snapshot.nr_accesses[first:last]
+    snapshot.ages = snapshot.ages[first:last]
+
+class DAMONRecordSnapshots:
+    '''Snapshots of a target in a memory-mapped record file.  Each snapshot
+    is decoded only when it is accessed.  Modifications to the returned
+    snapshots are not kept'''
+    buf = None
+    fmt_version = None
+    offsets = None
+    end_times = None
+    first_start_time = None
+
+    def __init__(self, buf, fmt_version, offsets, end_times,
+            first_start_time):
+        self.buf = buf
+        self.fmt_version = fmt_version
+        self.offsets = offsets
+        self.end_times = end_times
+        self.first_start_time = first_start_time
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return DAMONRecordSnapshots(self.buf, self.fmt_version,
+                    self.offsets[start:stop], self.end_times[start:stop],
+                    self.start_time_of(start))
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('snapshot index out of range')
+        return decode_record_snapshot(self.buf, self.offsets[idx],
+                self.fmt_version, self.start_time_of(idx),
+                self.end_times[idx])
+
+    def __delitem__(self, idx):
+        del self.offsets[idx]
+        del self.end_times[idx]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def start_time_of(self, idx):
+        if idx == 0:
+            return self.first_start_time
+        if idx <= len(self):
+            return self.end_times[idx - 1]
+        return None
+
+def open_record(file_path):
+    '''Memory-maps a record file and returns the file, the mapped buffer and
+    the index of the snapshots.  The index is loaded from the saved one if
+    available, or built by reading the snapshot headers'''
+    f = open(file_path, 'rb')
+    if os.fstat(f.fileno()).st_size == 0:
+        return f, b'', DAMONRecordIndex(0)
+    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    index = load_record_index(file_path)
+    if index == None:
+        index = build_record_index(buf)
+    if index.fmt_version == 4:
+        buf = record_v4_blocks(buf)
+    elif index.fmt_version == 5:
+        buf = record_v5_data(buf)
+    return f, buf, index
+
+def salvage_record(file_path):
+    '''Truncates a format version 6 record file after the last frame that
+    completely written, and writes the footer index of the frames.  Only the
+    headers of the frames and the payloads of the last frames are read.
+    Returns the number of the remaining snapshots, the number of the cut out
+    bytes, and an error string'''
+    try:
+        with open(file_path, 'r+b') as f:
+            fmt_version, offset = read_record_fmt_version(f.read(20))
+            if fmt_version != 6:
+                return None, None, ('salvaging format version %d record is '
+                        'not supported' % fmt_version)
+            file_size = os.fstat(f.fileno()).st_size
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            index = read_record_footer_index(buf, 6, record_v6_footer_mark)
+            if index != None:
+                buf.close()
+                return len(index), 0, None
+
+            index, data_end = walk_record_v6_frames(buf, offset)
+            buf.close()
+
+            f.truncate(data_end)
+            f.seek(data_end)
+            for column in [index.offsets, index.end_times, index.target_ids]:
+                f.write(le_column_bytes(column))
+            f.write(record_v3_footer.pack(data_end, len(index),
+                record_v6_footer_mark))
+    except (IOError, OSError, ValueError) as e:
+        return None, None, 'salvaging %s failed (%s)' % (file_path, e)
+    return len(index), file_size - data_end, None
+
+def check_record_checksums(file_path):
+    '''Returns an error string if a format version 6 record file has a
+    frame having a wrong checksum, or a partially written frame'''
+    f, buf, index = open_record(file_path)
+    try:
+        if index.fmt_version != 6:
+            return None
+        data_end = read_record_fmt_version(buf)[1]
+        for payload_offset in index.offsets:
+            nr_regions = record_v3_snapshot_head.unpack_from(buf,
+                    payload_offset)[2]
+            data_end = (payload_offset + record_v3_snapshot_head.size +
+                    nr_regions * 32)
+            if not record_v6_frame_valid(buf[payload_offset -
+                record_v6_frame_head.size:payload_offset],
+                buf[payload_offset:data_end]):
+                return 'wrong checksum of the frame at %d' % payload_offset
+        if read_record_footer_index(buf, 6, record_v6_footer_mark) == None \
+                and data_end != len(buf):
+            return 'broken or partially written frame at %d' % data_end
+    finally:
+        f.close()
+    return None
+
+def record_index_target_id(index, idx):
+    target_id = index.target_ids[idx]
+    if index.fmt_version == 1 and target_id >= 1 << 63:
+        target_id -= 1 << 64
+    return target_id
+
+def mmap_record_to_damon_result(file_path):
+    '''Returns a DAMONResult of the record file having DAMONRecordSnapshots
+    as the snapshots of each target'''
+    f, buf, index = open_record(file_path)
+
+    target_entries = {}
+    for idx in range(len(index)):
+        target_id = record_index_target_id(index, idx)
+        if not target_id in target_entries:
+            target_entries[target_id] = [array.array('Q'), array.array('Q')]
+        target_entries[target_id][0].append(index.offsets[idx])
+        target_entries[target_id][1].append(index.end_times[idx])
+
+    result = DAMONResult()
+    for target_id, entries in target_entries.items():
+        result.target_snapshots[target_id] = DAMONRecordSnapshots(buf,
+                index.fmt_version, entries[0], entries[1], None)
+    return result, f, index.fmt_version, None
+
+def iter_record_snapshots(file_path, target=None, time_range=None,
+        target_ids=None, addr_range=None):
+    '''Yields snapshots of a record file in the file order.  If 'target' is
+    given, snapshots of other targets are skipped without decoding.  If
+    'time_range' is given, the reading starts from the snapshots that could
+    overlap with the range, which is found from the index, and stops after
+    the range.  If 'addr_range' is given, only regions overlapping with the
+    range are decoded'''
+    f, buf, index = open_record(file_path)
+    f.close()
+    start, last_end_times = index_window(index, target_ids, time_range)
+    for idx in range(start, len(index)):
+        target_id = record_index_target_id(index, idx)
+        end_time = index.end_times[idx]
+        if target == None or target_id == target:
+            yield decode_record_snapshot(buf, index.offsets[idx],
+                    index.fmt_version, last_end_times.get(target_id),
+                    end_time, addr_range)
+        last_end_times[target_id] = end_time
+
+def parse_perf_script_line(line):
+    '''Parses a perf script output line of damon_aggregated event.  Returns
+    a tuple of the end time, target id, number of regions, start address,
+    end address, nr_accesses and age, or None if the line is not for the
+    event.
+
+    Example line is as below:
+
+    kdamond.0  4452 [000] 82877.315633: damon:damon_aggregated: \\
+            target_id=18446623435582458880 nr_regions=17 \\
+            140731667070976-140731668037632: 0 3
+
+    Note that the last field is not in the early version[1].
+
+    [1] https://lore.kernel.org/linux-mm/df8d52f1fb2f353a62ff34dc09fe99e32ca1f63f.1636610337.git.xhao@linux.alibaba.com/
+    '''
+    fields = line.split()
+    if not len(fields) in [9, 10]:
+        return None
+    if fields[4] != b'damon:damon_aggregated:':
+        return None
+    sec, subsec = fields[3][:-1].split(b'.')
+    end_time = int(sec) * 1000000000 + int(subsec.ljust(9, b'0')[:9])
+    start, end = fields[7][:-1].split(b'-')
+    # damo writes 'None' for unknown ages
+    if len(fields) == 10 and fields[9] != b'None':
+        age = int(fields[9])
+    else:
+        age = None
+    return (end_time, int(fields[5][10:]), int(fields[6][11:]), int(start),
+            int(end), int(fields[8]), age)
+
+def parse_perf_script_chunk(chunk_info):
+    '''Parses damon_aggregated events in a byte range of a perf script
+    output file.  Returns a list of runs of the events having same target id
+    and number of regions.  Each run is a list of the target id, the number
+    of regions, and the columns of the end times, start addresses, end
+    addresses, nr_accesses and ages of the events'''
+    file_path, start_offset, end_offset = chunk_info
+    with open(file_path, 'rb') as f:
+        f.seek(start_offset)
+        lines = f.read(end_offset - start_offset).split(b'\n')
+
+    runs = []
+    run = None
+    for line in lines:
+        event = parse_perf_script_line(line)
+        if event == None:
+            continue
+        end_time, target_id, nr_regions, start, end, nr_accesses, age = event
+        if run == None or run[0] != target_id or run[1] != nr_regions:
+            run = [target_id, nr_regions, [], [], [], [], []]
+            runs.append(run)
+        run[2].append(end_time)
+        run[3].append(start)
+        run[4].append(end)
+        run[5].append(nr_accesses)
+        run[6].append(age_unknown if age == None else age)
+    return runs
+
+def add_aggregated_regions_run(result, run, nr_read_regions):
+    '''Adds a run of damon_aggregated events to the result, splitting those
+    into snapshots.  Returns the updated number of read regions of the
+    current snapshot'''
+    target_id, nr_regions, end_times, starts, ends, nr_accesses, ages = run
+    if not target_id in result.target_snapshots:
+        result.target_snapshots[target_id] = []
+    target_snapshots = result.target_snapshots[target_id]
+
+    idx = 0
+    while idx < len(end_times):
+        if nr_read_regions == 0:
             if len(target_snapshots) == 0:
                 start_time = None
             else:
                 start_time = target_snapshots[-1].end_time
+            target_snapshots.append(
+                    DAMONSnapshot(start_time, end_times[idx], target_id))
+        nr_to_read = max(min(nr_regions - nr_read_regions,
+            len(end_times) - idx), 1)
+        snapshot = target_snapshots[-1]
+        end_idx = idx + nr_to_read
+        snapshot.starts.extend(starts[idx:end_idx])
+        snapshot.ends.extend(ends[idx:end_idx])
+        snapshot.nr_accesses.extend(nr_accesses[idx:end_idx])
+        snapshot.ages.extend(ages[idx:end_idx])
+        idx = end_idx
+        nr_read_regions += nr_to_read
+        if nr_read_regions == nr_regions:
+            nr_read_regions = 0
+    return nr_read_regions
 
-            snapshot = DAMONSnapshot(start_time, end_time, target_id)
-            nr_regions = struct.unpack('I', f.read(4))[0]
-            for r in range(nr_regions):
-                start_addr = struct.unpack('L', f.read(8))[0]
-                end_addr = struct.unpack('L', f.read(8))[0]
-                nr_accesses = struct.unpack('I', f.read(4))[0]
-                region = DAMONRegion(start_addr, end_addr, nr_accesses, None)
-                snapshot.regions.append(region)
-            target_snapshots.append(snapshot)
+# perf script output files smaller than this are parsed in the current process
+perf_script_parallel_min_sz = 16 * 1024 * 1024
+perf_script_chunk_sz = 4 * 1024 * 1024
 
-    return result, f, fmt_version, None
+def perf_script_chunks(file_path, nr_jobs):
+    '''Splits a perf script output file into byte ranges ending at line
+    boundaries'''
+    file_sz = os.path.getsize(file_path)
+    chunk_sz = max(file_sz // (nr_jobs * 4), perf_script_chunk_sz)
+    chunks = []
+    with open(file_path, 'rb') as f:
+        start = 0
+        while start < file_sz:
+            end = start + chunk_sz
+            if end < file_sz:
+                f.seek(end)
+                end += len(f.readline())
+            end = min(end, file_sz)
+            chunks.append((file_path, start, end))
+            start = end
+    return chunks
+
+def parse_perf_script_file(file_path, nr_jobs=None):
+    '''Parses a whole perf script output file.  Large files are split into
+    chunks at line boundaries, and the chunks are parsed in parallel using a
+    process pool'''
+    if nr_jobs == None:
+        nr_jobs = multiprocessing.cpu_count()
+    if nr_jobs > 1 and os.path.getsize(file_path) >= (
+            perf_script_parallel_min_sz):
+        chunks = perf_script_chunks(file_path, nr_jobs)
+        try:
+            pool = multiprocessing.Pool(nr_jobs)
+            chunk_runs = pool.imap(parse_perf_script_chunk, chunks)
+        except OSError:
+            # e.g., no shm support
+            pool = None
+            chunk_runs = [parse_perf_script_chunk(c) for c in chunks]
+    else:
+        pool = None
+        chunk_runs = [parse_perf_script_chunk(
+            (file_path, 0, os.path.getsize(file_path)))]
 
-def perf_script_to_damon_result(file_path, f, max_secs):
     result = None
     nr_read_regions = 0
-    parse_start_time = None
-
-    if not f:
-        f = open(file_path, 'r')
-
-    for line in f:
-        line = line.strip()
-        '''
-        example line is as below:
-
-        kdamond.0  4452 [000] 82877.315633: damon:damon_aggregated: \
-                target_id=18446623435582458880 nr_regions=17 \
-                140731667070976-140731668037632: 0 3
-
-        Note that the last field is not in the early version[1].
+    # a snapshot's regions may cross a chunk boundary
+    for runs in chunk_runs:
+        for run in runs:
+            if not result:
+                result = DAMONResult()
+            nr_read_regions = add_aggregated_regions_run(result, run,
+                    nr_read_regions)
+    if pool:
+        pool.close()
+        pool.join()
+    return result
 
-        [1] https://lore.kernel.org/linux-mm/df8d52f1fb2f353a62ff34dc09fe99e32ca1f63f.1636610337.git.xhao@linux.alibaba.com/
-        '''
+# Layout of damon_aggregated tracepoint data, for perf.data files having no
+# tracepoint format information
+default_aggregated_fields = {
+        'target_id': _damo_perf_data.TracepointField(8, 8, False),
+        'nr_regions': _damo_perf_data.TracepointField(16, 4, False),
+        'start': _damo_perf_data.TracepointField(24, 8, False),
+        'end': _damo_perf_data.TracepointField(32, 8, False),
+        'nr_accesses': _damo_perf_data.TracepointField(40, 4, False),
+        'age': _damo_perf_data.TracepointField(44, 4, False)}
 
-        fields = line.strip().split()
-        if not len(fields) in [9, 10]:
+def aggregated_event_decoder(fields, endian):
+    '''Returns a struct for decoding target_id, nr_regions, start, end,
+    nr_accesses and age (if the kernel provides) fields of damon_aggregated
+    tracepoint data'''
+    field_names = ['target_id', 'nr_regions', 'start', 'end', 'nr_accesses',
+            'age']
+    fmt = endian
+    offset = 0
+    for name in field_names:
+        if not name in fields:
             continue
-        if fields[4] != 'damon:damon_aggregated:':
-            continue
-        end_time = int(float(fields[3][:-1]) * 1000000000)
-        if not result:
-            result = DAMONResult()
-        if parse_start_time == None:
-            parse_start_time = end_time
-        elif max_secs != None and (
-                end_time - parse_start_time > max_secs * 1000000000):
-            # reverse seek of text file is not supported, we simply remove
-            # over-read line.
-            break
+        field = fields[name]
+        if field.offset < offset:
+            return None
+        fmt += '%dx' % (field.offset - offset)
+        fmt += {1: 'b', 2: 'h', 4: 'i', 8: 'q'}[field.size]
+        if not field.signed:
+            fmt = fmt[:-1] + fmt[-1].upper()
+        offset = field.offset + field.size
+    return struct.Struct(fmt)
 
-        target_id = int(fields[5].split('=')[1])
+def perf_data_event_decoder(perf_data):
+    '''Returns the event attr of damon_aggregated tracepoint in the
+    perf.data file, and a function that returns the damon_aggregated event
+    tuple of the end time, target id, number of regions, start address, end
+    address, nr_accesses and age of a sample, or None if the sample is not
+    for the event'''
+    tp_id, fields = perf_data.tracepoint_format('damon_aggregated')
+    if fields == None:
+        fields = default_aggregated_fields
+    decoder = aggregated_event_decoder(fields, perf_data.endian)
+    if decoder == None:
+        raise ValueError('unsupported damon_aggregated format')
+    has_age = 'age' in fields
 
-        if not target_id in result.target_snapshots:
-            result.target_snapshots[target_id] = []
-        target_snapshots = result.target_snapshots[target_id]
-        if len(target_snapshots) == 0:
-            start_time = None
-        else:
-            start_time = target_snapshots[-1].end_time
+    attr = None
+    if tp_id != None:
+        attr = perf_data.attr_of_config(
+                _damo_perf_data.perf_type_tracepoint, tp_id)
+    else:
+        tp_attrs = [a for a in perf_data.attrs
+                if a.type_ == _damo_perf_data.perf_type_tracepoint]
+        if len(tp_attrs) == 1:
+            attr = tp_attrs[0]
+    if attr == None:
+        raise ValueError('no damon_aggregated event in the file')
 
-        nr_regions = int(fields[6].split('=')[1])
-        addrs = [int(x) for x in fields[7][:-1].split('-')]
-        nr_accesses = int(fields[8])
-        if len(fields) == 10:
-            age = int(fields[9])
-        else:
-            age = None
+    common_type = struct.Struct(perf_data.endian + 'H')
+    def decode(end_time, raw):
+        if len(raw) < decoder.size:
+            return None
+        if tp_id != None and common_type.unpack_from(raw)[0] != tp_id:
+            return None
+        values = decoder.unpack_from(raw)
+        if has_age:
+            return (end_time,) + values
+        return (end_time,) + values + (None,)
+    return attr, decode
 
-        if nr_read_regions == 0:
-            snapshot = DAMONSnapshot(start_time, end_time, target_id)
-            target_snapshots.append(snapshot)
+def iter_perf_data_events(file_path):
+    '''Yields damon_aggregated tracepoint events in a perf.data file, as
+    tuples of the end time, target id, number of regions, start address, end
+    address, nr_accesses and age.  'perf' program is not used'''
+    perf_data, err = _damo_perf_data.read_perf_data(file_path)
+    if err:
+        raise ValueError(err)
+    attr, decode = perf_data_event_decoder(perf_data)
+    for end_time, raw in perf_data.samples(attr):
+        event = decode(end_time, raw)
+        if event != None:
+            yield event
 
-        snapshot = target_snapshots[-1]
-        snapshot.regions.append(
-                DAMONRegion(addrs[0], addrs[1], nr_accesses, age))
+def iter_aggregated_events_snapshots(events, last_end_times=None,
+        target=None, addr_range=None):
+    '''Yields snapshots made of damon_aggregated events, once each snapshot
+    is completed.  'last_end_times' is the end time of the last snapshot
+    before the events, of each target.  Regions of targets other than
+    'target' and regions not overlapping with 'addr_range' are not kept'''
+    if last_end_times == None:
+        last_end_times = {}
+    snapshots = {}  # in-progress snapshot of each target
+    nr_read_regions = 0
+    for end_time, target_id, nr_regions, start, end, nr_accesses, age in \
+            events:
+        if nr_read_regions == 0 or not target_id in snapshots:
+            if target_id in snapshots:
+                yield snapshots.pop(target_id)
+            snapshots[target_id] = DAMONSnapshot(
+                    last_end_times.get(target_id), end_time, target_id)
+            last_end_times[target_id] = end_time
+        if ((target == None or target_id == target) and (addr_range == None
+                or (start < addr_range[1] and addr_range[0] < end))):
+            snapshot = snapshots[target_id]
+            snapshot.starts.append(start)
+            snapshot.ends.append(end)
+            snapshot.nr_accesses.append(nr_accesses)
+            snapshot.ages.append(age_unknown if age == None else age)
 
         nr_read_regions += 1
         if nr_read_regions == nr_regions:
             nr_read_regions = 0
+            yield snapshots.pop(target_id)
+    # incompletely recorded snapshots
+    for snapshot in snapshots.values():
+        yield snapshot
 
-    if max_secs == None:
-        f.close()
-    return result, f
+def iter_perf_script_events(file_path, offset=0):
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            event = parse_perf_script_line(line)
+            if event != None:
+                yield event
+
+def build_perf_script_index(file_path):
+    '''Builds the index of snapshots in a perf script output file'''
+    index = DAMONRecordIndex(0)
+    nr_read_regions = 0
+    offset = 0
+    with open(file_path, 'rb') as f:
+        for line in f:
+            event = parse_perf_script_line(line)
+            if event != None:
+                end_time, target_id, nr_regions = event[:3]
+                if nr_read_regions == 0:
+                    index.offsets.append(offset)
+                    index.end_times.append(end_time)
+                    index.target_ids.append(target_id & 0xffffffffffffffff)
+                nr_read_regions += 1
+                if nr_read_regions == nr_regions:
+                    nr_read_regions = 0
+            offset += len(line)
+    return index
+
+def iter_perf_script_snapshots(file_path, target=None, time_range=None,
+        target_ids=None, addr_range=None):
+    '''Yields snapshots of a perf script output file in the file order.  If
+    'time_range' is given and the index of the file has saved, the reading
+    starts from the snapshots that could overlap with the range'''
+    index = None
+    if time_range:
+        index = load_record_index(file_path)
+    if index == None or len(index) == 0:
+        return iter_aggregated_events_snapshots(
+                iter_perf_script_events(file_path), None, target, addr_range)
+    start, last_end_times = index_window(index, target_ids, time_range)
+    if start == len(index):
+        return iter([])
+    return iter_aggregated_events_snapshots(
+            iter_perf_script_events(file_path, index.offsets[start]),
+            last_end_times, target, addr_range)
+
+def perf_data_to_damon_result(file_path):
+    '''Reads damon_aggregated tracepoint samples in a perf.data file without
+    'perf script'.  Returns DAMONResult and an error string'''
+    result = DAMONResult()
+    try:
+        for snapshot in iter_aggregated_events_snapshots(
+                iter_perf_data_events(file_path)):
+            if not snapshot.target_id in result.target_snapshots:
+                result.target_snapshots[snapshot.target_id] = []
+            result.target_snapshots[snapshot.target_id].append(snapshot)
+    except (IOError, OSError, ValueError, struct.error) as e:
+        return None, 'reading perf.data failed (%s)' % e
+    return result, None
 
 file_type_record = 'record'             # damo defined binary format
 file_type_perf_script = 'perf_script'   # perf script output
+file_type_perf_data = 'perf_data'       # perf record output
+file_type_segments = 'segments'         # manifest of rotated record segments
+file_type_npy = 'npy'                   # .npy arrays directory or .npz file
 
-def parse_damon_result_for(result_file, f, fmt_version, max_secs):
-    output = subprocess.check_output(
-            ['file', '-b', result_file]).decode().strip()
-    if output == 'ASCII text':
-        file_type = file_type_perf_script
-    else:
-        try:
-            script_output = subprocess.check_output(
-                    ['perf', 'script', '-i', result_file]).decode()
-            file_type = file_type_perf_script
-        except:
-            file_type = file_type_record
+def is_text(buf):
+    for c in bytearray(buf):
+        if c >= 0x7f or (c < 0x20 and not c in b'\t\n\r'):
+            return False
+    return True
+
+def get_file_type(result_file):
+    '''Returns the type of the given monitoring result file, by reading only
+    the head of the file'''
+    if os.path.isdir(result_file):
+        return file_type_npy
+    with open(result_file, 'rb') as f:
+        head = f.read(4096)
+    if head.startswith(b'damon_recfmt_ver'):
+        return file_type_record
+    if head.startswith(segments_manifest_mark):
+        return file_type_segments
+    if head.startswith(b'PERFILE2'):
+        return file_type_perf_data
+    if head.startswith(b'PK\x03\x04'):
+        return file_type_npy
+    if len(head) > 0 and is_text(head):
+        return file_type_perf_script
+    # record format version 0 has no header
+    return file_type_record
 
+def parse_damon_result_for(result_file):
+    '''Returns DAMONResult of the file and an error string'''
+    file_type = get_file_type(result_file)
     if file_type == file_type_record:
-        result, f, fmt_version, err = record_to_damon_result(result_file,
-                f, fmt_version, max_secs)
-        if err:
-            return None, None, None, err
+        result, f, fmt_version, err = mmap_record_to_damon_result(result_file)
+        # the mapped buffer is still valid
+        f.close()
     elif file_type == file_type_perf_script:
-        result, f = perf_script_to_damon_result(result_file, f, max_secs)
-        fmt_version = None
+        result, err = parse_perf_script_file(result_file), None
+    elif file_type == file_type_perf_data:
+        result, err = perf_data_to_damon_result(result_file)
+    elif file_type == file_type_segments:
+        result, err = segments_to_damon_result(result_file)
+    elif file_type == file_type_npy:
+        result, err = npy_to_damon_result(result_file)
     else:
-        print('unknown result file type: %s (%s)' % (file_type, result_file))
-        return None
+        return None, 'unknown result file type: %s' % file_type
+    if err:
+        return None, err
 
     for snapshots in result.target_snapshots.values():
         if len(snapshots) < 2:
@@ -234,7 +1439,11 @@ def parse_damon_result_for(result_file, f, fmt_version, max_secs):
             result.end_time = end_time
             result.nr_snapshots = nr_snapshots + 1
 
-        snapshots[0].start_time = snapshots[0].end_time - snapshot_time
+        first_start_time = snapshots[0].end_time - snapshot_time
+        if isinstance(snapshots, DAMONRecordSnapshots):
+            snapshots.first_start_time = first_start_time
+        else:
+            snapshots[0].start_time = first_start_time
 
         # cut out the fake snapshot for end time
         if len(snapshots) == 2 and len(snapshots[1].regions) == 1:
@@ -243,41 +1452,893 @@ def parse_damon_result_for(result_file, f, fmt_version, max_secs):
                     region.nr_accesses == -1 and region.age == -1):
                 del snapshots[1]
 
-    return result, f, fmt_version, None
+    return result, None
+
+# _damon_result_cache.ResultCache for caching parsed results, if not None
+result_cache = None
 
 def parse_damon_result(result_file):
-    result, f, fmt_version, err = parse_damon_result_for(result_file, None,
-            None, None)
+    if result_cache != None:
+        result = result_cache.get(result_file)
+        if result != None:
+            return result, None
+
+    result, err = parse_damon_result_for(result_file)
     if err:
         return None, err
-    f.close()
+
+    if result_cache != None:
+        # failing the caching is not a problem of the parsing
+        result_cache.put(result_file, result)
     return result, None
 
-def write_damon_record(result, file_path, format_version, file_permission):
+class DAMONResultInfo:
+    '''Summary of a monitoring results file.  'snapshot_time' is the
+    average time interval between snapshots'''
+    file_type = None
+    target_ids = None
+    nr_target_snapshots = None
+    start_time = None
+    end_time = None
+    nr_snapshots = None
+    snapshot_time = None
+
+    def __init__(self, file_type):
+        self.file_type = file_type
+        self.target_ids = []
+        self.nr_target_snapshots = {}
+
+def iter_raw_snapshots(result_file, file_type, target=None, time_range=None,
+        target_ids=None, addr_range=None):
+    '''Yields snapshots of a file in the file order.  The start time of the
+    first snapshot of each target is None.  Snapshots of targets other than
+    'target', or not overlapping with 'time_range' could also be yielded.
+    Regions of the snapshots are filtered by 'addr_range', if given'''
+    if file_type == file_type_record:
+        snapshots = iter_record_snapshots(result_file, target, time_range,
+                target_ids, addr_range)
+    elif file_type == file_type_perf_script:
+        snapshots = iter_perf_script_snapshots(result_file, target,
+                time_range, target_ids, addr_range)
+    elif file_type == file_type_segments:
+        snapshots = iter_segments_snapshots(result_file, target, time_range,
+                addr_range)
+    elif file_type == file_type_npy:
+        snapshots = iter_npy_snapshots(result_file, target, addr_range)
+    else:
+        snapshots = iter_aggregated_events_snapshots(
+                iter_perf_data_events(result_file), None, target, addr_range)
+    return iter_window_snapshots(snapshots, time_range)
+
+def get_result_info(result_file):
+    '''Returns DAMONResultInfo of a file and an error string.  Snapshots
+    are not kept in memory.  If the file has an index, only the index is
+    read'''
+    file_type = get_file_type(result_file)
+    info = DAMONResultInfo(file_type)
+    if result_cache != None:
+        result, err = parse_damon_result(result_file)
+        if err:
+            return None, err
+        for target_id, snapshots in result.target_snapshots.items():
+            info.target_ids.append(target_id)
+            info.nr_target_snapshots[target_id] = len(snapshots)
+        info.start_time = result.start_time
+        info.end_time = result.end_time
+        info.nr_snapshots = result.nr_snapshots
+        if result.nr_snapshots:
+            info.snapshot_time = (float(result.end_time - result.start_time) /
+                    result.nr_snapshots)
+        return info, None
+
+    if file_type == file_type_segments:
+        segments, err = read_segments_manifest(result_file)
+        if err:
+            return None, err
+        return segments_info(segments), None
+
+    # first and last snapshot end times of each target
+    target_end_times = {}
+    try:
+        index = None
+        if file_type == file_type_record:
+            f, buf, index = open_record(result_file)
+            f.close()
+        elif file_type == file_type_perf_script:
+            index = load_record_index(result_file)
+        if index != None:
+            end_times = [[record_index_target_id(index, i),
+                index.end_times[i]] for i in range(len(index))]
+        else:
+            end_times = ([s.target_id, s.end_time] for s in
+                    iter_raw_snapshots(result_file, file_type))
+        for target_id, end_time in end_times:
+            if not target_id in target_end_times:
+                info.target_ids.append(target_id)
+                info.nr_target_snapshots[target_id] = 0
+                target_end_times[target_id] = [end_time, end_time]
+            target_end_times[target_id][1] = end_time
+            info.nr_target_snapshots[target_id] += 1
+    except (IOError, OSError, ValueError, struct.error) as e:
+        return None, 'reading %s failed (%s)' % (result_file, e)
+
+    # same to parse_damon_result_for()
+    for target_id in info.target_ids:
+        start_time, end_time = target_end_times[target_id]
+        nr_snapshots = info.nr_target_snapshots[target_id]
+        if nr_snapshots < 2:
+            break
+        info.snapshot_time = float(end_time - start_time) / (nr_snapshots - 1)
+        info.start_time = start_time - info.snapshot_time
+        info.end_time = end_time
+        info.nr_snapshots = nr_snapshots
+        break
+    return info, None
+
+def iter_result_snapshots(result):
+    '''Yields snapshots of a DAMONResult in the time order'''
+    target_snapshots = [iter(snapshots)
+            for snapshots in result.target_snapshots.values()]
+    queue = []
+    for idx, snapshots in enumerate(target_snapshots):
+        for snapshot in snapshots:
+            heapq.heappush(queue, (snapshot.end_time, idx, snapshot))
+            break
+    while queue:
+        end_time, idx, snapshot = heapq.heappop(queue)
+        yield snapshot
+        for snapshot in target_snapshots[idx]:
+            heapq.heappush(queue, (snapshot.end_time, idx, snapshot))
+            break
+
+def is_fake_snapshot(snapshot):
+    if len(snapshot.starts) != 1:
+        return False
+    region = snapshot.regions[0]
+    return (region.start == 0 and region.end == 0 and
+            region.nr_accesses == -1 and region.age == -1)
+
+def filter_snapshots(snapshots, info, target, time_range, addr_range):
+    for snapshot in snapshots:
+        target_id = snapshot.target_id
+        if target != None and target_id != target:
+            continue
+        if snapshot.start_time == None:
+            if info.snapshot_time != None:
+                snapshot.start_time = (snapshot.end_time -
+                        info.snapshot_time)
+        # cut out the fake snapshot for end time.  The address range never
+        # overlaps with the fake region
+        elif (info.nr_target_snapshots[target_id] == 2 and
+                (is_fake_snapshot(snapshot) or
+                    (addr_range and len(snapshot.starts) == 0))):
+            continue
+        start_time = snapshot.start_time
+        if start_time == None:
+            start_time = snapshot.end_time
+        if time_range and (snapshot.end_time <= time_range[0] or
+                start_time >= time_range[1]):
+            continue
+        yield snapshot
+
+def iter_addr_filtered_snapshots(snapshots, addr_range):
+    for snapshot in snapshots:
+        filter_snapshot_regions(snapshot, addr_range)
+        yield snapshot
+
+def iter_snapshots(result_file, target=None, time_range=None, info=None,
+        addr_range=None):
+    '''Returns a generator of the snapshots in a monitoring results file and
+    an error string.  The snapshots are yielded in the file order, one by
+    one, so that the memory usage is constant.  Only snapshots of 'target'
+    and overlapping with 'time_range' are yielded if those are given.  If
+    'addr_range' is given, the snapshots have only regions overlapping with
+    the range.  Snapshots of other targets and regions out of the address
+    range are skipped without decoding where possible.  The start time of
+    the first snapshot of each target is set as same to that of
+    parse_damon_result().  The DAMONResultInfo of the file can be given as
+    'info' to avoid reading it again'''
+    if info == None:
+        info, err = get_result_info(result_file)
+        if err:
+            return None, err
+    if result_cache != None:
+        result, err = parse_damon_result(result_file)
+        if err:
+            return None, err
+        snapshots = iter_result_snapshots(result)
+        if addr_range:
+            snapshots = iter_addr_filtered_snapshots(snapshots, addr_range)
+    else:
+        snapshots = iter_raw_snapshots(result_file, info.file_type, target,
+                time_range, info.target_ids, addr_range)
+    return filter_snapshots(snapshots, info, target, time_range,
+            addr_range), None
+
+# Snapshots could be exported as NumPy arrays, in a directory of .npy files or
+# in a .npz file.  'target_ids' has the target ids.  Arrays of the target of
+# index N of 'target_ids' are named 'N_<column>'.  Snapshot i of the target
+# has the regions from 'region_offsets'[i] to 'region_offsets'[i + 1] of the
+# region columns.  Unknown start times are NaN.
+npy_snapshot_columns = [['start_times', 'd'], ['end_times', 'q'],
+        ['region_offsets', 'q']]
+npy_region_columns = [['starts', 'Q'], ['ends', 'Q'], ['nr_accesses', 'q'],
+        ['ages', 'q']]
+
+def snapshots_to_npy_arrays(snapshots):
+    '''Returns a dict of the names and array.array objects of the NumPy
+    export of the snapshots'''
+    target_ids = array.array('Q')
+    target_arrays = {}
+    for snapshot in snapshots:
+        target_id = snapshot.target_id
+        if not target_id in target_arrays:
+            target_ids.append(target_id & 0xffffffffffffffff)
+            arrays = {name: array.array(typecode) for name, typecode in
+                    npy_snapshot_columns + npy_region_columns}
+            arrays['region_offsets'].append(0)
+            target_arrays[target_id] = arrays
+        arrays = target_arrays[target_id]
+        arrays['start_times'].append(float('nan')
+                if snapshot.start_time == None else snapshot.start_time)
+        arrays['end_times'].append(snapshot.end_time)
+        arrays['starts'].extend(snapshot.starts)
+        arrays['ends'].extend(snapshot.ends)
+        arrays['nr_accesses'].extend(snapshot.nr_accesses)
+        arrays['ages'].extend(snapshot.ages)
+        arrays['region_offsets'].append(len(arrays['starts']))
+
+    named_arrays = {'target_ids': target_ids}
+    for idx, arrays in enumerate(target_arrays.values()):
+        for name, arr in arrays.items():
+            named_arrays['%d_%s' % (idx, name)] = arr
+    return named_arrays
+
+def write_npy_snapshots(snapshots, path, npz):
+    '''Writes the snapshots as NumPy arrays in a .npz file, or .npy files
+    of a directory if 'npz' is False'''
+    arrays = snapshots_to_npy_arrays(snapshots)
+    if not npz:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name, arr in arrays.items():
+            _damo_npy.write_npy(os.path.join(path, name + '.npy'), arr)
+        return
+
+    tmp_path = path + '.tmp'
+    try:
+        # not compressed, to be loaded without decompression
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as z:
+            for name, arr in arrays.items():
+                z.writestr(name + '.npy', _damo_npy.npy_bytes(arr))
+    except:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.rename(tmp_path, path)
+
+# local file header of zip file members, before the name and the extra field
+zip_local_file_head = struct.Struct('<4s22xHH')
+
+def read_npy_arrays(path):
+    '''Returns a dict of the names and the arrays of the NumPy export.  The
+    .npy files and the stored .npz members are memory-mapped, and the arrays
+    are memoryview objects of the mapped data'''
+    arrays = {}
+    if os.path.isdir(path):
+        for name in os.listdir(path):
+            if name.endswith('.npy'):
+                arrays[name[:-4]] = _damo_npy.mmap_npy(
+                        os.path.join(path, name))
+        return arrays
+    with open(path, 'rb') as f:
+        buf = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    with zipfile.ZipFile(path) as z:
+        for info in z.infolist():
+            name = info.filename
+            if not name.endswith('.npy'):
+                continue
+            if info.compress_type != zipfile.ZIP_STORED:
+                arrays[name[:-4]] = _damo_npy.parse_npy(z.read(name))
+                continue
+            mark, name_len, extra_len = zip_local_file_head.unpack_from(buf,
+                    info.header_offset)
+            if mark != b'PK\x03\x04':
+                raise ValueError('wrong zip local file header')
+            offset = (info.header_offset + zip_local_file_head.size +
+                    name_len + extra_len)
+            arrays[name[:-4]] = _damo_npy.view_npy(
+                    buf[offset:offset + info.file_size])
+    return arrays
+
+def iter_npy_target_snapshots(arrays, idx, target_id, addr_range):
+    start_times = arrays['%d_start_times' % idx]
+    end_times = arrays['%d_end_times' % idx]
+    offsets = arrays['%d_region_offsets' % idx]
+    columns = [arrays['%d_%s' % (idx, name)]
+            for name, typecode in npy_region_columns]
+    for i, end_time in enumerate(end_times):
+        start_time = start_times[i]
+        if math.isnan(start_time):
+            start_time = None
+        snapshot = DAMONSnapshot(start_time, end_time, target_id)
+        start, end = offsets[i], offsets[i + 1]
+        snapshot.starts, snapshot.ends, snapshot.nr_accesses, \
+                snapshot.ages = [_damo_npy.to_array(column[start:end])
+                        for column in columns]
+        if addr_range:
+            filter_snapshot_regions(snapshot, addr_range)
+        yield snapshot
+
+def npy_targets(path):
+    '''Returns the arrays of the NumPy export and a list of the target
+    ids'''
+    arrays = read_npy_arrays(path)
+    if not 'target_ids' in arrays:
+        raise ValueError('no target_ids array')
+    return arrays, arrays['target_ids'].tolist()
+
+def iter_npy_snapshots(path, target=None, addr_range=None):
+    '''Yields snapshots in the NumPy export, in the time order'''
+    arrays, target_ids = npy_targets(path)
+    target_snapshots = [iter_npy_target_snapshots(arrays, idx, target_id,
+        addr_range) for idx, target_id in enumerate(target_ids)
+        if target == None or target_id == target]
+    for snapshot in heapq.merge(*target_snapshots,
+            key=lambda snapshot: snapshot.end_time):
+        yield snapshot
+
+def npy_to_damon_result(path):
+    result = DAMONResult()
+    try:
+        arrays, target_ids = npy_targets(path)
+        for idx, target_id in enumerate(target_ids):
+            result.target_snapshots[target_id] = list(
+                    iter_npy_target_snapshots(arrays, idx, target_id, None))
+    except (IOError, OSError, ValueError, KeyError, SyntaxError,
+            zipfile.BadZipFile, struct.error) as e:
+        return None, 'reading numpy arrays failed (%s)' % e
+    return result, None
+
+# A record could be rotated into multiple segment files, which listed in a
+# manifest file of json format, together with the time ranges, target ids
+# and numbers of snapshots of the segments.
+segments_manifest_mark = b'{"damo_record_segments":'
+
+def write_segments_manifest(manifest_path, segment_paths):
+    '''Writes the manifest of the segment files.  Returns an error string'''
+    segments = []
+    for segment_path in segment_paths:
+        info, err = get_result_info(segment_path)
+        if err:
+            return err
+        first_end_time = None
+        if info.start_time != None:
+            first_end_time = info.start_time + info.snapshot_time
+        segments.append({
+            'file': os.path.relpath(segment_path,
+                os.path.dirname(os.path.abspath(manifest_path))),
+            'start_time': info.start_time, 'end_time': info.end_time,
+            'first_end_time': first_end_time,
+            'target_ids': info.target_ids,
+            'nr_target_snapshots': [info.nr_target_snapshots[tid]
+                for tid in info.target_ids]})
+    try:
+        with open(manifest_path, 'w') as f:
+            # the head of the file should be segments_manifest_mark
+            json.dump({'damo_record_segments': 1, 'segments': segments}, f)
+    except (IOError, OSError) as e:
+        return 'writing %s failed (%s)' % (manifest_path, e)
+    return None
+
+def read_segments_manifest(manifest_path):
+    '''Returns the segments listed in the manifest, having paths to the
+    segment files, and an error string'''
+    try:
+        with open(manifest_path, 'r') as f:
+            segments = json.load(f)['segments']
+    except (IOError, OSError, ValueError, KeyError) as e:
+        return None, 'reading %s failed (%s)' % (manifest_path, e)
+    for segment in segments:
+        segment['file'] = os.path.join(
+                os.path.dirname(os.path.abspath(manifest_path)),
+                segment['file'])
+    return segments, None
+
+def segments_info(segments):
+    '''Returns DAMONResultInfo of the segmented record, same to that of the
+    record that not segmented'''
+    info = DAMONResultInfo(file_type_segments)
+    first_end_times = {}
+    for segment in segments:
+        for tid, nr in zip(segment['target_ids'],
+                segment['nr_target_snapshots']):
+            if not tid in info.nr_target_snapshots:
+                info.target_ids.append(tid)
+                info.nr_target_snapshots[tid] = 0
+                first_end_times[tid] = segment['first_end_time']
+            info.nr_target_snapshots[tid] += nr
+    if not info.target_ids:
+        return info
+    tid = info.target_ids[0]
+    nr_snapshots = info.nr_target_snapshots[tid]
+    if nr_snapshots < 2 or first_end_times[tid] == None:
+        return info
+    end_time = segments[-1]['end_time']
+    info.snapshot_time = (float(end_time - first_end_times[tid]) /
+            (nr_snapshots - 1))
+    info.start_time = first_end_times[tid] - info.snapshot_time
+    info.end_time = end_time
+    info.nr_snapshots = nr_snapshots
+    return info
+
+def iter_segments_snapshots(manifest_path, target=None, time_range=None,
+        addr_range=None):
+    '''Yields snapshots in the segments of a segmented record.  Only
+    segments overlapping with 'time_range' are read'''
+    segments, err = read_segments_manifest(manifest_path)
+    if err:
+        raise ValueError(err)
+    last_end_times = {}
+    for segment in segments:
+        if time_range and (segment['end_time'] != None and
+                segment['end_time'] <= time_range[0]):
+            continue
+        if time_range and (segment['start_time'] != None and
+                segment['start_time'] >= time_range[1]):
+            break
+        segment_path = segment['file']
+        snapshots = iter_raw_snapshots(segment_path,
+                get_file_type(segment_path), target, time_range,
+                segment['target_ids'])
+        for snapshot in snapshots:
+            if snapshot.start_time == None:
+                snapshot.start_time = last_end_times.get(snapshot.target_id)
+            last_end_times[snapshot.target_id] = snapshot.end_time
+            if addr_range:
+                filter_snapshot_regions(snapshot, addr_range)
+            yield snapshot
+
+def segments_to_damon_result(manifest_path):
+    result = DAMONResult()
+    try:
+        for snapshot in iter_segments_snapshots(manifest_path):
+            if not snapshot.target_id in result.target_snapshots:
+                result.target_snapshots[snapshot.target_id] = []
+            result.target_snapshots[snapshot.target_id].append(snapshot)
+    except (IOError, OSError, ValueError, struct.error) as e:
+        return None, 'reading segments failed (%s)' % e
+    return result, None
+
+def first_event_time(perf_data_path):
+    for event in iter_perf_data_events(perf_data_path):
+        return event[0]
+    return None
+
+def write_record_segments(file_path, perf_data_paths, file_type,
+        file_permission, compression=None, format_version=None):
+    '''Converts perf.data files that rotated by 'perf record' into segment
+    files of the type, namely '<file_path>.<N>', and writes the manifest of
+    those to 'file_path'.  Snapshots that split by the rotation are put in
+    the segment that having the start of the snapshots.  Returns the paths
+    to the segment files and an error string'''
+    try:
+        start_times = []
+        events = []
+        for path in perf_data_paths:
+            start_time = first_event_time(path)
+            if start_time == None:
+                continue
+            start_times.append(start_time)
+            events.append(iter_perf_data_events(path))
+        events = itertools.chain(*events)
+
+        def segment_idx(snapshot):
+            return bisect.bisect_right(start_times, snapshot.end_time) - 1
+
+        segment_paths = []
+        # the fake snapshots for the end time are appended to the last one
+        for idx, snapshots in itertools.groupby(iter_faked_snapshots(
+                iter_aggregated_events_snapshots(events)), segment_idx):
+            segment_path = '%s.%d' % (file_path, len(segment_paths))
+            write_snapshots(snapshots, segment_path,
+                    file_type, file_permission, compression,
+                    format_version=format_version)
+            segment_paths.append(segment_path)
+    except (IOError, OSError, ValueError, struct.error) as e:
+        return None, 'converting segments failed (%s)' % e
+    err = write_segments_manifest(file_path, segment_paths)
+    if err:
+        return None, err
+    for path in perf_data_paths:
+        os.remove(path)
+    return segment_paths, None
+
+class DAMONResultFollower:
+    '''Reads snapshots appended to a monitoring results file that is being
+    written.  Only completely written snapshots are read, and the offset
+    after those is remembered, so that each read() reads only the newly
+    appended data.  The first snapshot of each target is returned together
+    with the next one, as its start time is estimated from the interval
+    between those.  'finished' is set once the footer of the file is read,
+    or the recording of the perf.data file is finished.  perf.data files are
+    read up to the last FINISHED_ROUND record'''
+    file_path = None
+    file_type = None
+    fmt_version = None
+    offset = None
+    finished = False
+    last_end_times = None   # {target id: end time of the last snapshot}
+    first_snapshots = None  # {target id: first snapshot}
+    perf_data_attr = None
+    decode_event = None     # perf_data_event_decoder() returned function
+    samples_queue = None    # _damo_perf_data.SamplesQueue
+    pending_events = None   # events of the incompletely read snapshot
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.last_end_times = {}
+        self.first_snapshots = {}
+        self.pending_events = []
+
+    def open(self):
+        '''Reads the file type and the format version, if enough data is
+        written.  Returns an error string'''
+        with open(self.file_path, 'rb') as f:
+            head = f.read(20)
+        # the head could be partially written
+        if len(head) < 20:
+            return None
+        file_type = get_file_type(self.file_path)
+        if file_type in [file_type_segments, file_type_npy]:
+            return 'following %s is not supported' % file_type
+        if file_type == file_type_perf_data:
+            return self.open_perf_data()
+        self.offset = 0
+        if file_type == file_type_record:
+            self.fmt_version, self.offset = read_record_fmt_version(head)
+            if self.fmt_version in [4, 5]:
+                return 'following format version %d record is not supported' \
+                        % self.fmt_version
+        self.file_type = file_type
+        return None
+
+    def open_perf_data(self):
+        perf_data, err = _damo_perf_data.read_perf_data(self.file_path)
+        # the header could be partially written
+        if err != None or os.path.getsize(self.file_path) < (
+                perf_data.data_offset):
+            return None
+        try:
+            self.perf_data_attr, self.decode_event = perf_data_event_decoder(
+                    perf_data)
+        except ValueError as e:
+            return 'reading %s failed (%s)' % (self.file_path, e)
+        self.samples_queue = _damo_perf_data.SamplesQueue()
+        self.offset = perf_data.data_offset
+        self.file_type = file_type_perf_data
+        return None
+
+    def read_perf_data(self):
+        '''Returns completely written snapshots in the perf.data file after
+        the last read'''
+        perf_data, err = _damo_perf_data.read_perf_data(self.file_path)
+        if err != None:
+            raise ValueError(err)
+        # the attrs are read again with the header
+        attr = perf_data.attr_of_config(self.perf_data_attr.type_,
+                self.perf_data_attr.config)
+        samples, self.offset = perf_data.round_samples(attr, self.offset,
+                self.samples_queue)
+        events = self.pending_events
+        for end_time, raw in samples:
+            event = self.decode_event(end_time, raw)
+            if event != None:
+                events.append(event)
+        nr_events = 0
+        nr_read_regions = 0
+        for idx, event in enumerate(events):
+            nr_read_regions += 1
+            if nr_read_regions == event[2]:
+                nr_read_regions = 0
+                nr_events = idx + 1
+        if not perf_data.recording:
+            # incompletely recorded snapshots are also read
+            nr_events = len(events)
+            self.finished = True
+        self.pending_events = events[nr_events:]
+        return list(iter_aggregated_events_snapshots(events[:nr_events]))
+
+    def decode_record(self, buf):
+        '''Returns completely written snapshots in the record data 'buf' and
+        the size of those'''
+        snapshots = []
+        offset = 0
+        if self.fmt_version == 6:
+            for payload_offset, length in record_v6_frames(buf, 0, len(buf)):
+                if not record_v6_frame_valid(buf[offset:payload_offset],
+                        buf[payload_offset:payload_offset + length]):
+                    break
+                snapshots.append(decode_record_snapshot(buf, payload_offset,
+                    6, None, None))
+                offset = payload_offset + length
+            return snapshots, offset
+        if self.fmt_version == 3:
+            while offset + record_v3_snapshot_head.size <= len(buf):
+                nr_regions = record_v3_snapshot_head.unpack_from(buf,
+                        offset)[2]
+                next_offset = (offset + record_v3_snapshot_head.size +
+                        nr_regions * 32)
+                if next_offset > len(buf):
+                    break
+                snapshots.append(decode_record_snapshot(buf, offset, 3,
+                    None, None))
+                offset = next_offset
+            return snapshots, offset
+
+        task_head = record_task_heads[1 if self.fmt_version == 1 else 2]
+        while offset + record_snapshot_head.size <= len(buf):
+            sec, nsec, nr_tasks = record_snapshot_head.unpack_from(buf,
+                    offset)
+            end_time = sec * 1000000000 + nsec
+            task_offsets = []
+            next_offset = offset + record_snapshot_head.size
+            for t in range(nr_tasks):
+                if next_offset + task_head.size > len(buf):
+                    return snapshots, offset
+                task_offsets.append(next_offset)
+                nr_regions = task_head.unpack_from(buf, next_offset)[1]
+                next_offset += task_head.size + nr_regions * record_region.size
+            if next_offset > len(buf):
+                break
+            for task_offset in task_offsets:
+                snapshots.append(decode_record_snapshot(buf, task_offset,
+                    self.fmt_version, None, end_time))
+            offset = next_offset
+        return snapshots, offset
+
+    def decode_perf_script(self, buf):
+        '''Returns completely written snapshots in the perf script output
+        'buf' and the size of those'''
+        events = []
+        offset = 0
+        line_offset = 0
+        nr_read_regions = 0
+        nr_events = 0
+        for line in buf.split(b'\n')[:-1]:
+            line_offset += len(line) + 1
+            event = parse_perf_script_line(line)
+            if event == None:
+                continue
+            events.append(event)
+            nr_read_regions += 1
+            if nr_read_regions == event[2]:
+                nr_read_regions = 0
+                nr_events = len(events)
+                offset = line_offset
+        return list(iter_aggregated_events_snapshots(events[:nr_events])), \
+                offset
+
+    def set_start_times(self, snapshots):
+        '''Sets start times of the snapshots and returns those, excluding
+        the first snapshots of targets that no next snapshot is read, and the
+        fake snapshots'''
+        ready = []
+        for snapshot in snapshots:
+            target_id = snapshot.target_id
+            first = self.first_snapshots.pop(target_id, None)
+            if first != None:
+                first.start_time = first.end_time - (snapshot.end_time -
+                        first.end_time)
+                ready.append(first)
+            snapshot.start_time = self.last_end_times.get(target_id)
+            self.last_end_times[target_id] = snapshot.end_time
+            if snapshot.start_time == None:
+                self.first_snapshots[target_id] = snapshot
+            elif not is_fake_snapshot(snapshot):
+                ready.append(snapshot)
+        return ready
+
+    def read(self):
+        '''Returns snapshots that completely written after the last call,
+        and an error string'''
+        try:
+            if self.file_type == None:
+                if not os.path.isfile(self.file_path):
+                    return [], None
+                err = self.open()
+                if err != None or self.file_type == None:
+                    return [], err
+            if self.file_type == file_type_perf_data:
+                return self.set_start_times(self.read_perf_data()), None
+            with open(self.file_path, 'rb') as f:
+                f.seek(self.offset)
+                buf = f.read()
+            if self.file_type == file_type_perf_script:
+                snapshots, size = self.decode_perf_script(buf)
+            else:
+                footer = None
+                if self.fmt_version in [3, 6]:
+                    footer_mark = record_v3_footer_mark
+                    if self.fmt_version == 6:
+                        footer_mark = record_v6_footer_mark
+                    footer = read_record_v3_footer(
+                            buf[len(buf) - record_v3_footer.size:],
+                            self.offset + len(buf), footer_mark)
+                # the index and the footer are not snapshots
+                if footer != None and footer[0] >= self.offset:
+                    buf = buf[:footer[0] - self.offset]
+                snapshots, size = self.decode_record(buf)
+                if footer != None and footer[0] == self.offset + size:
+                    self.finished = True
+        except (IOError, OSError, ValueError, struct.error) as e:
+            return [], 'reading %s failed (%s)' % (self.file_path, e)
+        self.offset += size
+        return self.set_start_times(snapshots), None
+
+def follow_snapshots(result_file, interval):
+    '''Yields lists of snapshots that appended to a monitoring results file
+    that is being written, checking the file every 'interval' seconds.
+    Raises ValueError on reading failures'''
+    follower = DAMONResultFollower(result_file)
+    while True:
+        snapshots, err = follower.read()
+        if err != None:
+            raise ValueError(err)
+        if snapshots:
+            yield snapshots
+        if follower.finished:
+            return
+        time.sleep(interval)
+
+# record format version that damo writes by default
+default_record_fmt_version = 2
+
+def record_v3_snapshot_bytes(snapshot, offset):
+    return b''.join([record_v3_snapshot_head.pack(snapshot.end_time,
+        snapshot.target_id & 0xffffffffffffffff, len(snapshot.starts))] +
+        [le_column_bytes(column) for column in [snapshot.starts,
+            snapshot.ends, snapshot.nr_accesses, snapshot.ages]])
+
+def iter_result_write_order(result):
+    '''Yields snapshots of a DAMONResult in the order that the writers
+    write those'''
+    for snapshot_idx in range(result.nr_snapshots):
+        for tid in result.target_snapshots:
+            yield result.target_snapshots[tid][snapshot_idx]
+
+def record_v6_snapshot_bytes(snapshot, offset):
+    return record_v6_frame_bytes(record_v3_snapshot_bytes(snapshot, offset))
+
+def write_record_snapshots(snapshots, f, encode, footer_mark, compression,
+        frame_head_size=0):
+    '''Writes the snapshots encoded by 'encode()' and the footer index, for
+    the format version 3 or later.  If 'compression' is not None, the
+    snapshots are packed into blocks that compressed using it.  The index
+    points the snapshots after the frame headers of 'frame_head_size'
+    bytes'''
+    offsets = array.array('Q')
+    end_times = array.array('Q')
+    target_ids = array.array('Q')
+    offset = f.tell()
+    block = []
+    block_size = 0
+    if compression != None:
+        offset = 0
+
+    for snapshot in snapshots:
+        offsets.append(offset + frame_head_size)
+        end_times.append(snapshot.end_time)
+        target_ids.append(snapshot.target_id & 0xffffffffffffffff)
+        data = encode(snapshot, offset)
+        offset += len(data)
+        if compression == None:
+            f.write(data)
+            continue
+        block.append(data)
+        block_size += len(data)
+        if block_size >= record_v4_block_size:
+            write_record_v4_block(f, b''.join(block), compression)
+            block = []
+            block_size = 0
+    if block:
+        write_record_v4_block(f, b''.join(block), compression)
+
+    index_offset = f.tell()
+    for column in [offsets, end_times, target_ids]:
+        f.write(le_column_bytes(column))
+    f.write(record_v3_footer.pack(index_offset, len(offsets), footer_mark))
+
+def write_record_v4_block(f, data, compression):
+    compressed = compress_block(data, compression)
+    f.write(record_v4_block_head.pack(len(compressed), len(data)))
+    f.write(compressed)
+
+def write_record_file(snapshots, file_path, format_version,
+        file_permission, compression=None, delta=False):
+    '''Writes the snapshots in a record file of the format version.  If
+    'delta' is True, the format version 5 is used.  Otherwise, if
+    'compression' ('zlib' or 'lzma') is given, the format version 4 is
+    used'''
     with open(file_path, 'wb', file_permission) as f:
         f.write(b'damon_recfmt_ver')
+        if delta:
+            compression = record_compressions.get(compression,
+                    record_no_compression)
+            f.write(struct.pack('<ii', 5, compression))
+            write_record_snapshots(snapshots, f, RecordV5Encoder().encode,
+                    record_v5_footer_mark, compression)
+            return
+        if compression:
+            compression = record_compressions[compression]
+            f.write(struct.pack('<ii', 4, compression))
+            write_record_snapshots(snapshots, f, record_v3_snapshot_bytes,
+                    record_v4_footer_mark, compression)
+            return
+        if format_version == 3:
+            f.write(struct.pack('<i', format_version))
+            write_record_snapshots(snapshots, f, record_v3_snapshot_bytes,
+                    record_v3_footer_mark, None)
+            return
+        if format_version == 6:
+            f.write(struct.pack('<i', format_version))
+            write_record_snapshots(snapshots, f, record_v6_snapshot_bytes,
+                    record_v6_footer_mark, None, record_v6_frame_head.size)
+            return
         f.write(struct.pack('i', format_version))
+        write_record_v2_snapshots(snapshots, f, format_version)
 
-        for snapshot_idx in range(result.nr_snapshots):
-            for tid in result.target_snapshots:
-                snapshot = result.target_snapshots[tid][snapshot_idx]
-                f.write(struct.pack('l', snapshot.end_time // 1000000000))
-                f.write(struct.pack('l', snapshot.end_time % 1000000000))
+def write_damon_record(result, file_path, format_version, file_permission,
+        compression=None, delta=False):
+    '''Writes the result in a record file, like write_record_file()'''
+    write_record_file(iter_result_write_order(result), file_path,
+            format_version, file_permission, compression, delta)
 
-                f.write(struct.pack('I', 1))
+# size of the chunks that the writers flush at once
+write_chunk_sz = 1 << 20
 
-                if format_version == 1:
-                    f.write(struct.pack('i', snapshot.target_id))
-                else:
-                    f.write(struct.pack('L', snapshot.target_id))
+def record_v2_snapshot_bytes(snapshot, task_head):
+    nr_regions = len(snapshot.starts)
+    buf = bytearray(record_snapshot_head.size + task_head.size +
+            nr_regions * record_region.size)
+    record_snapshot_head.pack_into(buf, 0, snapshot.end_time // 1000000000,
+            snapshot.end_time % 1000000000, 1)
+    offset = record_snapshot_head.size
+    task_head.pack_into(buf, offset, snapshot.target_id, nr_regions)
+    offset += task_head.size
+    pack_into = record_region.pack_into
+    region_sz = record_region.size
+    for start, end, nr_accesses in zip(snapshot.starts, snapshot.ends,
+            snapshot.nr_accesses):
+        pack_into(buf, offset, start, end, nr_accesses)
+        offset += region_sz
+    return buf
 
-                f.write(struct.pack('I', len(snapshot.regions)))
-                for region in snapshot.regions:
-                    f.write(struct.pack('L', region.start))
-                    f.write(struct.pack('L', region.end))
-                    f.write(struct.pack('I', region.nr_accesses))
+def write_record_v2_snapshots(snapshots, f, format_version):
+    task_head = record_task_heads[format_version]
+    chunk = []
+    chunk_sz = 0
+    for snapshot in snapshots:
+        data = record_v2_snapshot_bytes(snapshot, task_head)
+        chunk.append(data)
+        chunk_sz += len(data)
+        if chunk_sz >= write_chunk_sz:
+            f.write(b''.join(chunk))
+            chunk = []
+            chunk_sz = 0
+    f.write(b''.join(chunk))
 
-def write_damon_perf_script(result, file_path, file_permission):
+def perf_script_snapshot_text(snapshot):
+    prefix = ('kdamond.x xxxx xxxx %f: damon:damon_aggregated: '
+            'target_id=%s nr_regions=%d ' % (
+                snapshot.end_time / 1000000000.0, snapshot.target_id,
+                len(snapshot.starts)))
+    return ''.join(['%s%d-%d: %d %s\n' % (prefix, start, end, nr_accesses,
+        None if age == age_unknown else age)
+        for start, end, nr_accesses, age in zip(snapshot.starts,
+            snapshot.ends, snapshot.nr_accesses, snapshot.ages)])
+
+def write_perf_script_file(snapshots, file_path, file_permission):
     '''
     Example of the normal perf script output:
 
@@ -287,82 +2348,417 @@ def write_damon_perf_script(result, file_path, file_permission):
     '''
 
     with open(file_path, 'w', file_permission) as f:
-        for snapshot_idx in range(result.nr_snapshots):
-            for tid in result.target_snapshots:
-                snapshot = result.target_snapshots[tid][snapshot_idx]
-                for region in snapshot.regions:
-                    f.write(' '.join(['kdamond.x', 'xxxx', 'xxxx',
-                        '%f:' % (snapshot.end_time / 1000000000.0),
-                        'damon:damon_aggregated:',
-                        'target_id=%s' % snapshot.target_id,
-                        'nr_regions=%d' % len(snapshot.regions),
-                        '%d-%d: %d %s' % (region.start, region.end,
-                            region.nr_accesses, region.age)]) + '\n')
-
-def write_damon_result(result, file_path, file_type, file_permission):
+        chunk = []
+        chunk_sz = 0
+        for snapshot in snapshots:
+            text = perf_script_snapshot_text(snapshot)
+            chunk.append(text)
+            chunk_sz += len(text)
+            if chunk_sz >= write_chunk_sz:
+                f.write(''.join(chunk))
+                chunk = []
+                chunk_sz = 0
+        f.write(''.join(chunk))
+
+def write_damon_perf_script(result, file_path, file_permission):
+    write_perf_script_file(iter_result_write_order(result), file_path,
+            file_permission)
+
+def fake_snapshot_of(snapshot):
+    '''Returns the fake snapshot that follows the single snapshot of a
+    target'''
+    # we cannot know start/end time of single snapshot from the file
+    # to allow it with later read, write a fake snapshot
+    snap_duration = snapshot.end_time - snapshot.start_time
+    fake_snapshot = DAMONSnapshot(snapshot.end_time,
+            snapshot.end_time + snap_duration, snapshot.target_id)
+    # -1 nr_accesses/ -1 age means fake
+    fake_snapshot.regions = [DAMONRegion(0, 0, -1, -1)]
+    return fake_snapshot
+
+def write_snapshots(snapshots, file_path, file_type, file_permission,
+        compression=None, delta=False, format_version=None):
+    '''Writes the snapshots in a file of the type.  The snapshots are
+    written to a temporary file that replaces the file at the end, so that
+    the file is not corrupted by failures, and the snapshots could be read
+    from the file itself.  Record files are written in 'format_version', or
+    default_record_fmt_version if it is None'''
+    if format_version == None:
+        format_version = default_record_fmt_version
+    if not file_type in [file_type_record, file_type_perf_script]:
+        print('unsupported file type: %s' % file_type)
+        return
+    tmp_path = file_path + '.tmp'
+    try:
+        if file_type == file_type_record:
+            write_record_file(snapshots, tmp_path, format_version,
+                    file_permission, compression, delta)
+        else:
+            write_perf_script_file(snapshots, tmp_path, file_permission)
+        os.rename(tmp_path, file_path)
+    except:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_damon_result(result, file_path, file_type, file_permission,
+        compression=None, delta=False, format_version=None):
     for target_snapshots in result.target_snapshots.values():
         if len(target_snapshots) == 1:
-            # we cannot know start/end time of single snapshot from the file
-            # to allow it with later read, write a fake snapshot
-            snapshot = target_snapshots[0]
-            snap_duration = snapshot.end_time - snapshot.start_time
-            fake_snapshot = DAMONSnapshot(snapshot.end_time,
-                    snapshot.end_time + snap_duration, snapshot.target_id)
-            # -1 nr_accesses/ -1 age means fake
-            fake_snapshot.regions = [DAMONRegion(0, 0, -1, -1)]
-            target_snapshots.append(fake_snapshot)
+            target_snapshots = list(target_snapshots)
+            result.target_snapshots[target_snapshots[0].target_id] = \
+                    target_snapshots
+            target_snapshots.append(fake_snapshot_of(target_snapshots[0]))
             result.nr_snapshots += 1
-    if file_type == file_type_record:
-        write_damon_record(result, file_path, 2, file_permission)
-    elif file_type == file_type_perf_script:
-        write_damon_perf_script(result, file_path, file_permission)
-    else:
-        print('unsupported file type: %s' % file_type)
+    write_snapshots(iter_result_write_order(result), file_path, file_type,
+            file_permission, compression, delta, format_version)
+
+def iter_faked_snapshots(snapshots):
+    '''Yields the snapshots, and the fake snapshots for targets having only
+    one snapshot'''
+    single_snapshots = {}
+    for snapshot in snapshots:
+        target_id = snapshot.target_id
+        if not target_id in single_snapshots:
+            # keep only the region-less copy
+            single = DAMONSnapshot(snapshot.start_time, snapshot.end_time,
+                    target_id)
+            single_snapshots[target_id] = single
+        else:
+            single_snapshots[target_id] = None
+        yield snapshot
+    for single in single_snapshots.values():
+        # the duration of the snapshot is unknown if the start time is None
+        if single != None and single.start_time != None:
+            yield fake_snapshot_of(single)
+
+def merged_target_ids(infos):
+    '''Returns a map from the target ids of each file to those in the merged
+    file.  Same target ids in different files are kept if the time ranges
+    of the files are not overlapping, e.g., those are time-sharded records
+    of same targets.  Otherwise, those are assumed to be different targets,
+    and mapped to target ids that not used in the files'''
+    used_ids = set([tid for info in infos for tid in info.target_ids])
+    next_id = 0
+    time_ranges = {}    # {merged target id: list of time ranges}
+    id_maps = []
+    for info in infos:
+        id_map = {}
+        time_range = [info.start_time, info.end_time]
+        for tid in info.target_ids:
+            new_id = tid
+            if tid in time_ranges and (time_range[0] == None or
+                    [r for r in time_ranges[tid] if r[0] == None or
+                        (time_range[0] < r[1] and r[0] < time_range[1])]):
+                while next_id in used_ids:
+                    next_id += 1
+                new_id = next_id
+                used_ids.add(new_id)
+            if not new_id in time_ranges:
+                time_ranges[new_id] = []
+            time_ranges[new_id].append(time_range)
+            id_map[tid] = new_id
+        id_maps.append(id_map)
+    return id_maps
+
+def iter_id_mapped_snapshots(snapshots, id_map):
+    for snapshot in snapshots:
+        snapshot.target_id = id_map[snapshot.target_id]
+        yield snapshot
+
+def merge_snapshots(result_files):
+    '''Returns a generator of the snapshots of the monitoring results files
+    merged in the end time order, and an error string.  The snapshots are
+    read one by one from each file.  Target ids of the files are mapped by
+    merged_target_ids()'''
+    infos = []
+    for result_file in result_files:
+        info, err = get_result_info(result_file)
+        if err:
+            return None, err
+        infos.append(info)
+    file_snapshots = []
+    for result_file, info, id_map in zip(result_files, infos,
+            merged_target_ids(infos)):
+        snapshots, err = iter_snapshots(result_file, info=info)
+        if err:
+            return None, err
+        file_snapshots.append(iter_id_mapped_snapshots(snapshots, id_map))
+    return heapq.merge(*file_snapshots, key=lambda s: s.end_time), None
 
-def update_result_file(file_path, file_format, file_permission):
-    result, err = parse_damon_result(file_path)
+def update_result_file(file_path, file_format, file_permission,
+        compression=None, format_version=None):
+    '''Converts the results file to the format.  The snapshots are read and
+    written one by one to a temporary file, which then replaces the file, so
+    that the memory usage is constant and the file is not corrupted by
+    failures'''
+    snapshots, err = iter_snapshots(file_path)
     if err:
         return err
-    write_damon_result(result, file_path, file_format, file_permission)
+    try:
+        write_snapshots(iter_faked_snapshots(snapshots), file_path,
+                file_format, file_permission, compression,
+                format_version=format_version)
+    except (IOError, OSError, ValueError, struct.error) as e:
+        return 'converting %s failed (%s)' % (file_path, e)
     return None
 
-def regions_intersect(r1, r2):
-    return not (r1.end <= r2.start or r2.end <= r1.start)
-
-def add_region(regions, region, nr_acc_to_add):
-    for r in regions:
-        if regions_intersect(r, region):
-            if not r in nr_acc_to_add:
-                nr_acc_to_add[r] = 0
-            nr_acc_to_add[r] = max(nr_acc_to_add[r], region.nr_accesses)
-
-            new_regions = []
-            if region.start < r.start:
-                new_regions.append(DAMONRegion(
-                    region.start, r.start, region.nr_accesses, region.age))
-            if r.end < region.end:
-                new_regions.append(DAMONRegion(
-                        r.end, region.end, region.nr_accesses, region.age))
-
-            for new_r in new_regions:
-                add_region(regions, new_r, nr_acc_to_add)
-            return
-    regions.append(region)
+# Aggregate snapshots using NumPy, if it is installed and this is True
+use_numpy = numpy != None
+
+def np_array_of(arr, dtype):
+    return numpy.frombuffer(arr, dtype=dtype) if len(arr) else numpy.zeros(
+            0, dtype=dtype)
+
+def array_of_np(typecode, np_arr):
+    arr = array.array(typecode)
+    arr.frombytes(np_arr.tobytes())
+    return arr
+
+def np_aggregatable(snapshot):
+    '''Returns whether np_aggregate_snapshots() can handle the snapshot.
+    Its regions should be non-empty, sorted and not overlapping'''
+    starts = np_array_of(snapshot.starts, numpy.uint64)
+    ends = np_array_of(snapshot.ends, numpy.uint64)
+    return bool(numpy.all(starts < ends) and
+            numpy.all(starts[1:] >= ends[:-1]))
+
+def np_aggregate_snapshots(snapshots):
+    '''NumPy version of aggregate_snapshots().  Returns None if the
+    snapshots cannot be handled'''
+    if not all(np_aggregatable(snapshot) for snapshot in snapshots):
+        return None
+    u64 = numpy.uint64
+    # columns of the aggregated regions in the creation order
+    starts = numpy.zeros(0, dtype=u64)
+    ends = numpy.zeros(0, dtype=u64)
+    nr_accesses = numpy.zeros(0, dtype=numpy.int64)
+    ages = numpy.zeros(0, dtype=numpy.int64)
+    # same to aggregate_snapshots()
+    sorted_starts = numpy.zeros(0, dtype=u64)
+    sorted_ends = numpy.zeros(0, dtype=u64)
+    sorted_idxs = numpy.zeros(0, dtype=numpy.int64)
+    for snapshot in snapshots:
+        if len(snapshot.starts) == 0:
+            continue
+        in_starts = np_array_of(snapshot.starts, u64)
+        in_ends = np_array_of(snapshot.ends, u64)
+        in_nr_accesses = np_array_of(snapshot.nr_accesses, numpy.int64)
+        in_ages = np_array_of(snapshot.ages, numpy.int64)
+
+        # maximum nr_accesses of the regions intersecting with each
+        # aggregated region.  Those are contiguous, from lo to hi
+        if len(sorted_starts):
+            lo = numpy.searchsorted(in_ends, sorted_starts, 'right')
+            hi = numpy.searchsorted(in_starts, sorted_ends, 'left')
+            bounds = numpy.empty(len(lo) * 2, dtype=numpy.intp)
+            bounds[0::2] = lo
+            bounds[1::2] = hi
+            # reduceat indices should be smaller than the length
+            maxs = numpy.maximum.reduceat(numpy.append(in_nr_accesses, 0),
+                    bounds)[0::2]
+            intersect = lo < hi
+            nr_accesses[sorted_idxs[intersect]] += numpy.maximum(
+                    maxs[intersect], 0)
+
+        # parts of the regions not covered by the aggregated regions, split
+        # by all the boundaries
+        bounds = numpy.unique(numpy.concatenate(
+            [in_starts, in_ends, sorted_starts, sorted_ends]))
+        piece_starts = bounds[:-1]
+        owners = numpy.searchsorted(in_ends, piece_starts, 'right')
+        in_region = owners < len(in_starts)
+        in_region[in_region] = (in_starts[owners[in_region]] <=
+                piece_starts[in_region])
+        covering = numpy.searchsorted(sorted_ends, piece_starts, 'right')
+        covered = covering < len(sorted_starts)
+        covered[covered] = (sorted_starts[covering[covered]] <=
+                piece_starts[covered])
+        gap_pieces = numpy.flatnonzero(in_region & ~covered)
+        if len(gap_pieces):
+            # contiguous pieces of same region make one gap
+            gap_owners = owners[gap_pieces]
+            firsts = numpy.ones(len(gap_pieces), dtype=bool)
+            firsts[1:] = ((gap_pieces[1:] != gap_pieces[:-1] + 1) |
+                    (gap_owners[1:] != gap_owners[:-1]))
+            lasts = numpy.ones(len(gap_pieces), dtype=bool)
+            lasts[:-1] = firsts[1:]
+            gap_starts = bounds[gap_pieces[firsts]]
+            gap_ends = bounds[gap_pieces[lasts] + 1]
+            gap_owners = gap_owners[firsts]
+
+            # the gaps are sorted, as the regions of the snapshot are
+            positions = numpy.searchsorted(sorted_starts, gap_starts)
+            sorted_starts = numpy.insert(sorted_starts, positions, gap_starts)
+            sorted_ends = numpy.insert(sorted_ends, positions, gap_ends)
+            sorted_idxs = numpy.insert(sorted_idxs, positions,
+                    numpy.arange(len(starts), len(starts) + len(gap_starts)))
+            starts = numpy.concatenate([starts, gap_starts])
+            ends = numpy.concatenate([ends, gap_ends])
+            nr_accesses = numpy.concatenate(
+                    [nr_accesses, in_nr_accesses[gap_owners]])
+            ages = numpy.concatenate([ages, in_ages[gap_owners]])
+
+    new_snapshot = DAMONSnapshot(snapshots[0].start_time,
+            snapshots[-1].end_time, snapshots[0].target_id)
+    new_snapshot.starts = array_of_np('Q', starts)
+    new_snapshot.ends = array_of_np('Q', ends)
+    new_snapshot.nr_accesses = array_of_np('q', nr_accesses)
+    new_snapshot.ages = array_of_np('q', ages)
+    return new_snapshot
 
 def aggregate_snapshots(snapshots):
-    new_regions = []
+    '''Returns a snapshot aggregating the snapshots.  Aggregated regions
+    are made in the order of the appearance in the snapshots, and the
+    boundaries of those are kept.  Parts of regions that not covered by the
+    aggregated regions are added as new aggregated regions'''
+    if use_numpy:
+        new_snapshot = np_aggregate_snapshots(snapshots)
+        if new_snapshot != None:
+            return new_snapshot
+
+    starts, ends, nr_accesses, ages = [], [], [], []
+    # start and end addresses and indices of the aggregated regions, sorted
+    # by the addresses.  Aggregated regions are not overlapping, so the end
+    # addresses are also sorted.  Empty regions, e.g., those of the fake
+    # snapshots, have no address to intersect, so not indexed
+    sorted_starts, sorted_ends, sorted_idxs = [], [], []
     for snapshot in snapshots:
         # Suppose the first snapshot has a region 1-10:5, and the second
         # snapshot has two regions, 1-5:2, 5-10: 4.  Aggregated snapshot should
         # be 1-10:9.  That is, we should add maximum nr_accesses of
         # intersecting regions.  nr_acc_to_add contains the information.
         nr_acc_to_add = {}
-        for region in snapshot.regions:
-            add_region(new_regions, region, nr_acc_to_add)
-        for region in nr_acc_to_add:
-            region.nr_accesses += nr_acc_to_add[region]
+        for start, end, nr_acc, age in zip(snapshot.starts, snapshot.ends,
+                snapshot.nr_accesses, snapshot.ages):
+            # aggregated regions intersecting with the region are contiguous
+            pos = bisect.bisect_right(sorted_ends, start)
+            gaps = []
+            gap_start = start
+            intersect = False
+            while pos < len(sorted_starts) and sorted_starts[pos] < end:
+                idx = sorted_idxs[pos]
+                intersect = True
+                nr_acc_to_add[idx] = max(nr_acc_to_add.get(idx, 0), nr_acc)
+                if gap_start < sorted_starts[pos]:
+                    gaps.append([gap_start, sorted_starts[pos]])
+                gap_start = sorted_ends[pos]
+                pos += 1
+            if gap_start < end:
+                gaps.append([gap_start, end])
+            if not intersect:
+                gaps = [[start, end]]
+
+            for gap_start, gap_end in gaps:
+                if gap_start < gap_end:
+                    pos = bisect.bisect_right(sorted_starts, gap_start)
+                    sorted_starts.insert(pos, gap_start)
+                    sorted_ends.insert(pos, gap_end)
+                    sorted_idxs.insert(pos, len(starts))
+                starts.append(gap_start)
+                ends.append(gap_end)
+                nr_accesses.append(nr_acc)
+                ages.append(age)
+        for idx, nr_acc in nr_acc_to_add.items():
+            nr_accesses[idx] += nr_acc
 
     new_snapshot = DAMONSnapshot(snapshots[0].start_time,
             snapshots[-1].end_time, snapshots[0].target_id)
-    new_snapshot.regions = new_regions
+    new_snapshot.set_columns(starts, ends, nr_accesses, ages)
     return new_snapshot
+
+def iter_snapshot_windows(snapshots, nr_shots_in_aggr, nr_snapshots_to_skip=0,
+        nr_windows=None):
+    '''Yields lists of every 'nr_shots_in_aggr' snapshots of each target,
+    after skipping first 'nr_snapshots_to_skip' snapshots of each target.
+    Each window is yielded as soon as it is completed, so that the memory
+    usage is constant.  If 'nr_windows' is given, only the first
+    'nr_windows' completed windows of each target are yielded.  Otherwise,
+    incomplete last windows are also yielded'''
+    nr_skipped = {}
+    windows = {}
+    nr_yielded_windows = {}
+    for snapshot in snapshots:
+        tid = snapshot.target_id
+        # Skip first several snapshots as regions may not adjusted yet.
+        if nr_skipped.get(tid, 0) < nr_snapshots_to_skip:
+            nr_skipped[tid] = nr_skipped.get(tid, 0) + 1
+            continue
+        if not tid in windows:
+            windows[tid] = []
+            nr_yielded_windows[tid] = 0
+        window = windows[tid]
+        window.append(snapshot)
+        if len(window) < nr_shots_in_aggr:
+            continue
+        windows[tid] = []
+        if nr_windows != None and nr_yielded_windows[tid] >= nr_windows:
+            continue
+        nr_yielded_windows[tid] += 1
+        yield window
+    if nr_windows != None:
+        return
+    for window in windows.values():
+        if window:
+            yield window
+
+def aggregate_windows(windows, aggregate=aggregate_snapshots):
+    return [aggregate(window) for window in windows]
+
+# number of windows that a task of the process pool aggregates at once
+aggregate_shard_sz = 16
+
+def iter_parallel_aggregated_snapshots(windows, nr_jobs,
+        aggregate=aggregate_snapshots):
+    '''Aggregates the windows in shards using a process pool, and yields the
+    aggregated snapshots in the order of the windows.  Only a limited number
+    of shards are in flight at once, so that the memory usage is bounded'''
+    try:
+        pool = multiprocessing.Pool(nr_jobs)
+    except OSError:
+        # e.g., no shm support
+        for window in windows:
+            yield aggregate(window)
+        return
+
+    pending = []
+    shard = []
+    try:
+        for window in windows:
+            shard.append(window)
+            if len(shard) < aggregate_shard_sz:
+                continue
+            pending.append(pool.apply_async(aggregate_windows,
+                (shard, aggregate)))
+            shard = []
+            if len(pending) < nr_jobs * 2:
+                continue
+            for snapshot in pending.pop(0).get():
+                yield snapshot
+        if shard:
+            pending.append(pool.apply_async(aggregate_windows,
+                (shard, aggregate)))
+        for task in pending:
+            for snapshot in task.get():
+                yield snapshot
+    finally:
+        # terminates remaining tasks if the caller stopped iterating
+        pool.terminate()
+        pool.join()
+
+def iter_window_aggregated_snapshots(snapshots, nr_shots_in_aggr,
+        nr_snapshots_to_skip=0, nr_windows=None, nr_jobs=1,
+        aggregate=aggregate_snapshots):
+    '''Yields the aggregations of the windows that iter_snapshot_windows()
+    yields, in the order.  If 'nr_jobs' is larger than one, the windows are
+    aggregated in parallel using a process pool of the size.  'aggregate' is
+    the function that aggregates each window'''
+    windows = iter_snapshot_windows(snapshots, nr_shots_in_aggr,
+            nr_snapshots_to_skip, nr_windows)
+    if nr_jobs > 1:
+        snapshots = iter_parallel_aggregated_snapshots(windows, nr_jobs,
+                aggregate)
+    else:
+        snapshots = (aggregate(window) for window in windows)
+    for snapshot in snapshots:
+        yield snapshot
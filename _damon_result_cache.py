@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+"""
+Cache of parsed monitoring results files.
+
+Each cache file keeps a DAMONResult of a monitoring results file in a
+columnar binary layout that can be loaded without parsing, and the path,
+size and modification time of the results file, to invalidate the cache once
+the file is changed.  The version of the cache layout and that of damo are
+also kept, to invalidate the cache once damo is upgraded.  Least recently
+used cache files are evicted when the total size of the cache files exceeds
+the limit.
+"""
+
+import array
+import hashlib
+import math
+import os
+import struct
+
+import _damon_result
+
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'damo')
+default_cache_size = 1 << 30
+
+cache_mark = b'damo_result_cache'
+cache_version = 2
+# version, size and mtime of the results file, start time, end time and
+# number of snapshots of the result, number of targets, length of path, and
+# length of damo version
+cache_head = struct.Struct('=iQqdqqiii')
+# target id, whether the target id is negative, number of snapshots, and
+# start time of the first snapshot
+cache_target_head = struct.Struct('=Q?qd')
+
+def read_damo_version():
+    try:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+            'damo_version.py'), 'r') as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return ''
+
+damo_version = read_damo_version()
+
+def time_to_float(time):
+    if time == None:
+        return float('nan')
+    return float(time)
+
+def float_to_time(value):
+    if math.isnan(value):
+        return None
+    return value
+
+def write_cache(result, stat, path, cache_path):
+    with open(cache_path, 'wb') as f:
+        f.write(cache_mark)
+        path_bytes = path.encode()
+        version_bytes = damo_version.encode()
+        f.write(cache_head.pack(cache_version, stat.st_size,
+            stat.st_mtime_ns, time_to_float(result.start_time),
+            -1 if result.end_time == None else result.end_time,
+            -1 if result.nr_snapshots == None else result.nr_snapshots,
+            len(result.target_snapshots), len(path_bytes),
+            len(version_bytes)))
+        f.write(path_bytes)
+        f.write(version_bytes)
+        for target_id, snapshots in result.target_snapshots.items():
+            start_times = array.array('q')
+            end_times = array.array('q')
+            nr_regions = array.array('q')
+            columns = [array.array(typecode)
+                    for typecode in ['Q', 'Q', 'q', 'q']]
+            first_start_time = None
+            # lazily decoded snapshots are decoded for each access, so
+            # access each snapshot only once
+            for idx, snapshot in enumerate(snapshots):
+                if idx == 0:
+                    first_start_time = snapshot.start_time
+                start_times.append(int(snapshot.start_time or 0))
+                end_times.append(snapshot.end_time)
+                nr_regions.append(len(snapshot.starts))
+                for column, snapshot_column in zip(columns, [snapshot.starts,
+                    snapshot.ends, snapshot.nr_accesses, snapshot.ages]):
+                    column.extend(snapshot_column)
+            f.write(cache_target_head.pack(target_id & 0xffffffffffffffff,
+                target_id < 0, len(end_times),
+                time_to_float(first_start_time)))
+            for arr in [start_times, end_times, nr_regions] + columns:
+                arr.tofile(f)
+
+def read_cache(cache_path, path, stat):
+    '''Returns the DAMONResult in the cache file, or None if the cache is not
+    for the current file'''
+    with open(cache_path, 'rb') as f:
+        if f.read(len(cache_mark)) != cache_mark:
+            return None
+        head = f.read(cache_head.size)
+        if len(head) != cache_head.size:
+            return None
+        (version, size, mtime, start_time, end_time, nr_snapshots,
+                nr_targets, path_len, version_len) = cache_head.unpack(head)
+        if (version != cache_version or size != stat.st_size or
+                mtime != stat.st_mtime_ns or
+                f.read(path_len) != path.encode() or
+                f.read(version_len) != damo_version.encode()):
+            return None
+
+        result = _damon_result.DAMONResult()
+        result.start_time = float_to_time(start_time)
+        if end_time != -1:
+            result.end_time = end_time
+        if nr_snapshots != -1:
+            result.nr_snapshots = nr_snapshots
+        for t in range(nr_targets):
+            target_id, negative, nr_target_snapshots, first_start_time = \
+                    cache_target_head.unpack(f.read(cache_target_head.size))
+            if negative:
+                target_id -= 1 << 64
+            times = []
+            for typecode in ['q', 'q', 'q']:
+                arr = array.array(typecode)
+                arr.fromfile(f, nr_target_snapshots)
+                times.append(arr)
+            start_times, end_times, nr_regions = times
+            total_nr_regions = sum(nr_regions)
+            columns = []
+            for typecode in ['Q', 'Q', 'q', 'q']:
+                arr = array.array(typecode)
+                arr.fromfile(f, total_nr_regions)
+                columns.append(arr)
+
+            snapshots = []
+            offset = 0
+            for idx in range(nr_target_snapshots):
+                start_time = start_times[idx]
+                if idx == 0:
+                    start_time = float_to_time(first_start_time)
+                snapshot = _damon_result.DAMONSnapshot(start_time,
+                        end_times[idx], target_id)
+                next_offset = offset + nr_regions[idx]
+                snapshot.starts = columns[0][offset:next_offset]
+                snapshot.ends = columns[1][offset:next_offset]
+                snapshot.nr_accesses = columns[2][offset:next_offset]
+                snapshot.ages = columns[3][offset:next_offset]
+                snapshots.append(snapshot)
+                offset = next_offset
+            result.target_snapshots[target_id] = snapshots
+    return result
+
+class ResultCache:
+    cache_dir = None
+    size_limit = None
+
+    def __init__(self, cache_dir=default_cache_dir,
+            size_limit=default_cache_size):
+        self.cache_dir = cache_dir
+        self.size_limit = size_limit
+
+    def cache_path(self, path):
+        return os.path.join(self.cache_dir, '%s.cache' %
+                hashlib.sha1(path.encode()).hexdigest())
+
+    def get(self, result_file):
+        '''Returns the cached DAMONResult of the results file, or None if it
+        is not cached or the file has changed after the caching'''
+        path = os.path.realpath(result_file)
+        cache_path = self.cache_path(path)
+        if not os.path.isfile(cache_path):
+            return None
+        try:
+            result = read_cache(cache_path, path, os.stat(path))
+            if result == None:
+                os.remove(cache_path)
+                return None
+            # mark as recently used
+            os.utime(cache_path, None)
+        except (IOError, OSError, EOFError, struct.error):
+            return None
+        return result
+
+    def put(self, result_file, result):
+        'Caches the DAMONResult of the results file.  Returns an error string'
+        path = os.path.realpath(result_file)
+        cache_path = self.cache_path(path)
+        tmp_path = cache_path + '.tmp'
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            write_cache(result, os.stat(path), path, tmp_path)
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError) as e:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            return 'caching %s failed (%s)' % (result_file, e)
+        self.evict()
+        return None
+
+    def evict(self):
+        'Removes least recently used cache files until those fit in the limit'
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.cache'):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            entries.append([stat.st_mtime, name, stat.st_size])
+            total_size += stat.st_size
+        for mtime, name, size in sorted(entries):
+            if total_size <= self.size_limit:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total_size -= size
@@ -6,39 +6,36 @@
 import argparse
 import struct
 
+import _damon_pyramid
 import _damon_result
 
-def adjust_result(result, aggregate_interval, nr_snapshots_to_skip): 
-    interval = float(result.end_time - result.start_time) / result.nr_snapshots
-    nr_shots_in_aggr = int(max(round(aggregate_interval * 1000 / interval), 1))
-    target_snapshots = result.target_snapshots
+def get_nr_shots_in_aggr(interval, aggregate_interval):
+    return int(max(round(aggregate_interval * 1000 / interval), 1))
 
+def iter_adjusted_snapshots(snapshots, info, aggregate_interval,
+        nr_snapshots_to_skip, nr_windows=None, nr_jobs=1):
+    '''Aggregates snapshots yielded by _damon_result.iter_snapshots() with
+    the new aggregation interval.  'info' is the DAMONResultInfo of the file.
+    Refer to _damon_result.iter_window_aggregated_snapshots() for the
+    windows'''
+    interval = float(info.end_time - info.start_time) / info.nr_snapshots
+    nr_shots_in_aggr = get_nr_shots_in_aggr(interval, aggregate_interval)
     if nr_shots_in_aggr <= 1:
+        for snapshot in snapshots:
+            yield snapshot
         return
 
-    start_time = 0
-    end_time = 0
-    nr_snapshots = int(max((result.nr_snapshots - nr_snapshots_to_skip), 0) /
-            nr_shots_in_aggr)
-
-    for tid in target_snapshots:
-        # Skip first several snapshots as regions may not adjusted yet.
-        snapshots = target_snapshots[tid][nr_snapshots_to_skip:]
-        if start_time == 0:
-            start_time = snapshots[0].start_time
-            end_time = snapshots[-1].end_time
-
-        aggregated_snapshots = []
-        for i in range(0, len(snapshots), nr_shots_in_aggr):
-            to_aggregate = snapshots[i:
-                    min(i + nr_shots_in_aggr, len(snapshots))]
-            aggregated_snapshots.append(
-                    _damon_result.aggregate_snapshots(to_aggregate))
-        target_snapshots[tid] = aggregated_snapshots
+    for snapshot in _damon_result.iter_window_aggregated_snapshots(
+            snapshots, nr_shots_in_aggr, nr_snapshots_to_skip, nr_windows,
+            nr_jobs):
+        yield snapshot
 
-    result.start_time = start_time
-    result.end_time = end_time
-    result.nr_snapshots = nr_snapshots
+def nr_adjusted_snapshots(info, aggregate_interval, nr_snapshots_to_skip):
+    '''Returns the number of complete windows of the aggregation'''
+    interval = float(info.end_time - info.start_time) / info.nr_snapshots
+    nr_shots_in_aggr = get_nr_shots_in_aggr(interval, aggregate_interval)
+    return int(max(info.nr_snapshots - nr_snapshots_to_skip, 0) /
+            nr_shots_in_aggr)
 
 def set_argparser(parser):
     parser.add_argument('--aggregate_interval', type=int, default=None,
@@ -51,6 +48,23 @@ def set_argparser(parser):
             default='record', help='output file\'s type')
     parser.add_argument('--skip', type=int, metavar='<int>', default=20,
             help='number of first snapshots to skip')
+    parser.add_argument('--compression', choices=['zlib', 'lzma'],
+            help='compress the record type output file')
+    parser.add_argument('--format_version', type=int, choices=[2, 3, 6],
+            help='format version of the record type output file')
+    parser.add_argument('--delta', action='store_true',
+            help='delta-encode snapshots of the record type output file')
+    parser.add_argument('--save_index', action='store_true',
+            help='save the snapshots index of the output file')
+    parser.add_argument('--jobs', type=int, metavar='<int>', default=1,
+            help='number of processes to aggregate snapshots in parallel')
+    parser.add_argument('--pyramid', action='store_true',
+            help='build aggregation levels of the input for heatmaps')
+    parser.add_argument('--pyramid_factor', type=int, metavar='<int>',
+            default=_damon_pyramid.default_factor,
+            help='number of snapshots to aggregate for each pyramid level')
+    parser.add_argument('--pyramid_levels', type=int, metavar='<int>',
+            help='maximum number of the pyramid levels')
 
 def main(args=None):
     if not args:
@@ -59,17 +73,61 @@ def main(args=None):
         args = parser.parse_args()
 
     file_path = args.input
+    if args.compression and args.output_type != 'record':
+        print('--compression is supported for only record output type')
+        exit(1)
+    if args.format_version != None and args.output_type != 'record':
+        print('--format_version is supported for only record output type')
+        exit(1)
+    if args.delta and args.output_type != 'record':
+        print('--delta is supported for only record output type')
+        exit(1)
+    if args.jobs < 1:
+        print('wrong --jobs (%d)' % args.jobs)
+        exit(1)
 
-    result, err = _damon_result.parse_damon_result(file_path)
+    if args.pyramid:
+        if args.aggregate_interval != None:
+            print('--pyramid and --aggregate_interval are exclusive')
+            exit(1)
+        level_paths, err = _damon_pyramid.build_pyramid(file_path,
+                args.pyramid_factor, args.pyramid_levels, args.jobs)
+        if err:
+            print('building pyramid failed (%s)' % err)
+            exit(1)
+        for path in level_paths:
+            print(path)
+        return
+
+    # Read, aggregate and write snapshots one by one, to support files
+    # larger than the memory
+    info, err = _damon_result.get_result_info(file_path)
+    if err == None:
+        snapshots, err = _damon_result.iter_snapshots(file_path, info=info)
     if err:
         print('monitoring result file (%s) parsing failed (%s)' %
                 (file_path, err))
         exit(1)
 
     if args.aggregate_interval != None:
-        adjust_result(result, args.aggregate_interval, args.skip)
-    _damon_result.write_damon_result(result, args.output, args.output_type,
-            0o600)
+        if info.nr_snapshots == None:
+            print('too few snapshots in the file for the adjustment')
+            exit(1)
+        snapshots = iter_adjusted_snapshots(snapshots, info,
+                args.aggregate_interval, args.skip, nr_adjusted_snapshots(
+                    info, args.aggregate_interval, args.skip), args.jobs)
+    try:
+        _damon_result.write_snapshots(
+                _damon_result.iter_faked_snapshots(snapshots), args.output,
+                args.output_type, 0o600, args.compression, args.delta,
+                args.format_version)
+    except (IOError, OSError, ValueError, struct.error) as e:
+        print('writing adjusted result failed (%s)' % e)
+        exit(1)
+    if args.save_index:
+        err = _damon_result.save_record_index(args.output)
+        if err:
+            print(err)
 
 if __name__ == '__main__':
     main()
@@ -15,6 +15,53 @@ def set_argparser(parser):
             help='start and end time offset for record to parse')
     parser.add_argument('--raw_number', action='store_true',
             help='use machine-friendly raw numbers')
+    parser.add_argument('--follow', action='store_true',
+            help='keep printing snapshots appended to the file')
+    parser.add_argument('--follow_interval', type=float, default=1.0,
+            metavar='<seconds>',
+            help='interval between checks of the file for --follow')
+
+def pr_snapshots(snapshots, raw_number, base_time=None):
+    '''Prints the snapshots and returns the base time'''
+    for snapshot in snapshots:
+        if base_time == None:
+            base_time = snapshot.start_time
+            print('base_time_absolute: %s\n' %
+                    _damo_fmt_str.format_time_ns(base_time, raw_number))
+
+        print('monitoring_start:    %16s' %
+                _damo_fmt_str.format_time_ns(
+                    snapshot.start_time - base_time, raw_number))
+        print('monitoring_end:      %16s' %
+                _damo_fmt_str.format_time_ns(
+                    snapshot.end_time - base_time, raw_number))
+        print('monitoring_duration: %16s' %
+                _damo_fmt_str.format_time_ns(
+                    snapshot.end_time - snapshot.start_time, raw_number))
+        print('target_id: %s' % snapshot.target_id)
+        print('nr_regions: %s' % len(snapshot.regions))
+        print('# %10s %12s  %12s  %11s %5s' %
+                ('start_addr', 'end_addr', 'length', 'nr_accesses', 'age'))
+        for r in snapshot.regions:
+            print("%012x-%012x (%12s) %11d %5d" %
+                    (r.start, r.end,
+                        _damo_fmt_str.format_sz(r.end - r.start, raw_number),
+                        r.nr_accesses, r.age if r.age != None else -1))
+        print('')
+    return base_time
+
+def pr_followed_snapshots(file_path, interval, raw_number):
+    base_time = None
+    try:
+        for snapshots in _damon_result.follow_snapshots(file_path, interval):
+            base_time = pr_snapshots(snapshots, raw_number, base_time)
+            sys.stdout.flush()
+    except ValueError as e:
+        print('following damon result file (%s) failed (%s)' %
+                (file_path, e))
+        exit(1)
+    except KeyboardInterrupt:
+        pass
 
 def main(args=None):
     if not args:
@@ -24,68 +71,49 @@ def main(args=None):
 
     file_path = args.input
 
-    if not os.path.isfile(file_path):
-        print('input file (%s) is not exist' % file_path)
-        exit(1)
-
-    if args.duration:
-        print('read start')
-        result, f, fmt_version, err = _damon_result.parse_damon_result_for(
-                file_path, None, None, args.duration[0])
-        if err != None:
-            print(err)
-            exit(1)
-        print('now real read')
-        result, f, fmt_version, err = _damon_result.parse_damon_result_for(
-                file_path, f, fmt_version, args.duration[1])
-        if err != None:
-            print(err)
+    if args.follow:
+        if args.duration:
+            print('--duration is not supported with --follow')
             exit(1)
-        f.close()
-    else:
-        result, err = _damon_result.parse_damon_result(file_path)
-        if err:
-            print('parsing damon result file (%s) failed (%s)' %
-                    (file_path, err))
+        pr_followed_snapshots(file_path, args.follow_interval,
+                args.raw_number)
+        return
 
-    if not result:
-        print('monitoring result file (%s) parsing failed' % file_path)
+    if not os.path.exists(file_path):
+        print('input file (%s) is not exist' % file_path)
         exit(1)
 
-    if not result:
-        print('no monitoring result in the file')
+    # Read snapshots one by one, to support files larger than the memory
+    info, err = _damon_result.get_result_info(file_path)
+    if err:
+        print('parsing damon result file (%s) failed (%s)' % (file_path, err))
         exit(1)
 
-    for snapshots in result.target_snapshots.values():
-        if len(snapshots) == 0:
-            continue
-
-        base_time = snapshots[0].start_time
-        print('base_time_absolute: %s\n' %
-                _damo_fmt_str.format_time_ns(base_time, args.raw_number))
+    time_range = None
+    if args.duration:
+        if info.start_time == None:
+            print('too few snapshots in the file for --duration')
+            exit(1)
+        time_range = [info.start_time + args.duration[0] * 1000000000,
+                info.start_time + args.duration[1] * 1000000000]
 
-        for snapshot in snapshots:
-            print('monitoring_start:    %16s' %
-                    _damo_fmt_str.format_time_ns(
-                        snapshot.start_time - base_time, args.raw_number))
-            print('monitoring_end:      %16s' %
-                    _damo_fmt_str.format_time_ns(
-                        snapshot.end_time - base_time, args.raw_number))
-            print('monitoring_duration: %16s' %
-                    _damo_fmt_str.format_time_ns(
-                        snapshot.end_time - snapshot.start_time,
-                        args.raw_number))
-            print('target_id: %s' % snapshot.target_id)
-            print('nr_regions: %s' % len(snapshot.regions))
-            print('# %10s %12s  %12s  %11s %5s' %
-                    ('start_addr', 'end_addr', 'length', 'nr_accesses', 'age'))
-            for r in snapshot.regions:
-                print("%012x-%012x (%12s) %11d %5d" %
-                        (r.start, r.end,
-                            _damo_fmt_str.format_sz(r.end - r.start,
-                                args.raw_number), r.nr_accesses,
-                                r.age if r.age != None else -1))
-            print('')
+    snapshots, err = _damon_result.iter_snapshots(file_path,
+            time_range=time_range, info=info)
+    if err:
+        print('parsing damon result file (%s) failed (%s)' %
+                (file_path, err))
+        exit(1)
+    # print snapshots of the first target while reading the file, and those
+    # of the other targets after that, target by target
+    target_snapshots = {tid: [] for tid in info.target_ids[1:]}
+    base_time = None
+    for snapshot in snapshots:
+        if snapshot.target_id in target_snapshots:
+            target_snapshots[snapshot.target_id].append(snapshot)
+        else:
+            base_time = pr_snapshots([snapshot], args.raw_number, base_time)
+    for snapshots in target_snapshots.values():
+        pr_snapshots(snapshots, args.raw_number)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+"Export monitoring results as NumPy arrays"
+
+import argparse
+import os
+
+import _damon_result
+
+def set_argparser(parser):
+    parser.add_argument('--input', '-i', type=str, metavar='<file>',
+            default='damon.data', help='input file name')
+    parser.add_argument('--output', '-o', type=str, metavar='<file>',
+            help='output file (or directory for npy format) name')
+    parser.add_argument('--format', choices=['npz', 'npy'], default='npz',
+            help='.npz file, or directory of .npy files')
+
+def main(args=None):
+    if not args:
+        parser = argparse.ArgumentParser()
+        set_argparser(parser)
+        args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print('input file (%s) is not exist' % args.input)
+        exit(1)
+    output = args.output
+    if output == None:
+        output = '%s.%s' % (args.input, args.format)
+
+    snapshots, err = _damon_result.iter_snapshots(args.input)
+    if err:
+        print('parsing monitoring result file (%s) failed (%s)' %
+                (args.input, err))
+        exit(1)
+    try:
+        _damon_result.write_npy_snapshots(snapshots, output,
+                args.format == 'npz')
+    except (IOError, OSError, ValueError) as e:
+        print('exporting monitoring results failed (%s)' % e)
+        exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,7 @@ import subprocess
 import sys
 import tempfile
 
+import _damon_pyramid
 import _damon_result
 import _damo_fmt_str
 
@@ -58,8 +59,12 @@ def add_heats(snapshot, duration, pixels, time_unit, space_unit, addr_range):
             fraction_start = fraction_end
             addr_idx += 1
 
-def heat_pixels_from_snapshots(snapshots, time_range, addr_range, resols):
-    """Get heat pixels for monitoring snapshots."""
+def heat_pixels_from_snapshots(snapshots, time_range, addr_range, resols,
+        snapshot_time=None):
+    """Get heat pixels for monitoring snapshots.  If the snapshots are
+    aggregations of snapshots of 'snapshot_time' interval, the heats are
+    divided by the number of the aggregated snapshots.
+    """
     time_unit = (time_range[1] - time_range[0]) / float(resols[0])
     space_unit = (addr_range[1] - addr_range[0]) / float(resols[1])
 
@@ -67,19 +72,23 @@ def heat_pixels_from_snapshots(snapshots, time_range, addr_range, resols):
                     int(addr_range[0] + j * space_unit), 0.0)
             for j in range(resols[1])] for i in range(resols[0])]
 
-    if len(snapshots) < 2:
-        return pixels
-
-    for idx, shot in enumerate(snapshots[1:]):
-        start = shot.start_time
+    for shot in snapshots:
+        start = max(shot.start_time, time_range[0])
         end = min(shot.end_time, time_range[1])
 
+        weight = 1
+        if snapshot_time != None:
+            # nr_accesses of aggregated snapshots are sums of those.  The
+            # last snapshot of each target could aggregate less snapshots.
+            weight = 1.0 / max(round((shot.end_time - shot.start_time) /
+                snapshot_time), 1)
+
         fraction_start = start
         time_idx = int(float(fraction_start - time_range[0]) / time_unit)
         while fraction_start < end:
             fraction_end = min((time_idx + 1) * time_unit + time_range[0], end)
-            add_heats(shot, fraction_end - fraction_start, pixels[time_idx],
-                    time_unit, space_unit, addr_range)
+            add_heats(shot, (fraction_end - fraction_start) * weight,
+                    pixels[time_idx], time_unit, space_unit, addr_range)
             fraction_start = fraction_end
             time_idx += 1
     return pixels
@@ -133,7 +142,10 @@ def heatmap_plot_ascii(pixels, time_range, addr_range, resols, colorset):
         _damo_fmt_str.format_time_ns(
             float(time_range[1] - time_range[0]) / len(pixels), False)))
 
-def pr_heats(args, damon_result):
+def pr_heats(args, snapshots, snapshot_time=None):
+    '''Prints heats of the snapshots.  If the snapshots are of a pyramid
+    level, 'snapshot_time' is the snapshot time of the original results
+    file'''
     tid = args.tid
     tres = args.resol[0]
     tmin = args.time_range[0]
@@ -151,9 +163,8 @@ def pr_heats(args, damon_result):
 
     # __pr_heats(damon_result, tid, tunit, tmin, tmax, aunit, amin, amax)
 
-    snapshots = damon_result.target_snapshots[tid]
     pixels = heat_pixels_from_snapshots(snapshots, [tmin, tmax], [amin, amax],
-            [tres, ares])
+            [tres, ares], snapshot_time)
 
     if args.heatmap == 'stdout':
         heatmap_plot_ascii(pixels, [tmin, tmax], [amin, amax], [tres, ares],
@@ -361,26 +372,58 @@ def main(args=None):
         set_argparser(parser)
         args = parser.parse_args()
 
-    damon_result, err = _damon_result.parse_damon_result(args.input)
-    if err != None:
-        print('monitoring result file (%s) parsing failed (%s)' %
-                (args.input, err))
-
     # Use 80x40 resolution as default for ascii plot
     if args.heatmap == 'stdout' and args.resol == [500, 500]:
         args.resol = [40, 80]
 
+    snapshot_time = None
+    if (not args.guide and args.tid and args.time_range and
+            args.address_range):
+        # snapshots of the coarsest pyramid level that still finer than the
+        # time resolution are enough
+        tunit = (args.time_range[1] - args.time_range[0]) // args.resol[0]
+        level = _damon_pyramid.coarsest_level(args.input,
+                lambda level: level['snapshot_time'] <= tunit)
+        input_file = args.input
+        info = None
+        if level != None:
+            input_file = level['file']
+            info, err = _damon_pyramid.level_info(level)
+            if err != None:
+                print('pyramid level file (%s) reading failed (%s)' %
+                        (input_file, err))
+                exit(1)
+            snapshot_time = (level['snapshot_time'] /
+                    level['nr_shots_in_aggr'])
+        # read only the regions of the target in the time and address ranges
+        snapshots, err = _damon_result.iter_snapshots(input_file, args.tid,
+                args.time_range, info=info, addr_range=args.address_range)
+        if err != None:
+            print('monitoring result file (%s) parsing failed (%s)' %
+                    (args.input, err))
+            exit(1)
+        snapshots = list(snapshots)
+        damon_result = None
+    else:
+        damon_result, err = _damon_result.parse_damon_result(args.input)
+        if err != None:
+            print('monitoring result file (%s) parsing failed (%s)' %
+                    (args.input, err))
+            exit(1)
+
     if args.guide:
         pr_guide(damon_result)
     else:
-        set_missed_args(args, damon_result)
+        if damon_result:
+            set_missed_args(args, damon_result)
+            snapshots = damon_result.target_snapshots[args.tid]
         orig_stdout = sys.stdout
         if args.heatmap and args.heatmap != 'stdout':
             tmp_path = tempfile.mkstemp()[1]
             tmp_file = open(tmp_path, 'w')
             sys.stdout = tmp_file
 
-        pr_heats(args, damon_result)
+        pr_heats(args, snapshots, snapshot_time)
 
         if args.heatmap and args.heatmap != 'stdout':
             sys.stdout = orig_stdout
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+"Merge multiple monitoring result files into one"
+
+import argparse
+import os
+
+import _damon_result
+
+def set_argparser(parser):
+    parser.add_argument('--input', '-i', type=str, metavar='<file>',
+            nargs='+', required=True, help='input file names')
+    parser.add_argument('--output', '-o', type=str, metavar='<file>',
+            default='damon.merged.data', help='output file name')
+    parser.add_argument('--output_type', choices=['record', 'perf_script'],
+            default='record', help='output file\'s type')
+    parser.add_argument('--compression', choices=['zlib', 'lzma'],
+            help='compress the record type output file')
+    parser.add_argument('--format_version', type=int, choices=[2, 3, 6],
+            help='format version of the record type output file')
+
+def main(args=None):
+    if not args:
+        parser = argparse.ArgumentParser()
+        set_argparser(parser)
+        args = parser.parse_args()
+
+    if args.compression and args.output_type != 'record':
+        print('--compression is supported for only record output type')
+        exit(1)
+    if args.format_version != None and args.output_type != 'record':
+        print('--format_version is supported for only record output type')
+        exit(1)
+    for file_path in args.input:
+        if not os.path.exists(file_path):
+            print('input file (%s) is not exist' % file_path)
+            exit(1)
+
+    snapshots, err = _damon_result.merge_snapshots(args.input)
+    if err:
+        print('merging monitoring result files failed (%s)' % err)
+        exit(1)
+    _damon_result.write_snapshots(_damon_result.iter_faked_snapshots(
+        snapshots), args.output, args.output_type, 0o600, args.compression,
+        format_version=args.format_version)
+
+if __name__ == '__main__':
+    main()
@@ -36,7 +36,7 @@ def main(args=None):
     if args.sortby == 'time':
         nr_regions_sort = False
 
-    result, err = _damon_result.parse_damon_result(file_path)
+    info, err = _damon_result.get_result_info(file_path)
     if err != None:
         print('monitoring result file (%s) parsing failed (%s)' %
                 (file_path, err))
@@ -50,12 +50,23 @@ def main(args=None):
 
     print('# <percentile> <# regions>')
 
-    for tid in result.target_snapshots.keys():
+    snapshots, err = _damon_result.iter_snapshots(file_path, info=info)
+    if err != None:
+        print('monitoring result file (%s) parsing failed (%s)' %
+                (file_path, err))
+        exit(1)
+    nr_regions_dists = {tid: [] for tid in info.target_ids}
+    nr_skipped = {tid: 0 for tid in info.target_ids}
+    for snapshot in snapshots:
+        tid = snapshot.target_id
         # Skip firs 20 regions as those would not adaptively adjusted
-        snapshots = result.target_snapshots[tid][20:]
-        nr_regions_dist = []
-        for snapshot in snapshots:
-            nr_regions_dist.append(len(snapshot.regions))
+        if nr_skipped[tid] < 20:
+            nr_skipped[tid] += 1
+            continue
+        nr_regions_dists[tid].append(len(snapshot.starts))
+
+    for tid in info.target_ids:
+        nr_regions_dist = nr_regions_dists[tid]
         if nr_regions_sort:
             nr_regions_dist.sort(reverse=False)
 
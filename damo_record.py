@@ -5,6 +5,7 @@
 Record monitored data access patterns.
 """
 
+import glob
 import os
 import signal
 import subprocess
@@ -21,10 +22,30 @@ class DataForCleanup:
     rfile_path = None
     rfile_format = None
     rfile_permission = None
+    rfile_compression = None
+    rfile_format_version = None
+    rfile_rotation = None
     perf_pipe = None
 
 data_for_cleanup = DataForCleanup()
 
+def segment_rotated_files():
+    '''Converts the files that rotated by 'perf record' into the segment
+    files and the manifest of those'''
+    rfile_path = data_for_cleanup.rfile_path
+    # perf appends the timestamp of the rotation to the rotated files
+    perf_data_paths = sorted(glob.glob(rfile_path + '.' + '[0-9]' * 14 + '*'))
+    segment_paths, err = _damon_result.write_record_segments(rfile_path,
+            perf_data_paths, data_for_cleanup.rfile_format,
+            data_for_cleanup.rfile_permission,
+            data_for_cleanup.rfile_compression,
+            data_for_cleanup.rfile_format_version)
+    if err != None:
+        print('segmenting the rotated files failed (%s)' % err)
+        return
+    for path in segment_paths + [rfile_path]:
+        os.chmod(path, data_for_cleanup.rfile_permission)
+
 def cleanup_exit(exit_code):
     if not data_for_cleanup.target_is_ongoing:
         if _damon.any_kdamond_running():
@@ -46,18 +67,29 @@ def cleanup_exit(exit_code):
             # perf might already finished
             pass
 
-        rfile_current_format = 'perf_script'
-        script_output = subprocess.check_output(
-                ['perf', 'script', '-i', data_for_cleanup.rfile_path]).decode()
-        with open(data_for_cleanup.rfile_path, 'w') as f:
-            f.write(script_output)
+        if data_for_cleanup.rfile_rotation != None:
+            segment_rotated_files()
+            exit(exit_code)
+
+        rfile_current_format = 'perf_data'
+        if data_for_cleanup.rfile_format == 'perf_script':
+            rfile_current_format = 'perf_script'
+            tmp_path = data_for_cleanup.rfile_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                subprocess.call(['perf', 'script', '-i',
+                    data_for_cleanup.rfile_path], stdout=f)
+            os.rename(tmp_path, data_for_cleanup.rfile_path)
     else:
         rfile_current_format = 'record'
 
-    if rfile_current_format != data_for_cleanup.rfile_format:
+    if (rfile_current_format != data_for_cleanup.rfile_format or
+            data_for_cleanup.rfile_compression or
+            data_for_cleanup.rfile_format_version != None):
         err = _damon_result.update_result_file(data_for_cleanup.rfile_path,
                 data_for_cleanup.rfile_format,
-                data_for_cleanup.rfile_permission)
+                data_for_cleanup.rfile_permission,
+                data_for_cleanup.rfile_compression,
+                data_for_cleanup.rfile_format_version)
         if err != None:
             print('setting format and permission failed (%s)' % err)
 
@@ -76,6 +108,12 @@ def set_data_for_cleanup(data_for_cleanup, args, output_permission):
     data_for_cleanup.rfile_format = args.output_type
     data_for_cleanup.rfile_path = args.out
     data_for_cleanup.rfile_permission = output_permission
+    data_for_cleanup.rfile_compression = args.compression
+    data_for_cleanup.rfile_format_version = args.format_version
+    if args.rotate_size != None:
+        data_for_cleanup.rfile_rotation = args.rotate_size
+    elif args.rotate_interval != None:
+        data_for_cleanup.rfile_rotation = '%ds' % args.rotate_interval
     data_for_cleanup.orig_kdamonds = _damon.current_kdamonds()
 
 def chk_handle_record_feature_support(args):
@@ -110,10 +148,19 @@ def backup_duplicate_output_file(output_file):
 
 def set_argparser(parser):
     parser = _damon_args.set_argparser(parser, add_record_options=True)
-    parser.add_argument('--output_type', choices=['record', 'perf_script'],
+    parser.add_argument('--output_type',
+            choices=['record', 'perf_script', 'perf_data'],
             default='perf_script', help='output file\'s type')
     parser.add_argument('--output_permission', type=str, default='600',
             help='permission of the output file')
+    parser.add_argument('--compression', choices=['zlib', 'lzma'],
+            help='compress the record type output file')
+    parser.add_argument('--format_version', type=int, choices=[2, 3, 6],
+            help='format version of the record type output file')
+    parser.add_argument('--rotate_size', metavar='<size>',
+            help='rotate the output file when it becomes larger than the size')
+    parser.add_argument('--rotate_interval', metavar='<seconds>', type=int,
+            help='rotate the output file for every the time interval')
     return parser
 
 def main(args=None):
@@ -127,6 +174,26 @@ def main(args=None):
 
     # Check/handle the arguments and options
     damon_record_supported = chk_handle_record_feature_support(args)
+    if (damon_record_supported and not _damon_args.is_ongoing_target(args)
+            and args.output_type == 'perf_data'):
+        print('perf_data output type is not supported with in-kernel record')
+        exit(1)
+    if args.compression and args.output_type != 'record':
+        print('--compression is supported for only record output type')
+        exit(1)
+    if args.format_version != None and args.output_type != 'record':
+        print('--format_version is supported for only record output type')
+        exit(1)
+    if args.rotate_size != None or args.rotate_interval != None:
+        if args.rotate_size != None and args.rotate_interval != None:
+            print('--rotate_size and --rotate_interval are exclusive')
+            exit(1)
+        if args.output_type == 'perf_data':
+            print('rotation is not supported for perf_data output type')
+            exit(1)
+        if damon_record_supported and not _damon_args.is_ongoing_target(args):
+            print('rotation is not supported with in-kernel record')
+            exit(1)
     output_permission = chk_handle_output_permission(args.output_permission)
     backup_duplicate_output_file(args.out)
 
@@ -148,7 +215,7 @@ def main(args=None):
     if not damon_record_supported or is_ongoing:
         # Record the monitoring results using perf
         data_for_cleanup.perf_pipe, err = _damon.start_monitoring_record(
-                data_for_cleanup.rfile_path)
+                data_for_cleanup.rfile_path, data_for_cleanup.rfile_rotation)
         if err != None:
             print('could not start recording (%s)' % err)
             cleanup_exit(-3)
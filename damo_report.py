@@ -9,6 +9,8 @@ import damo_nr_regions
 import damo_wss
 
 import _damo_subcmds
+import _damon_result
+import _damon_result_cache
 
 subcmds = [
         _damo_subcmds.DamoSubCmd(name='raw', module=damo_bin2txt,
@@ -21,6 +23,14 @@ subcmds = [
             msg='number of regions')]
 
 def set_argparser(parser):
+    parser.add_argument('--cache', action='store_true',
+            help='cache the parsed results file for later reports')
+    parser.add_argument('--cache_dir', metavar='<dir>',
+            default=_damon_result_cache.default_cache_dir,
+            help='directory to save the cache files')
+    parser.add_argument('--cache_size', metavar='<bytes>', type=int,
+            default=_damon_result_cache.default_cache_size,
+            help='maximum total size of the cache files')
     subparsers = parser.add_subparsers(title='report type', dest='report_type',
             metavar='<report type>', help='the type of the report to generate')
     subparsers.required = True
@@ -34,6 +44,10 @@ def main(args=None):
         set_argparser(parser)
         args = parser.parse_args()
 
+    if args.cache:
+        _damon_result.result_cache = _damon_result_cache.ResultCache(
+                args.cache_dir, args.cache_size)
+
     for subcmd in subcmds:
         if subcmd.name == args.report_type:
             subcmd.execute(args)
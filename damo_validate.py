@@ -50,6 +50,8 @@ def set_argparser(parser):
             help='allowed percent of error samples')
     parser.add_argument('--regions_boundary', metavar='<start>-<end>',
             nargs='+', help='regions boundary')
+    parser.add_argument('--salvage', action='store_true',
+            help='cut out partially written snapshots at the end')
 
 def main(args=None):
     if not args:
@@ -61,6 +63,16 @@ def main(args=None):
         print('the file (%s) not found' % args.input)
         exit(1)
 
+    if args.salvage:
+        nr_snapshots, nr_cut_bytes, err = _damon_result.salvage_record(
+                args.input)
+        if err != None:
+            print(err)
+            exit(1)
+        print('%d snapshots remain, %d bytes cut out' %
+                (nr_snapshots, nr_cut_bytes))
+        return
+
     regions_boundary = []
     if args.regions_boundary:
         for boundary in args.regions_boundary:
@@ -69,6 +81,13 @@ def main(args=None):
                 print('wrong boundary input %s' % boundary)
             regions_boundary.append(parsed_boundary)
 
+    if (_damon_result.get_file_type(args.input) ==
+            _damon_result.file_type_record):
+        err = _damon_result.check_record_checksums(args.input)
+        if err != None:
+            print('invalid: %s' % err)
+            exit(1)
+
     result, err = _damon_result.parse_damon_result(args.input)
     if err != None:
         print('parsing failed (%s)' % err)
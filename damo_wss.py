@@ -4,6 +4,7 @@
 "Print out the distribution of the working set sizes of the given trace"
 
 import argparse
+import bisect
 import sys
 import tempfile
 
@@ -13,24 +14,71 @@ import _damo_fmt_str
 
 import damo_adjust
 
-def get_wss_dists(result, acc_thres, sz_thres, do_sort):
-    wss_dists = {}
-    for tid in result.target_snapshots.keys():
-        wss_dist = []
-        for idx, snapshot in enumerate(result.target_snapshots[tid]):
-            wss = 0
-            for r in snapshot.regions:
-                # Ignore regions not fulfill working set conditions
-                if r.nr_accesses < acc_thres:
-                    continue
-                if r.end - r.start < sz_thres:
-                    continue
-                wss += r.end - r.start
-            wss_dist.append(wss)
-        if do_sort:
+def get_wss(snapshot, acc_thres, sz_thres):
+    wss = 0
+    for r in snapshot.regions:
+        # Ignore regions not fulfill working set conditions
+        if r.nr_accesses < acc_thres:
+            continue
+        if r.end - r.start < sz_thres:
+            continue
+        wss += r.end - r.start
+    return wss
+
+def read_wss_dists(file_path, work_time, nr_snapshots_to_skip, acc_thres,
+        sz_thres, do_sort):
+    '''Returns the working set sizes of the snapshots of each target in the
+    file, aggregated for the work time, and an error string.  Snapshots are
+    read one by one'''
+    info, err = _damon_result.get_result_info(file_path)
+    if err:
+        return None, err
+
+    snapshots, err = _damon_result.iter_snapshots(file_path, info=info)
+    if err:
+        return None, err
+    snapshots = damo_adjust.iter_adjusted_snapshots(snapshots, info,
+            work_time, nr_snapshots_to_skip)
+    wss_dists = {tid: [] for tid in info.target_ids}
+    for snapshot in snapshots:
+        wss_dists[snapshot.target_id].append(
+                get_wss(snapshot, acc_thres, sz_thres))
+    if do_sort:
+        for wss_dist in wss_dists.values():
             wss_dist.sort(reverse=False)
-        wss_dists[tid] = wss_dist
-    return wss_dists
+    return wss_dists, None
+
+def add_wss(wss_dists, snapshot, acc_thres, sz_thres, do_sort):
+    if not snapshot.target_id in wss_dists:
+        wss_dists[snapshot.target_id] = []
+    wss_dist = wss_dists[snapshot.target_id]
+    wss = get_wss(snapshot, acc_thres, sz_thres)
+    if do_sort:
+        bisect.insort(wss_dist, wss)
+    else:
+        wss_dist.append(wss)
+
+def pr_followed_wss_dists(args, percentiles, do_sort):
+    '''Prints the distributions of the working set sizes each time new
+    snapshots are appended to the file'''
+    wss_dists = {}
+    try:
+        for snapshots in _damon_result.follow_snapshots(args.input,
+                args.follow_interval):
+            for snapshot in snapshots:
+                add_wss(wss_dists, snapshot, args.acc_thres, args.sz_thres,
+                        do_sort)
+            if wss_dists:
+                pr_wss_dists(wss_dists, percentiles, args.raw_number,
+                        args.nr_cols_bar, args.all_wss)
+                print('')
+                sys.stdout.flush()
+    except ValueError as e:
+        print('following monitoring result file (%s) failed (%s)' %
+                (args.input, e))
+        exit(1)
+    except KeyboardInterrupt:
+        pass
 
 def pr_wss_dists(wss_dists, percentiles, raw_number, nr_cols_bar, pr_all_wss):
     print('# <percentile> <wss>')
@@ -101,6 +149,11 @@ def set_argparser(parser):
             help='use machine-friendly raw numbers')
     parser.add_argument('--all_wss', action='store_true',
             help='Do not print percentile but all calculated wss')
+    parser.add_argument('--follow', action='store_true',
+            help='keep printing the distribution as the file grows')
+    parser.add_argument('--follow_interval', type=float, default=1.0,
+            metavar='<seconds>',
+            help='interval between checks of the file for --follow')
 
 def main(args=None):
     if not args:
@@ -115,15 +168,20 @@ def main(args=None):
         wss_sort = False
     raw_number = args.raw_number
 
-    result, err = _damon_result.parse_damon_result(file_path)
+    if args.follow:
+        if args.plot or args.work_time != 1:
+            print('--plot and --work_time are not supported with --follow')
+            exit(1)
+        pr_followed_wss_dists(args, percentiles, wss_sort)
+        return
+
+    wss_dists, err = read_wss_dists(file_path, args.work_time,
+            args.exclude_samples, args.acc_thres, args.sz_thres, wss_sort)
     if err != None:
         print('monitoring result file (%s) parsing failed (%s)' %
                 (file_path, err))
         exit(1)
 
-    damo_adjust.adjust_result(result, args.work_time, args.exclude_samples)
-    wss_dists = get_wss_dists(result, args.acc_thres, args.sz_thres, wss_sort)
-
     if args.plot:
         orig_stdout = sys.stdout
         tmp_path = tempfile.mkstemp()[1]
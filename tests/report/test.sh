@@ -30,6 +30,8 @@ test_report \
 	"$damo report raw -i perf.data.script" \
 	"raw_perf_script"
 
+test_report "$damo report raw -i perf.data" "raw_perf_data"
+
 test_report "$damo report wss -r 1 101 1 --raw_number" "wss"
 
 test_report "$damo report wss -r 1 101 1 --work_time 1000000 --raw_number" \
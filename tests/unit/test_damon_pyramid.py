@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import _test_damo_common
+
+_test_damo_common.add_damo_dir_to_syspath()
+
+import _damon_pyramid
+import _damon_result
+import damo_heats
+import damo_wss
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+perf_script_file = os.path.join(bindir, '..', 'report', 'perf.data.script')
+
+def snapshot_to_list(snapshot):
+    return [snapshot.target_id, snapshot.start_time, snapshot.end_time,
+        [[r.start, r.end, r.nr_accesses] for r in snapshot.regions]]
+
+def region_heats(snapshot):
+    return sum([(r.end - r.start) * r.nr_accesses for r in snapshot.regions])
+
+def heats_of(args):
+    '''Returns the pixels that 'damo report heats' prints'''
+    parser = argparse.ArgumentParser()
+    damo_heats.set_argparser(parser)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        damo_heats.main(parser.parse_args(args))
+    return [[float(x) for x in line.split()]
+            for line in out.getvalue().strip().split('\n')]
+
+class TestDamonPyramid(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'damon.data')
+        shutil.copy(perf_script_file, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_build_pyramid(self):
+        info, err = _damon_result.get_result_info(self.path)
+        self.assertEqual(err, None)
+        paths, err = _damon_pyramid.build_pyramid(self.path, 4, 2)
+        self.assertEqual(err, None)
+        self.assertEqual(paths, ['%s.pyramid.1' % self.path,
+            '%s.pyramid.2' % self.path])
+
+        levels = _damon_pyramid.read_levels(self.path)
+        self.assertEqual([l['nr_shots_in_aggr'] for l in levels], [4, 16])
+        for path, level in zip(paths, levels):
+            nr_shots = level['nr_shots_in_aggr']
+            self.assertEqual(level['snapshot_time'],
+                    nr_shots * info.snapshot_time)
+            level_info, err = _damon_pyramid.level_info(level)
+            self.assertEqual(err, None)
+            self.assertEqual(level_info.nr_snapshots,
+                    (info.nr_snapshots + nr_shots - 1) // nr_shots)
+            self.assertAlmostEqual(level_info.start_time, info.start_time,
+                    delta=info.snapshot_time)
+            self.assertEqual(level_info.end_time, info.end_time)
+
+        self.assertEqual(_damon_pyramid.coarsest_level(self.path,
+            lambda level: level['nr_shots_in_aggr'] <= 8), levels[0])
+        self.assertEqual(_damon_pyramid.coarsest_level(self.path,
+            lambda level: False), None)
+
+        # levels of less than three snapshots are not built
+        paths, err = _damon_pyramid.build_pyramid(self.path, 4)
+        self.assertEqual(err, None)
+        self.assertEqual(len(paths), 4)
+
+        # the pyramid should be ignored once the file is changed
+        with open(self.path, 'a') as f:
+            f.write('\n')
+        self.assertEqual(_damon_pyramid.read_levels(self.path), [])
+
+    def test_wss_with_pyramid(self):
+        # the pyramid should not affect the exact wss report
+        args = [self.path, 800000, 2, 1, 1, True]
+        expected, err = damo_wss.read_wss_dists(*args)
+        self.assertEqual(err, None)
+        paths, err = _damon_pyramid.build_pyramid(self.path, 2)
+        self.assertEqual(err, None)
+        self.assertTrue(len(paths) > 0)
+        self.assertEqual(damo_wss.read_wss_dists(*args), (expected, None))
+
+    def test_aggregate_level_snapshots(self):
+        snapshots, err = _damon_result.iter_snapshots(self.path)
+        self.assertEqual(err, None)
+        snapshots = list(snapshots)[:8]
+        # aggregating the aggregations is same to aggregating at once
+        expected = _damon_pyramid.aggregate_level_snapshots(snapshots)
+        aggregated = _damon_pyramid.aggregate_level_snapshots([
+            _damon_pyramid.aggregate_level_snapshots(snapshots[i:i + 2])
+            for i in range(0, 8, 2)])
+        self.assertEqual(snapshot_to_list(aggregated),
+                snapshot_to_list(expected))
+        # heats are kept
+        self.assertEqual(region_heats(expected),
+                sum([region_heats(s) for s in snapshots]))
+
+    def test_heats_with_pyramid(self):
+        # snapshots of uneven regions, of 100 ns interval
+        result = _damon_result.DAMONResult()
+        snapshots = []
+        for idx in range(64):
+            snapshot = _damon_result.DAMONSnapshot(1000 + idx * 100,
+                    1000 + (idx + 1) * 100, 42)
+            boundaries = [0, 4096 * (idx % 5 + 1), 4096 * (idx % 7 + 6),
+                    4096 * 16]
+            snapshot.regions = [_damon_result.DAMONRegion(start, end,
+                (idx * 3 + i) % 10, None) for i, (start, end) in
+                enumerate(zip(boundaries[:-1], boundaries[1:]))]
+            snapshots.append(snapshot)
+        result.target_snapshots[42] = snapshots
+        result.nr_snapshots = len(snapshots)
+        _damon_result.write_damon_record(result, self.path, 2, 0o600)
+
+        args = ['--input', self.path, '--tid', '42', '--resol', '8', '8',
+                '--time_range', '1000', '7400', '--address_range', '0',
+                '%d' % (4096 * 16)]
+        expected = heats_of(args)
+        paths, err = _damon_pyramid.build_pyramid(self.path)
+        self.assertEqual(err, None)
+        self.assertEqual(len(paths), 4)
+        heats = heats_of(args)
+        self.assertEqual(len(heats), len(expected))
+        for pixel, expected_pixel in zip(heats, expected):
+            self.assertEqual(pixel[:2], expected_pixel[:2])
+            self.assertAlmostEqual(pixel[2], expected_pixel[2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,801 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import array
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import unittest.mock
+import zipfile
+
+import _test_damo_common
+
+_test_damo_common.add_damo_dir_to_syspath()
+
+import _damo_perf_data
+import _damon_result
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+record_file = os.path.join(bindir, '..', 'report', 'damon.data')
+perf_data_file = os.path.join(bindir, '..', 'report', 'perf.data')
+perf_script_file = os.path.join(bindir, '..', 'report', 'perf.data.script')
+
+def snapshot_to_list(snapshot):
+    return [snapshot.target_id, snapshot.start_time, snapshot.end_time,
+        [[r.start, r.end, r.nr_accesses, r.age] for r in snapshot.regions]]
+
+def snapshots_to_list(result):
+    return [snapshot_to_list(snapshot)
+        for snapshots in result.target_snapshots.values()
+        for snapshot in snapshots]
+
+class TestDamonResult(unittest.TestCase):
+    def test_get_file_type(self):
+        _test_damo_common.test_input_expects(self,
+                _damon_result.get_file_type,
+                {
+                    record_file: _damon_result.file_type_record,
+                    perf_data_file: _damon_result.file_type_perf_data,
+                    perf_script_file: _damon_result.file_type_perf_script,
+                    })
+
+    def test_snapshot_regions(self):
+        snapshot = _damon_result.DAMONSnapshot(10, 20, 42)
+        snapshot.regions.append(_damon_result.DAMONRegion(0, 4096, 3, None))
+        snapshot.regions += [_damon_result.DAMONRegion(4096, 8192, 5, 7)]
+        self.assertEqual(len(snapshot.regions), 2)
+        self.assertEqual(
+                [[r.start, r.end, r.nr_accesses, r.age]
+                    for r in snapshot.regions],
+                [[0, 4096, 3, None], [4096, 8192, 5, 7]])
+        self.assertEqual(snapshot.regions[-1].age, 7)
+        self.assertEqual(list(snapshot.starts), [0, 4096])
+
+        snapshot.regions = [_damon_result.DAMONRegion(0, 0, -1, -1)]
+        self.assertEqual(
+                [[r.start, r.end, r.nr_accesses, r.age]
+                    for r in snapshot.regions], [[0, 0, -1, -1]])
+
+    def test_parse_record(self):
+        result, err = _damon_result.parse_damon_result(record_file)
+        self.assertEqual(err, None)
+        self.assertEqual(list(result.target_snapshots.keys()),
+                [18446623438842320000])
+        self.assertEqual(result.nr_snapshots, 543)
+        self.assertEqual(result.end_time, 596606618651)
+
+        snapshots = result.target_snapshots[18446623438842320000]
+        self.assertEqual(len(snapshots), 543)
+        self.assertEqual(snapshots[0].end_time, 539914032967)
+        self.assertEqual(snapshots[1].start_time, 539914032967)
+        self.assertEqual(len(snapshots[0].regions), 10)
+        region = snapshots[0].regions[0]
+        self.assertEqual([region.start, region.end, region.nr_accesses,
+            region.age], [94827419009024, 94827423150080, 0, None])
+
+    def test_parse_perf_data(self):
+        result, err = _damon_result.parse_damon_result(perf_data_file)
+        self.assertEqual(err, None)
+        script_result, err = _damon_result.parse_damon_result(
+                perf_script_file)
+        self.assertEqual(err, None)
+
+        # perf script shows the time in microseconds
+        snapshots = snapshots_to_list(result)
+        script_snapshots = snapshots_to_list(script_result)
+        self.assertEqual(len(snapshots), len(script_snapshots))
+        for snapshot, script_snapshot in zip(snapshots, script_snapshots):
+            self.assertEqual(snapshot[0], script_snapshot[0])
+            self.assertEqual(snapshot[2] // 1000,
+                    (script_snapshot[2] + 1) // 1000)
+            self.assertEqual(snapshot[3], script_snapshot[3])
+
+    def test_parse_perf_script_parallel(self):
+        expected = snapshots_to_list(
+                _damon_result.parse_perf_script_file(perf_script_file, 1))
+
+        # make chunk boundaries split snapshots
+        with unittest.mock.patch.object(_damon_result,
+                'perf_script_parallel_min_sz', 0), \
+                unittest.mock.patch.object(_damon_result,
+                        'perf_script_chunk_sz', 4096):
+            for nr_jobs in [2, 3]:
+                self.assertTrue(len(_damon_result.perf_script_chunks(
+                    perf_script_file, nr_jobs)) > nr_jobs)
+                self.assertEqual(snapshots_to_list(
+                    _damon_result.parse_perf_script_file(perf_script_file,
+                        nr_jobs)), expected)
+
+    def test_record_write_read(self):
+        result, err = _damon_result.parse_damon_result(record_file)
+        self.assertEqual(err, None)
+        for tid, snapshots in result.target_snapshots.items():
+            result.target_snapshots[tid] = list(snapshots)
+        expected = snapshots_to_list(result)
+
+        for fmt_version in [2, 3, 6, 1]:
+            if fmt_version == 1:
+                # format version 1 supports only 'int' target ids
+                for snapshots in result.target_snapshots.values():
+                    for snapshot in snapshots:
+                        snapshot.target_id = 42
+                expected = snapshots_to_list(result)
+            fd, tmp_path = tempfile.mkstemp()
+            os.close(fd)
+            _damon_result.write_damon_record(result, tmp_path, fmt_version,
+                    0o600)
+            written, err = _damon_result.parse_damon_result(tmp_path)
+            os.remove(tmp_path)
+            self.assertEqual(err, None)
+            self.assertEqual(snapshots_to_list(written), expected)
+
+    def test_write_chunks(self):
+        result, err = _damon_result.parse_damon_result(perf_script_file)
+        self.assertEqual(err, None)
+        nr_regions = sum([len(snapshot.regions)
+            for snapshots in result.target_snapshots.values()
+            for snapshot in snapshots])
+
+        outputs = []
+        for chunk_sz in [_damon_result.write_chunk_sz, 4096]:
+            fd, tmp_path = tempfile.mkstemp()
+            os.close(fd)
+            with unittest.mock.patch.object(_damon_result, 'write_chunk_sz',
+                    chunk_sz):
+                _damon_result.write_damon_perf_script(result, tmp_path, 0o600)
+                with open(tmp_path, 'rb') as f:
+                    outputs.append([f.read()])
+                _damon_result.write_damon_record(result, tmp_path, 2, 0o600)
+                with open(tmp_path, 'rb') as f:
+                    outputs[-1].append(f.read())
+            os.remove(tmp_path)
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0][0].count(b'\n'), nr_regions)
+        self.assertEqual(outputs[0][0].split(b'\n')[0],
+                b'kdamond.x xxxx xxxx 82820.952659: damon:damon_aggregated: '
+                b'target_id=18446623435582458880 nr_regions=8 '
+                b'94253027950592-94253031862272: 0 None')
+
+    def test_update_result_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        tmp_path = os.path.join(tmp_dir, 'damon.data')
+        for path in [record_file, perf_data_file]:
+            result, err = _damon_result.parse_damon_result(path)
+            expected = snapshots_to_list(result)
+            with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                dst.write(src.read())
+            self.assertEqual(_damon_result.update_result_file(tmp_path,
+                'record', 0o600, 'zlib'), None)
+            self.assertEqual(os.listdir(tmp_dir), ['damon.data'])
+            written, err = _damon_result.parse_damon_result(tmp_path)
+            self.assertEqual(err, None)
+            self.assertEqual(snapshots_to_list(written), expected)
+
+        # failed conversion should keep the original file
+        with open(tmp_path, 'rb') as f:
+            content = f.read()
+        self.assertRaises(KeyError, _damon_result.update_result_file,
+                tmp_path, 'record', 0o600, 'foo')
+        self.assertEqual(os.listdir(tmp_dir), ['damon.data'])
+        with open(tmp_path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        os.remove(tmp_path)
+        os.rmdir(tmp_dir)
+
+    def test_write_snapshots_fmt_version(self):
+        result, err = _damon_result.parse_damon_result(record_file)
+        self.assertEqual(err, None)
+        snapshots = list(result.target_snapshots.values())[0]
+
+        tmp_dir = tempfile.mkdtemp()
+        tmp_path = os.path.join(tmp_dir, 'damon.data')
+        # newer format versions are written only if explicitly asked
+        for format_version, expected in [[None, 2], [3, 3], [6, 6]]:
+            _damon_result.write_snapshots(snapshots, tmp_path, 'record',
+                    0o600, format_version=format_version)
+            with open(tmp_path, 'rb') as f:
+                self.assertEqual(_damon_result.read_record_fmt_version(
+                    f.read(20))[0], expected)
+        os.remove(tmp_path)
+        os.rmdir(tmp_dir)
+
+    def test_set_record_regions(self):
+        regions = [[0, 4096, 0], [4096, 0xffffffff00001000, 0xfffffffe],
+                [0xffffffff00001000, 0xfffffffffffff000, 1]]
+        block = b''.join([_damon_result.record_region.pack(*r)
+            for r in regions])
+        # decode by regions, and by columns
+        for min_regions in [len(regions) + 1, 0]:
+            snapshot = _damon_result.DAMONSnapshot(0, 1, 42)
+            with unittest.mock.patch.object(_damon_result,
+                    'record_columns_decode_min_regions', min_regions):
+                _damon_result.set_record_regions(snapshot, block)
+            self.assertEqual(snapshot_to_list(snapshot), [42, 0, 1,
+                [r + [None] for r in regions]])
+
+    def test_record_index(self):
+        snapshots, err = _damon_result.iter_snapshots(record_file)
+        expected = [snapshot_to_list(s) for s in snapshots][1:]
+
+        lazy_result, f, fmt_version, err = \
+                _damon_result.mmap_record_to_damon_result(record_file)
+        f.close()
+        self.assertEqual(err, None)
+        self.assertEqual(fmt_version, 2)
+        snapshots = lazy_result.target_snapshots[18446623438842320000]
+        self.assertEqual(type(snapshots), _damon_result.DAMONRecordSnapshots)
+        self.assertEqual(len(snapshots), 543)
+        # start time of the first snapshot is set by parse_damon_result()
+        self.assertEqual(snapshots_to_list(lazy_result)[1:], expected)
+        self.assertEqual(
+                [s.end_time for s in snapshots[100:103]],
+                [expected[99][2], expected[100][2], expected[101][2]])
+        self.assertEqual(snapshots[100:103][0].start_time, expected[98][2])
+        self.assertEqual(snapshots[-1].end_time, expected[-1][2])
+
+        tmp_dir = tempfile.mkdtemp()
+        tmp_path = os.path.join(tmp_dir, 'damon.data')
+        with open(record_file, 'rb') as src, open(tmp_path, 'wb') as dst:
+            dst.write(src.read())
+        self.assertEqual(_damon_result.load_record_index(tmp_path), None)
+        self.assertEqual(_damon_result.save_record_index(tmp_path), None)
+        index = _damon_result.load_record_index(tmp_path)
+        with open(tmp_path, 'rb') as f:
+            built = _damon_result.build_record_index(f.read())
+        self.assertEqual([index.offsets, index.end_times, index.target_ids],
+                [built.offsets, built.end_times, built.target_ids])
+
+        # the saved index should be ignored once the file is changed
+        with open(tmp_path, 'ab') as f:
+            f.write(b'foo')
+        self.assertEqual(_damon_result.load_record_index(tmp_path), None)
+        os.remove(_damon_result.record_index_path(tmp_path))
+        os.remove(tmp_path)
+        os.rmdir(tmp_dir)
+
+    def test_iter_snapshots(self):
+        for path in [record_file, perf_data_file, perf_script_file]:
+            result, err = _damon_result.parse_damon_result(path)
+            self.assertEqual(err, None)
+            expected = snapshots_to_list(result)
+
+            info, err = _damon_result.get_result_info(path)
+            self.assertEqual(err, None)
+            self.assertEqual(info.target_ids,
+                    list(result.target_snapshots.keys()))
+            self.assertEqual(
+                    [info.start_time, info.end_time, info.nr_snapshots],
+                    [result.start_time, result.end_time, result.nr_snapshots])
+
+            snapshots, err = _damon_result.iter_snapshots(path)
+            self.assertEqual(err, None)
+            self.assertEqual([snapshot_to_list(s) for s in snapshots],
+                    expected)
+
+            snapshots, err = _damon_result.iter_snapshots(path,
+                    target=info.target_ids[0] + 1)
+            self.assertEqual(list(snapshots), [])
+
+            time_range = [expected[10][2], expected[12][2]]
+            snapshots, err = _damon_result.iter_snapshots(path,
+                    time_range=time_range)
+            self.assertEqual([snapshot_to_list(s) for s in snapshots],
+                    expected[11:13])
+
+    def test_iter_snapshots_indexed(self):
+        tmp_dir = tempfile.mkdtemp()
+        for path in [record_file, perf_script_file]:
+            tmp_path = os.path.join(tmp_dir, os.path.basename(path))
+            with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                dst.write(src.read())
+            snapshots, err = _damon_result.iter_snapshots(tmp_path)
+            expected = [snapshot_to_list(s) for s in snapshots]
+            self.assertEqual(_damon_result.save_record_index(tmp_path), None)
+
+            for time_range in [[expected[0][2], expected[3][2]],
+                    [expected[100][2] + 1, expected[200][2] - 1],
+                    [expected[-3][2], expected[-1][2] + 1000000000]]:
+                snapshots, err = _damon_result.iter_snapshots(tmp_path,
+                        time_range=time_range)
+                self.assertEqual(err, None)
+                self.assertEqual([snapshot_to_list(s) for s in snapshots],
+                        [s for s in expected if s[2] > time_range[0] and
+                            s[1] < time_range[1]])
+            os.remove(_damon_result.record_index_path(tmp_path))
+            os.remove(tmp_path)
+        os.rmdir(tmp_dir)
+
+    def test_iter_snapshots_addr_range(self):
+        for path in [record_file, perf_data_file, perf_script_file]:
+            info, err = _damon_result.get_result_info(path)
+            snapshots, err = _damon_result.iter_snapshots(path)
+            expected = [snapshot_to_list(s) for s in snapshots]
+            regions = expected[0][3]
+            addr_range = [regions[1][0] + 1, regions[-2][1] - 1]
+            for snapshot in expected:
+                snapshot[3] = [r for r in snapshot[3]
+                        if r[0] < addr_range[1] and addr_range[0] < r[1]]
+
+            snapshots, err = _damon_result.iter_snapshots(path,
+                    info.target_ids[0], addr_range=addr_range)
+            self.assertEqual(err, None)
+            self.assertEqual([snapshot_to_list(s) for s in snapshots],
+                    expected)
+
+    def test_record_v3(self):
+        result, err = _damon_result.parse_damon_result(perf_script_file)
+        self.assertEqual(err, None)
+        expected = snapshots_to_list(result)
+
+        fd, tmp_path = tempfile.mkstemp()
+        os.close(fd)
+        _damon_result.write_damon_record(result, tmp_path, 3, 0o600)
+        self.assertEqual(_damon_result.get_file_type(tmp_path),
+                _damon_result.file_type_record)
+        # ages are kept in the format version 3
+        written, err = _damon_result.parse_damon_result(tmp_path)
+        self.assertEqual(err, None)
+        self.assertEqual(snapshots_to_list(written), expected)
+        with open(tmp_path, 'rb') as f:
+            buf = f.read()
+        self.assertEqual(_damon_result.read_record_fmt_version(buf)[0], 3)
+        index = _damon_result.build_record_index(buf)
+        self.assertEqual(len(index), len(expected))
+        # the index should be built from the headers if no footer
+        footer = _damon_result.read_record_v3_footer(
+                buf[-_damon_result.record_v3_footer.size:], len(buf))
+        walked = _damon_result.build_record_index(buf[:footer[0]])
+        self.assertEqual(
+                [index.offsets, index.end_times, index.target_ids],
+                [walked.offsets, walked.end_times, walked.target_ids])
+        os.remove(tmp_path)
+
+    def test_record_v6(self):
+        result, err = _damon_result.parse_damon_result(perf_script_file)
+        self.assertEqual(err, None)
+        expected = snapshots_to_list(result)
+
+        fd, tmp_path = tempfile.mkstemp()
+        os.close(fd)
+        _damon_result.write_damon_record(result, tmp_path, 6, 0o600)
+        self.assertEqual(_damon_result.check_record_checksums(tmp_path),
+                None)
+        self.assertEqual(_damon_result.salvage_record(tmp_path),
+                (len(expected), 0, None))
+        with open(tmp_path, 'rb') as f:
+            buf = f.read()
+        footer = _damon_result.read_record_v3_footer(
+                buf[-_damon_result.record_v3_footer.size:], len(buf),
+                _damon_result.record_v6_footer_mark)
+
+        # partially written last frame
+        with open(tmp_path, 'wb') as f:
+            f.write(buf[:footer[0] - 100])
+        self.assertNotEqual(_damon_result.check_record_checksums(tmp_path),
+                None)
+        written, err = _damon_result.parse_damon_result(tmp_path)
+        # start time of the first snapshot is estimated from the others
+        self.assertEqual(snapshots_to_list(written)[1:], expected[1:-1])
+        nr_snapshots, nr_cut_bytes, err = _damon_result.salvage_record(
+                tmp_path)
+        self.assertEqual([nr_snapshots, err], [len(expected) - 1, None])
+        self.assertEqual(_damon_result.check_record_checksums(tmp_path),
+                None)
+        written, err = _damon_result.parse_damon_result(tmp_path)
+        self.assertEqual(snapshots_to_list(written)[1:], expected[1:-1])
+
+        # completely written last frame having a wrong checksum
+        corrupted = bytearray(buf[:footer[0]])
+        corrupted[-1] ^= 0xff
+        with open(tmp_path, 'wb') as f:
+            f.write(corrupted)
+        self.assertNotEqual(_damon_result.check_record_checksums(tmp_path),
+                None)
+        written, err = _damon_result.parse_damon_result(tmp_path)
+        self.assertEqual(err, None)
+        self.assertEqual(snapshots_to_list(written)[1:], expected[1:-1])
+        self.assertEqual(_damon_result.salvage_record(tmp_path)[0],
+                len(expected) - 1)
+        written, err = _damon_result.parse_damon_result(tmp_path)
+        self.assertEqual(snapshots_to_list(written)[1:], expected[1:-1])
+        os.remove(tmp_path)
+
+    def test_follow(self):
+        result, err = _damon_result.parse_damon_result(perf_script_file)
+        self.assertEqual(err, None)
+        expected = snapshots_to_list(result)
+
+        tmp_dir = tempfile.mkdtemp()
+        src_path = os.path.join(tmp_dir, 'src')
+        tmp_path = os.path.join(tmp_dir, 'growing')
+        for fmt_version in [2, 3, 6, None]:
+            if fmt_version == None:
+                src_path = perf_script_file
+            else:
+                _damon_result.write_damon_record(result, src_path,
+                        fmt_version, 0o600)
+            with open(src_path, 'rb') as f:
+                content = f.read()
+
+            follower = _damon_result.DAMONResultFollower(tmp_path)
+            followed = []
+            # append the content in chunks that split snapshots
+            for offset in range(0, len(content) + 8191, 8191):
+                with open(tmp_path, 'ab') as f:
+                    f.write(content[offset:offset + 8191])
+                snapshots, err = follower.read()
+                self.assertEqual(err, None)
+                followed += [snapshot_to_list(s) for s in snapshots]
+            # start time of the first snapshot is estimated differently
+            self.assertEqual(followed[1:], expected[1:])
+            self.assertEqual(followed[0][2:], expected[0][2:])
+            self.assertEqual(follower.finished, fmt_version in [3, 6])
+            os.remove(tmp_path)
+        os.remove(os.path.join(tmp_dir, 'src'))
+        os.rmdir(tmp_dir)
+
+    def test_follow_finished_v3(self):
+        # the index of a large record should not be read as a snapshot
+        result = _damon_result.DAMONResult()
+        snapshots = []
+        for idx in range(3000):
+            snapshot = _damon_result.DAMONSnapshot(idx * 100, (idx + 1) * 100,
+                    42)
+            snapshot.regions = [_damon_result.DAMONRegion(i * 4096,
+                (i + 1) * 4096, (idx + i) % 20, idx) for i in range(10)]
+            snapshots.append(snapshot)
+        result.target_snapshots[42] = snapshots
+        result.nr_snapshots = len(snapshots)
+        expected = snapshots_to_list(result)
+
+        tmp_dir = tempfile.mkdtemp()
+        tmp_path = os.path.join(tmp_dir, 'damon.data')
+        _damon_result.write_damon_record(result, tmp_path, 3, 0o600)
+        follower = _damon_result.DAMONResultFollower(tmp_path)
+        followed, err = follower.read()
+        self.assertEqual(err, None)
+        self.assertTrue(follower.finished)
+        followed = [snapshot_to_list(s) for s in followed]
+        self.assertEqual(followed[1:], expected[1:])
+        self.assertEqual(followed[0][2:], expected[0][2:])
+        shutil.rmtree(tmp_dir)
+
+    def test_follow_perf_data(self):
+        result, err = _damon_result.parse_damon_result(perf_data_file)
+        self.assertEqual(err, None)
+        expected = snapshots_to_list(result)
+        with open(perf_data_file, 'rb') as f:
+            content = f.read()
+        perf_data, err = _damo_perf_data.read_perf_data(perf_data_file)
+        self.assertEqual(err, None)
+        data_end = perf_data.data_offset + perf_data.data_size
+
+        tmp_dir = tempfile.mkdtemp()
+        tmp_path = os.path.join(tmp_dir, 'perf.data')
+        # 'perf record' updates the data size in the header at the end
+        header = bytearray(content[:perf_data.data_offset])
+        header[48:56] = b'\0' * 8
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+        follower = _damon_result.DAMONResultFollower(tmp_path)
+        followed = []
+        # append the data in chunks that split records
+        for offset in range(perf_data.data_offset, data_end, 8191):
+            with open(tmp_path, 'ab') as f:
+                f.write(content[offset:min(offset + 8191, data_end)])
+            snapshots, err = follower.read()
+            self.assertEqual(err, None)
+            followed += [snapshot_to_list(s) for s in snapshots]
+            self.assertFalse(follower.finished)
+        self.assertTrue(len(followed) > 0)
+        self.assertTrue(len(followed) < len(expected))
+
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        snapshots, err = follower.read()
+        self.assertEqual(err, None)
+        followed += [snapshot_to_list(s) for s in snapshots]
+        self.assertTrue(follower.finished)
+        # the tracepoint format is unknown while recording, so ages of the
+        # default format are read
+        for snapshot in followed + expected:
+            snapshot[3] = [region[:3] for region in snapshot[3]]
+        # start time of the first snapshot is estimated differently
+        self.assertEqual(followed[1:], expected[1:])
+        self.assertEqual(followed[0][2:], expected[0][2:])
+        shutil.rmtree(tmp_dir)
+
+    def test_merge_snapshots(self):
+        result, err = _damon_result.parse_damon_result(perf_script_file)
+        self.assertEqual(err, None)
+        expected = snapshots_to_list(result)
+        target_id = expected[0][0]
+
+        # time-sharded files of same target
+        tmp_dir = tempfile.mkdtemp()
+        shard_paths = [os.path.join(tmp_dir, name)
+                for name in ['shard0', 'shard1']]
+        snapshots = list(result.target_snapshots[target_id])
+        for path, shard in zip(shard_paths, [snapshots[:300],
+            snapshots[300:]]):
+            result.target_snapshots[target_id] = shard
+            result.nr_snapshots = len(shard)
+            _damon_result.write_damon_record(result, path, 6, 0o600)
+        merged, err = _damon_result.merge_snapshots(
+                [shard_paths[1], shard_paths[0]])
+        self.assertEqual(err, None)
+        merged = [snapshot_to_list(s) for s in merged]
+        self.assertEqual([s[2:] for s in merged], [s[2:] for s in expected])
+        self.assertEqual(set([s[0] for s in merged]), set([target_id]))
+
+        # overlapping files of different targets having same id
+        merged, err = _damon_result.merge_snapshots(
+                [perf_script_file, record_file, shard_paths[1]])
+        self.assertEqual(err, None)
+        merged = [snapshot_to_list(s) for s in merged]
+        self.assertEqual([s[2] for s in merged],
+                sorted([s[2] for s in merged]))
+        self.assertEqual(set([s[0] for s in merged]),
+                set([target_id, 18446623438842320000, 0]))
+        self.assertEqual([s[2:] for s in merged if s[0] == 0],
+                [s[2:] for s in expected[300:]])
+        for path in shard_paths:
+            os.remove(path)
+        os.rmdir(tmp_dir)
+
+    def test_segments(self):
+        result, err = _damon_result.parse_damon_result(perf_script_file)
+        self.assertEqual(err, None)
+        expected = snapshots_to_list(result)
+        info, err = _damon_result.get_result_info(perf_script_file)
+        self.assertEqual(err, None)
+        target_id = expected[0][0]
+
+        tmp_dir = tempfile.mkdtemp()
+        manifest_path = os.path.join(tmp_dir, 'damon.data')
+        segment_paths = ['%s.%d' % (manifest_path, i) for i in range(3)]
+        snapshots = list(result.target_snapshots[target_id])
+        for path, segment in zip(segment_paths, [snapshots[:100],
+            snapshots[100:300], snapshots[300:]]):
+            _damon_result.write_snapshots(segment, path, 'record', 0o600)
+        self.assertEqual(_damon_result.write_segments_manifest(manifest_path,
+            segment_paths), None)
+        self.assertEqual(_damon_result.get_file_type(manifest_path),
+                'segments')
+
+        seg_info, err = _damon_result.get_result_info(manifest_path)
+        self.assertEqual(err, None)
+        self.assertEqual([seg_info.target_ids, seg_info.nr_target_snapshots,
+            seg_info.start_time, seg_info.end_time, seg_info.nr_snapshots,
+            seg_info.snapshot_time],
+            [info.target_ids, info.nr_target_snapshots, info.start_time,
+                info.end_time, info.nr_snapshots, info.snapshot_time])
+
+        parsed, err = _damon_result.parse_damon_result(manifest_path)
+        self.assertEqual(err, None)
+        self.assertEqual(snapshots_to_list(parsed), expected)
+
+        time_range = [expected[150][2], expected[250][2]]
+        snapshots, err = _damon_result.iter_snapshots(manifest_path,
+                time_range=time_range)
+        self.assertEqual(err, None)
+        self.assertEqual([snapshot_to_list(s) for s in snapshots],
+                expected[151:251])
+
+        # conversion of rotated perf.data files
+        rotated_path = os.path.join(tmp_dir, 'damon.data.2023010100000000')
+        shutil.copy(perf_data_file, rotated_path)
+        paths, err = _damon_result.write_record_segments(manifest_path,
+                [rotated_path], 'record', 0o600)
+        self.assertEqual(err, None)
+        self.assertEqual(paths, segment_paths[:1])
+        self.assertFalse(os.path.exists(rotated_path))
+        parsed, err = _damon_result.parse_damon_result(manifest_path)
+        self.assertEqual(err, None)
+        perf_data_result, err = _damon_result.parse_damon_result(
+                perf_data_file)
+        self.assertEqual(err, None)
+        self.assertEqual(snapshots_to_list(parsed),
+                snapshots_to_list(perf_data_result))
+        for path in segment_paths + [manifest_path]:
+            os.remove(path)
+        os.rmdir(tmp_dir)
+
+    def test_npy(self):
+        result, err = _damon_result.parse_damon_result(perf_script_file)
+        self.assertEqual(err, None)
+        expected = snapshots_to_list(result)
+
+        tmp_dir = tempfile.mkdtemp()
+        for npz in [True, False]:
+            path = os.path.join(tmp_dir, 'damon.data.npz' if npz else
+                    'damon.data.npy')
+            snapshots, err = _damon_result.iter_snapshots(perf_script_file)
+            self.assertEqual(err, None)
+            _damon_result.write_npy_snapshots(snapshots, path, npz)
+            self.assertEqual(_damon_result.get_file_type(path), 'npy')
+
+            parsed, err = _damon_result.parse_damon_result(path)
+            self.assertEqual(err, None)
+            self.assertEqual(snapshots_to_list(parsed), expected)
+
+            snapshots, err = _damon_result.iter_snapshots(path)
+            self.assertEqual(err, None)
+            self.assertEqual([snapshot_to_list(s) for s in snapshots],
+                    expected)
+        shutil.rmtree(tmp_dir)
+
+    @unittest.skipUnless(sys.byteorder == 'little',
+            'arrays are copied on big endian machines')
+    def test_npy_mmap(self):
+        result, err = _damon_result.parse_damon_result(perf_script_file)
+        self.assertEqual(err, None)
+        expected = snapshots_to_list(result)
+
+        tmp_dir = tempfile.mkdtemp()
+        for npz in [True, False]:
+            path = os.path.join(tmp_dir, 'damon.data.npz' if npz else
+                    'damon.data.npy')
+            snapshots, err = _damon_result.iter_snapshots(perf_script_file)
+            self.assertEqual(err, None)
+            _damon_result.write_npy_snapshots(snapshots, path, npz)
+            for arr in _damon_result.read_npy_arrays(path).values():
+                self.assertTrue(isinstance(arr, memoryview))
+
+        # compressed members are read by copying
+        path = os.path.join(tmp_dir, 'damon.data.npz')
+        deflated_path = os.path.join(tmp_dir, 'deflated.npz')
+        with zipfile.ZipFile(path) as z:
+            with zipfile.ZipFile(deflated_path, 'w',
+                    zipfile.ZIP_DEFLATED) as deflated:
+                for name in z.namelist():
+                    deflated.writestr(name, z.read(name))
+        for arr in _damon_result.read_npy_arrays(deflated_path).values():
+            self.assertTrue(isinstance(arr, array.array))
+        parsed, err = _damon_result.parse_damon_result(deflated_path)
+        self.assertEqual(err, None)
+        self.assertEqual(snapshots_to_list(parsed), expected)
+        shutil.rmtree(tmp_dir)
+
+    def test_aggregate_snapshots(self):
+        snapshots = []
+        for idx, regions in enumerate([[[1, 10, 5]], [[1, 5, 2], [5, 10, 4]],
+                [[0, 3, 1], [3, 12, 6]]]):
+            snapshot = _damon_result.DAMONSnapshot(idx, idx + 1, 0)
+            snapshot.regions = [_damon_result.DAMONRegion(start, end,
+                nr_accesses, None) for start, end, nr_accesses in regions]
+            snapshots.append(snapshot)
+        aggregated = _damon_result.aggregate_snapshots(snapshots)
+        self.assertEqual(snapshot_to_list(aggregated), [0, 0, 3,
+            [[1, 10, 15, None], [0, 1, 1, None], [10, 12, 6, None]]])
+
+        # fragmented regions should not be a problem
+        snapshots = []
+        for idx in range(2):
+            snapshot = _damon_result.DAMONSnapshot(idx, idx + 1, 0)
+            snapshot.regions = [_damon_result.DAMONRegion(start,
+                start + 1 + idx, 1, None) for start in range(0, 4000, 1 + idx)]
+            snapshots.append(snapshot)
+        aggregated = _damon_result.aggregate_snapshots(snapshots)
+        self.assertEqual(len(aggregated.regions), 4000)
+        self.assertEqual(set(aggregated.nr_accesses), set([2]))
+
+    @unittest.skipUnless(_damon_result.numpy != None,
+            'numpy is not installed')
+    def test_np_aggregate_snapshots(self):
+        result, err = _damon_result.parse_damon_result(perf_script_file)
+        self.assertEqual(err, None)
+        for snapshots in result.target_snapshots.values():
+            for i in range(0, len(snapshots), 10):
+                window = snapshots[i:i + 10]
+                aggregated = _damon_result.np_aggregate_snapshots(window)
+                self.assertNotEqual(aggregated, None)
+                with unittest.mock.patch.object(_damon_result, 'use_numpy',
+                        False):
+                    expected = _damon_result.aggregate_snapshots(window)
+                self.assertEqual(snapshot_to_list(aggregated),
+                        snapshot_to_list(expected))
+
+    def test_parallel_aggregation(self):
+        result, err = _damon_result.parse_damon_result(perf_script_file)
+        self.assertEqual(err, None)
+        snapshots = [s for target_snapshots in
+                result.target_snapshots.values() for s in target_snapshots]
+        expected = [snapshot_to_list(s) for s in
+                _damon_result.iter_window_aggregated_snapshots(snapshots, 3,
+                    5)]
+        # more shards than those could be in flight at once, and the
+        # incomplete last shard
+        for shard_sz, nr_jobs in [[4, 2], [2, 2], [5, 3]]:
+            self.assertTrue(len(expected) > shard_sz * nr_jobs * 2)
+            with unittest.mock.patch.object(_damon_result,
+                    'aggregate_shard_sz', shard_sz):
+                aggregated = [snapshot_to_list(s) for s in
+                        _damon_result.iter_window_aggregated_snapshots(
+                            snapshots, 3, 5, nr_jobs=nr_jobs)]
+            self.assertEqual(aggregated, expected)
+
+    def test_record_v4(self):
+        result, err = _damon_result.parse_damon_result(perf_script_file)
+        self.assertEqual(err, None)
+        expected = snapshots_to_list(result)
+
+        fd, tmp_path = tempfile.mkstemp()
+        os.close(fd)
+        for compression in ['zlib', 'lzma']:
+            # make multiple blocks
+            with unittest.mock.patch.object(_damon_result,
+                    'record_v4_block_size', 4096):
+                _damon_result.write_damon_record(result, tmp_path, 3, 0o600,
+                        compression)
+            self.assertTrue(os.path.getsize(tmp_path) * 5 <
+                    os.path.getsize(perf_script_file))
+            written, err = _damon_result.parse_damon_result(tmp_path)
+            self.assertEqual(err, None)
+            self.assertEqual(snapshots_to_list(written), expected)
+            snapshots = written.target_snapshots[expected[0][0]]
+            self.assertEqual(snapshot_to_list(snapshots[-100]),
+                    expected[-100])
+            self.assertTrue(len(snapshots.buf) > 1)
+
+            snapshots, err = _damon_result.iter_snapshots(tmp_path)
+            self.assertEqual(err, None)
+            self.assertEqual([snapshot_to_list(s) for s in snapshots],
+                    expected)
+
+            with open(tmp_path, 'rb') as f:
+                buf = f.read()
+            index = _damon_result.build_record_index(buf)
+            self.assertEqual(len(index), len(expected))
+            footer = _damon_result.read_record_v3_footer(
+                    buf[-_damon_result.record_v3_footer.size:], len(buf),
+                    _damon_result.record_v4_footer_mark)
+            walked = _damon_result.build_record_index(buf[:footer[0]])
+            self.assertEqual(
+                    [index.offsets, index.end_times, index.target_ids],
+                    [walked.offsets, walked.end_times, walked.target_ids])
+        os.remove(tmp_path)
+
+    def test_record_v5(self):
+        result, err = _damon_result.parse_damon_result(perf_script_file)
+        self.assertEqual(err, None)
+        expected = snapshots_to_list(result)
+
+        fd, tmp_path = tempfile.mkstemp()
+        os.close(fd)
+        for compression in [None, 'zlib']:
+            with unittest.mock.patch.object(_damon_result,
+                    'record_v4_block_size', 4096):
+                _damon_result.write_damon_record(result, tmp_path, 3, 0o600,
+                        compression, delta=True)
+            written, err = _damon_result.parse_damon_result(tmp_path)
+            self.assertEqual(err, None)
+            self.assertEqual(snapshots_to_list(written), expected)
+            # random accesses should decode from the last keyframe
+            snapshots = written.target_snapshots[expected[0][0]]
+            for idx in [-100, 3, -1, 2]:
+                self.assertEqual(snapshot_to_list(snapshots[idx]),
+                        expected[idx])
+
+            snapshots, err = _damon_result.iter_snapshots(tmp_path)
+            self.assertEqual(err, None)
+            self.assertEqual([snapshot_to_list(s) for s in snapshots],
+                    expected)
+
+            with open(tmp_path, 'rb') as f:
+                buf = f.read()
+            index = _damon_result.build_record_index(buf)
+            self.assertEqual(len(index), len(expected))
+            footer = _damon_result.read_record_v3_footer(
+                    buf[-_damon_result.record_v3_footer.size:], len(buf),
+                    _damon_result.record_v5_footer_mark)
+            walked = _damon_result.build_record_index(buf[:footer[0]])
+            self.assertEqual(
+                    [index.offsets, index.end_times, index.target_ids],
+                    [walked.offsets, walked.end_times, walked.target_ids])
+        os.remove(tmp_path)
+
+if __name__ == '__main__':
+    unittest.main()
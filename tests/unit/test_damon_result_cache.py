@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: GPL-2.0
+
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import _test_damo_common
+
+_test_damo_common.add_damo_dir_to_syspath()
+
+import _damon_result
+import _damon_result_cache
+
+bindir = os.path.dirname(os.path.realpath(__file__))
+report_dir = os.path.join(bindir, '..', 'report')
+
+def result_to_list(result):
+    return [result.start_time, result.end_time, result.nr_snapshots,
+            [[snapshot.target_id, snapshot.start_time, snapshot.end_time,
+                [[r.start, r.end, r.nr_accesses, r.age]
+                    for r in snapshot.regions]]
+                for snapshots in result.target_snapshots.values()
+                for snapshot in snapshots]]
+
+class TestDamonResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def copy_result_file(self, name):
+        path = os.path.join(self.tmp_dir, name)
+        shutil.copy(os.path.join(report_dir, name), path)
+        return path
+
+    def test_get_put(self):
+        cache = _damon_result_cache.ResultCache(self.cache_dir)
+        for name in ['damon.data', 'perf.data.script', 'perf.data']:
+            path = self.copy_result_file(name)
+            result, err = _damon_result.parse_damon_result(path)
+            self.assertEqual(err, None)
+            expected = result_to_list(result)
+
+            self.assertEqual(cache.get(path), None)
+            self.assertEqual(cache.put(path, result), None)
+            self.assertEqual(result_to_list(cache.get(path)), expected)
+
+            # the cache should be invalidated once the file is changed
+            with open(path, 'ab') as f:
+                f.write(b'\n')
+            os.utime(path, (0, 0))
+            self.assertEqual(cache.get(path), None)
+
+    def test_damo_upgrade(self):
+        cache = _damon_result_cache.ResultCache(self.cache_dir)
+        path = self.copy_result_file('damon.data')
+        result, err = _damon_result.parse_damon_result(path)
+        self.assertEqual(cache.put(path, result), None)
+        self.assertNotEqual(cache.get(path), None)
+        # caches made by other versions of damo should not be used
+        with unittest.mock.patch.object(_damon_result_cache, 'damo_version',
+                _damon_result_cache.damo_version + '.1'):
+            self.assertEqual(cache.get(path), None)
+
+    def test_evict(self):
+        paths = [self.copy_result_file(name)
+                for name in ['damon.data', 'perf.data.script']]
+        cache = _damon_result_cache.ResultCache(self.cache_dir)
+        for path in paths:
+            result, err = _damon_result.parse_damon_result(path)
+            cache.put(path, result)
+        os.utime(cache.cache_path(os.path.realpath(paths[0])), (0, 0))
+        self.assertNotEqual(cache.get(paths[1]), None)
+
+        cache.size_limit = os.path.getsize(
+                cache.cache_path(os.path.realpath(paths[1])))
+        cache.evict()
+        self.assertEqual(cache.get(paths[0]), None)
+        self.assertNotEqual(cache.get(paths[1]), None)
+
+if __name__ == '__main__':
+    unittest.main()